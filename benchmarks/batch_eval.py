@@ -0,0 +1,135 @@
+"""
+Benchmark LLStepData.evaluateBatch against a loop of
+LL.update_all_models, one call per row of parameters, and report the
+largest difference between their landmarks and nodes.
+
+Sets of K rows:
+    distinct    random pc weights, pelvis, hip and knee parameters per row
+    pelvis      one shape and pose, random pelvis parameters per row, as in
+                a population search over the pelvis pose
+    fd          forward differences of every parameter about one row, as
+                in a finite difference gradient
+
+Usage:
+    python benchmarks/batch_eval.py [--pcs N] [-k K] [--side left|right]
+        [--nodes]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+
+
+def makeConfig(side, pcs):
+    return {'side': side,
+            'registration_mode': 'shapemodel',
+            'pcs_to_fit': str(pcs),
+            'mweight': '0.1',
+            'knee_corr': 'False',
+            'knee_dof': 'False',
+            'landmarks': {},
+            }
+
+
+def atlasLandmarks(lldata):
+    """validModelLandmarks that the loaded atlas evaluates
+    """
+    return [l for l in llstep.validModelLandmarks
+            if l in lldata.LL.models[l.split('-')[0]].landmarks]
+
+
+def randomRows(rng, k, pcs):
+    return np.hstack([rng.normal(0.0, 1.0, (k, pcs)),
+                      rng.normal(0.0, 5.0, (k, 3)),
+                      rng.normal(0.0, 0.05, (k, 3)),
+                      rng.normal(0.0, 0.1, (k, 3)),
+                      np.abs(rng.normal(0.0, 0.2, (k, 1))),
+                      ])
+
+
+def makeRows(name, rng, k, pcs):
+    if name == 'distinct':
+        return randomRows(rng, k, pcs)
+    x = randomRows(rng, 1, pcs)
+    if name == 'pelvis':
+        X = np.repeat(x, k, axis=0)
+        X[:, pcs:pcs + 6] = randomRows(rng, k, pcs)[:, pcs:pcs + 6]
+        return X
+    if name == 'fd':
+        X = np.repeat(x, x.shape[1] + 1, axis=0)
+        X[1:] += 1e-4 * np.eye(x.shape[1])
+        return X
+    raise ValueError(name)
+
+
+def loop(lldata, X, nodes):
+    """update_all_models for each row of X
+    """
+    ll = lldata.LL
+    modes = lldata.T.shapeModes
+    nPCs = len(modes)
+    names = lldata.landmarkNames
+    L = np.zeros((len(X), len(names), 3))
+    boneNodes = dict((b, []) for b in ll.models) if nodes else None
+    for k, x in enumerate(X):
+        ll.update_all_models(x[:nPCs], modes, x[nPCs:nPCs + 6], x[nPCs + 6:nPCs + 9], x[nPCs + 9:])
+        for i, l in enumerate(names):
+            L[k, i] = ll.models[l.split('-')[0]].landmarks[l]
+        if nodes:
+            for b, m in ll.models.items():
+                boneNodes[b].append(m.gf.field_parameters[:, :, 0].T.copy())
+    return L, boneNodes
+
+
+def run(lldata, name, X, nodes):
+    t0 = time.time()
+    L0, nodes0 = loop(lldata, X, nodes)
+    loopWall = time.time() - t0
+    t0 = time.time()
+    out = lldata.evaluateBatch(X, nodes=nodes)
+    batchWall = time.time() - t0
+    L1, nodes1 = out if nodes else (out, None)
+    err = np.abs(L1 - L0).max()
+    if nodes:
+        err = max([err] + [np.abs(nodes1[b] - np.array(nodes0[b])).max() for b in nodes0])
+    return {'rows': name,
+            'k': len(X),
+            'loop': loopWall,
+            'batch': batchWall,
+            'speedup': loopWall / batchWall,
+            'maxError': err,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pcs', type=int, default=10, help='number of pcs')
+    parser.add_argument('-k', type=int, default=100, help='rows per set')
+    parser.add_argument('--side', default='left', choices=('left', 'right'))
+    parser.add_argument('--nodes', action='store_true', help='also evaluate and compare all nodes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    lldata = llstep.LLStepData(makeConfig(args.side, args.pcs))
+    lldata.loadData()
+    lldata.config['landmarks'] = dict((l, l) for l in atlasLandmarks(lldata))
+    lldata.updateFromConfig()
+    # build the evaluator outside the timings
+    rng = np.random.RandomState(args.seed)
+    lldata.evaluateBatch(randomRows(rng, 1, args.pcs))
+
+    results = [run(lldata, name, makeRows(name, rng, args.k, args.pcs), args.nodes)
+               for name in ('distinct', 'pelvis', 'fd')]
+
+    print('')
+    print('{:>10s} {:>6s} {:>10s} {:>10s} {:>8s} {:>12s}'.format(
+        'rows', 'K', 'loop (s)', 'batch (s)', 'speedup', 'max err (mm)'))
+    for r in results:
+        print('{:>10s} {:6d} {:10.3f} {:10.3f} {:7.1f}x {:12.2e}'.format(
+            r['rows'], r['k'], r['loop'], r['batch'], r['speedup'], r['maxError']))
+
+
+if __name__ == '__main__':
+    main()
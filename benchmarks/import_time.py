@@ -0,0 +1,161 @@
+"""
+Benchmark the import cost of the plugin's headless code paths, and check
+that they never import the GUI stack.
+
+Each target is run in its own spawned process, which first imports the
+target's baseline modules (not counted), then imports the target modules
+and runs its setup. For each target, reports the import wall time, the
+number of modules it added, peak RSS and any GUI modules (Qt, traits,
+pyface, mayavi, VTK) among them. Exits with status 1 if a headless target
+imported a GUI module. Results are written as JSON with --output.
+
+Targets:
+    llstep      import llstep, as batch registration workers do
+    step        import the step module, as MAP Client plugin discovery
+                does. Its baseline is mapclient's WorkflowStepMountPoint,
+                which is skipped if mapclient is not installed.
+    headless    import llstep and load the atlas, the GUI 'False'
+                execution path up to registration
+    dialog      import the registration dialog, for comparison. Not
+                headless.
+
+Usage:
+    python benchmarks/import_time.py [--targets llstep,step,headless,dialog]
+        [--side left|right] [--output results.json]
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PACKAGE = 'mapclientplugins.fieldworklowerlimbgenerationstep'
+GUI_MODULES = ('PySide2', 'PySide6', 'PyQt5', 'PyQt6', 'shiboken2', 'shiboken6',
+               'traits', 'traitsui', 'pyface', 'mayavi', 'tvtk', 'vtk', 'vtkmodules')
+
+# name: (baseline modules, target modules, headless)
+TARGETS = {'llstep': ((), (PACKAGE + '.llstep',), True),
+           'step': (('mapclient.mountpoints.workflowstep',), (PACKAGE + '.step',), True),
+           'headless': ((), (PACKAGE + '.llstep',), True),
+           'dialog': ((), (PACKAGE + '.lowerlimbgenerationdialog',), False),
+           }
+
+
+def peakRSS():
+    """Peak resident set size of this process in MB, or None if unknown
+    """
+    if resource is None:
+        return None
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        return maxRSS / 2.0 ** 20
+    return maxRSS / 2.0 ** 10
+
+
+def isGUIModule(name):
+    return name.split('.')[0] in GUI_MODULES
+
+
+def runTarget(name, side):
+    """Import target name in this process. Returns its import time, the
+    modules it added, the GUI modules among them and peak RSS, or the
+    error that stopped it.
+    """
+    baseline, modules, headless = TARGETS[name]
+    result = {'target': name, 'headless': headless, 'error': None}
+    try:
+        for m in baseline:
+            importlib.import_module(m)
+    except ImportError as e:
+        result['error'] = 'baseline not importable: {}'.format(e)
+        return result
+
+    before = set(sys.modules)
+    t0 = time.perf_counter()
+    try:
+        imported = [importlib.import_module(m) for m in modules]
+        importTime = time.perf_counter() - t0
+        if name == 'headless':
+            lldata = imported[0].LLStepData({'side': side})
+            lldata.loadData()
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        return result
+    result['setupTime'] = time.perf_counter() - t0 - importTime
+
+    added = sorted(set(sys.modules) - before)
+    result['importTime'] = importTime
+    result['modulesAdded'] = len(added)
+    result['guiModules'] = sorted(set(m.split('.')[0] for m in added if isGUIModule(m)))
+    result['peakRSS'] = peakRSS()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', default=','.join(TARGETS), help='comma-separated targets')
+    parser.add_argument('--side', default='left', choices=('left', 'right'))
+    parser.add_argument('--output', help='write JSON results to this file, - for stdout')
+    args = parser.parse_args()
+
+    targets = [t.strip() for t in args.targets.split(',') if t.strip()]
+    for t in targets:
+        if t not in TARGETS:
+            parser.error('unknown target {}'.format(t))
+
+    results = []
+    for t in targets:
+        # a new, spawned process per target so that nothing is imported yet
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results.append(executor.submit(runTarget, t, args.side).result())
+
+    failed = [r['target'] for r in results if r['headless'] and r.get('guiModules')]
+    summary = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'results': results,
+               'headlessImportsGUI': failed,
+               }
+
+    if args.output == '-':
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(summary, f, indent=2)
+
+        print('')
+        print('{:>10s} {:>10s} {:>10s} {:>8s} {:>10s}  {}'.format(
+            'target', 'import (s)', 'setup (s)', 'modules', 'rss (MB)', 'gui modules'))
+        for r in results:
+            if r['error'] is not None:
+                print('{:>10s}  skipped, {}'.format(r['target'], r['error']))
+                continue
+            rss = r['peakRSS']
+            print('{:>10s} {:10.3f} {:10.3f} {:8d} {:>10s}  {}'.format(
+                r['target'],
+                r['importTime'],
+                r['setupTime'],
+                r['modulesAdded'],
+                'n/a' if rss is None else '{:.0f}'.format(rss),
+                ', '.join(r['guiModules']) or '-',
+            ))
+        if failed:
+            print('headless targets imported GUI modules: {}'.format(', '.join(failed)))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
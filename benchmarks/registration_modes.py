@@ -0,0 +1,192 @@
+"""
+Benchmark LLStepData.register in the shapemodel, uniformscaling and
+perbonescaling registration modes.
+
+Target landmarks are generated from the atlas at randomly sampled shape
+mode weights and poses. Each mode is run in its own spawned process,
+which loads the atlas and registers every target in turn, so that the
+peak RSS reported for a mode is that of the process that ran it. Runs
+headless.
+
+For each mode and target, reports wall time, objective evaluations
+(scipy nfev), optimiser iterations and final landmark RMSE. Results are
+written as JSON with --output.
+
+Usage:
+    python benchmarks/registration_modes.py [--targets N] [--pcs N]
+        [--modes shapemodel,uniformscaling,perbonescaling]
+        [--side left|right] [--seed N] [--output results.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+
+MODES = ('shapemodel', 'uniformscaling', 'perbonescaling')
+
+
+def makeConfig(side, mode, pcs, landmarks):
+    return {'side': side,
+            'registration_mode': mode,
+            'pcs_to_fit': str(pcs),
+            'mweight': '0.1',
+            'knee_corr': 'False',
+            'knee_dof': 'False',
+            'landmarks': dict((l, l) for l in landmarks),
+            }
+
+
+def atlasLandmarks(lldata):
+    """validModelLandmarks that the loaded atlas evaluates
+    """
+    return [l for l in llstep.validModelLandmarks
+            if l in lldata.LL.models[l.split('-')[0]].landmarks]
+
+
+def makeTargets(lldata, nTargets, pcs, seed=0):
+    """Landmark dicts of the atlas at nTargets random shape mode weights
+    and poses
+    """
+    rng = np.random.RandomState(seed)
+    landmarkNames = atlasLandmarks(lldata)
+    targets = []
+    for i in range(nTargets):
+        lldata.LL.update_all_models(
+            rng.normal(0.0, 1.0, pcs),
+            np.arange(pcs),
+            np.hstack([rng.normal(0.0, 5.0, 3), rng.normal(0.0, 0.05, 3)]),
+            rng.normal(0.0, 0.1, 3),
+            [abs(rng.normal(0.0, 0.2)), ],
+        )
+        targets.append(dict(
+            (l, np.array(lldata.LL.models[l.split('-')[0]].landmarks[l])) for l in landmarkNames
+        ))
+    lldata.resetLL()
+    return targets
+
+
+def peakRSS():
+    """Peak resident set size of this process in MB, or None if unknown
+    """
+    if resource is None:
+        return None
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        return maxRSS / 2.0 ** 20
+    return maxRSS / 2.0 ** 10
+
+
+def runMode(config, targets, verbose=False):
+    """Register each target with config in this process. Returns the atlas
+    load time, per-target results and peak RSS.
+    """
+    stdout = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with stdout:
+        t0 = time.time()
+        lldata = llstep.LLStepData(config)
+        lldata.loadData()
+        loadTime = time.time() - t0
+
+        results = []
+        for i, landmarks in enumerate(targets):
+            lldata.resetLL()
+            lldata.inputLandmarks = landmarks
+            t0 = time.time()
+            xFitted, dist, rmse, info = lldata.register()
+            wall = time.time() - t0
+            res = info['min_results']
+            results.append({'target': i,
+                            'wall': wall,
+                            'nfev': int(res['nfev']),
+                            'nit': int(res['nit']),
+                            'rmse': float(rmse),
+                            })
+
+    return {'loadTime': loadTime, 'targets': results, 'peakRSS': peakRSS()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', type=int, default=3, help='number of synthetic landmark sets')
+    parser.add_argument('--pcs', type=int, default=4, help='number of pcs to sample and to fit')
+    parser.add_argument('--modes', default=','.join(MODES), help='comma-separated registration modes')
+    parser.add_argument('--side', default='left', choices=('left', 'right'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON results to this file, - for stdout')
+    parser.add_argument('--verbose', action='store_true', help='show registration output')
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error('unknown registration mode {}'.format(mode))
+
+    lldata = llstep.LLStepData(makeConfig(args.side, 'shapemodel', args.pcs, ()))
+    lldata.loadData()
+    landmarkNames = atlasLandmarks(lldata)
+    targets = makeTargets(lldata, args.targets, args.pcs, args.seed)
+
+    results = []
+    for mode in modes:
+        config = makeConfig(args.side, mode, args.pcs, landmarkNames)
+        # a new, spawned process per mode so that peak RSS is per mode
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            r = executor.submit(runMode, config, targets, args.verbose).result()
+        r['mode'] = mode
+        results.append(r)
+
+    summary = {'python': platform.python_version(),
+               'numpy': np.__version__,
+               'scipy': scipy.__version__,
+               'platform': platform.platform(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'side': args.side,
+               'pcs': args.pcs,
+               'seed': args.seed,
+               'landmarks': landmarkNames,
+               'results': results,
+               }
+
+    if args.output == '-':
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    print('')
+    print('{:>16s} {:>10s} {:>8s} {:>6s} {:>10s} {:>10s}'.format(
+        'mode', 'wall (s)', 'nfev', 'nit', 'rmse', 'rss (MB)'))
+    for r in results:
+        t = r['targets']
+        rss = r['peakRSS']
+        print('{:>16s} {:10.2f} {:8.0f} {:6.0f} {:10.4f} {:>10s}'.format(
+            r['mode'],
+            np.mean([x['wall'] for x in t]),
+            np.mean([x['nfev'] for x in t]),
+            np.mean([x['nit'] for x in t]),
+            np.mean([x['rmse'] for x in t]),
+            'n/a' if rss is None else '{:.0f}'.format(rss),
+        ))
+    print('means over {} targets'.format(args.targets))
+
+
+if __name__ == '__main__':
+    main()
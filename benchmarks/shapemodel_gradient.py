@@ -0,0 +1,93 @@
+"""
+Benchmark shape model registration with finite difference gradients
+(minArgs['jac'] = False) against the shapemodelfit gradient
+(minArgs['jac'] = 'analytic').
+
+Target landmarks are generated from the atlas at known parameters.
+
+Usage:
+    python benchmarks/shapemodel_gradient.py [--pcs N] [--side left|right]
+"""
+import argparse
+import copy
+import time
+
+import numpy as np
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+
+
+def makeConfig(side, pcs):
+    return {'side': side,
+            'registration_mode': 'shapemodel',
+            'pcs_to_fit': str(pcs),
+            'mweight': '0.1',
+            'knee_corr': 'False',
+            'knee_dof': 'False',
+            'landmarks': {},
+            }
+
+
+def atlasLandmarks(lldata):
+    """validModelLandmarks that the loaded atlas evaluates
+    """
+    return [l for l in llstep.validModelLandmarks
+            if l in lldata.LL.models[l.split('-')[0]].landmarks]
+
+
+def makeTargetLandmarks(lldata, pcs, seed=0):
+    rng = np.random.RandomState(seed)
+    lldata.LL.update_all_models(
+        rng.normal(0.0, 0.5, pcs),
+        np.arange(pcs),
+        np.hstack([rng.normal(0.0, 5.0, 3), rng.normal(0.0, 0.05, 3)]),
+        rng.normal(0.0, 0.1, 3),
+        [abs(rng.normal(0.0, 0.2)), ],
+    )
+    landmarks = dict((l, np.array(lldata.LL.models[l.split('-')[0]].landmarks[l])) for l in atlasLandmarks(lldata))
+    lldata.resetLL()
+    return landmarks
+
+
+def run(lldata, jac):
+    lldata.resetLL()
+    lldata.minArgs = copy.deepcopy(llstep.LLStepData.minArgs)
+    lldata.minArgs['jac'] = jac
+    t0 = time.time()
+    xFitted, dist, rmse, info = lldata.register()
+    wall = time.time() - t0
+    res = info['min_results']
+    return {'jac': jac,
+            'wall': wall,
+            'nit': res['nit'],
+            'nfev': res['nfev'],
+            'its_per_s': res['nit'] / wall,
+            'rmse': rmse,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pcs', type=int, default=10, help='number of pcs to fit')
+    parser.add_argument('--side', default='left', choices=('left', 'right'))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    lldata = llstep.LLStepData(makeConfig(args.side, args.pcs))
+    lldata.loadData()
+    lldata.config['landmarks'] = dict((l, l) for l in atlasLandmarks(lldata))
+    lldata.updateFromConfig()
+    lldata.inputLandmarks = makeTargetLandmarks(lldata, args.pcs, args.seed)
+
+    results = [run(lldata, False), run(lldata, 'analytic')]
+
+    print('')
+    print('{:>10s} {:>10s} {:>6s} {:>7s} {:>8s} {:>10s}'.format('jac', 'wall (s)', 'nit', 'nfev', 'it/s', 'rmse'))
+    for r in results:
+        print('{:>10s} {:10.2f} {:6d} {:7d} {:8.3f} {:10.4f}'.format(
+            str(r['jac']), r['wall'], r['nit'], r['nfev'], r['its_per_s'], r['rmse']))
+    print('speedup (it/s): {:.2f}x'.format(results[1]['its_per_s'] / results[0]['its_per_s']))
+
+
+if __name__ == '__main__':
+    main()
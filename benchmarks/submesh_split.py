@@ -0,0 +1,83 @@
+"""
+Benchmark splitting the pelvis and tibia-fibula fields into submeshes with
+makeGFFromElements against precomputed submesh node maps.
+
+Usage:
+    python benchmarks/submesh_split.py [--repeats N] [--side left|right]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+from mapclientplugins.fieldworklowerlimbgenerationstep.submeshmap import submeshMapCache
+
+SUBMESHES = (
+    ('pelvis', 'hemipelvis-left', llstep.PELVIS_SUBMESH_ELEMS['LH'], llstep.PELVIS_BASISTYPES),
+    ('pelvis', 'sacrum', llstep.PELVIS_SUBMESH_ELEMS['sac'], llstep.PELVIS_BASISTYPES),
+    ('pelvis', 'hemipelvis-right', llstep.PELVIS_SUBMESH_ELEMS['RH'], llstep.PELVIS_BASISTYPES),
+    ('tibiafibula', 'tibia', llstep.TIBFIB_SUBMESH_ELEMS['tibia'], llstep.TIBFIB_BASISTYPES),
+    ('tibiafibula', 'fibula', llstep.TIBFIB_SUBMESH_ELEMS['fibula'], llstep.TIBFIB_BASISTYPES),
+)
+
+
+def makeConfig(side):
+    return {'side': side,
+            'registration_mode': 'shapemodel',
+            'pcs_to_fit': '1',
+            'mweight': '0.1',
+            'knee_corr': 'False',
+            'knee_dof': 'False',
+            'landmarks': {},
+            }
+
+
+def splitWithElements(lldata):
+    for bone, name, elements, basisTypes in SUBMESHES:
+        lldata.LL.models[bone].gf.makeGFFromElements(name, elements, basisTypes)
+
+
+def splitWithMaps(lldata):
+    for bone, name, elements, basisTypes in SUBMESHES:
+        lldata._makeSubmeshGF(bone, name, elements, basisTypes)
+
+
+def timeSplit(lldata, split, repeats, seed=0):
+    rng = np.random.RandomState(seed)
+    times = []
+    for i in range(repeats):
+        lldata.LL.update_all_models(rng.normal(0.0, 1.0, 1), [0, ], np.zeros(6), np.zeros(3), [0.0, ])
+        t0 = time.time()
+        split(lldata)
+        times.append(time.time() - t0)
+    return np.array(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=10, help='number of splits to time')
+    parser.add_argument('--side', default='left', choices=('left', 'right'))
+    args = parser.parse_args()
+
+    lldata = llstep.LLStepData(makeConfig(args.side))
+    lldata.loadData()
+
+    submeshMapCache.clear()
+    t0 = time.time()
+    splitWithMaps(lldata)
+    buildTime = time.time() - t0
+
+    before = timeSplit(lldata, splitWithElements, args.repeats)
+    after = timeSplit(lldata, splitWithMaps, args.repeats)
+
+    print('')
+    print('one-off map build: {:.3f} s'.format(buildTime))
+    print('{:>24s} {:>12s} {:>12s}'.format('per split (5 submeshes)', 'mean (ms)', 'min (ms)'))
+    print('{:>24s} {:12.2f} {:12.2f}'.format('makeGFFromElements', before.mean() * 1e3, before.min() * 1e3))
+    print('{:>24s} {:12.2f} {:12.2f}'.format('submesh maps', after.mean() * 1e3, after.min() * 1e3))
+    print('speedup: {:.0f}x'.format(before.mean() / after.mean()))
+
+
+if __name__ == '__main__':
+    main()
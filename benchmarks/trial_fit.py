@@ -0,0 +1,141 @@
+"""
+Benchmark LLStepData.registerTrial on a synthetic motion capture trial.
+
+The frames are generated lazily from the atlas at known shape model
+weights, walking forward with sinusoidal pelvis, hip and knee motion. The
+shape is registered to the first frame, then each frame's pose is fitted
+from the previous one. Reports the shape registration time and RMSE,
+frames per second, mean objective evaluations, landmark RMSE and joint angle errors,
+and peak RSS after the first and last frames, which should not grow with
+the number of frames.
+
+Usage:
+    python benchmarks/trial_fit.py [--frames N] [--pcs N] [--noise MM]
+        [--side left|right]
+"""
+import argparse
+import copy
+import itertools
+import sys
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import landmarkmodel
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+
+
+def makeConfig(side, pcs):
+    return {'side': side,
+            'registration_mode': 'shapemodel',
+            'pcs_to_fit': str(pcs),
+            'mweight': '0.1',
+            'knee_corr': 'False',
+            'knee_dof': 'False',
+            'landmarks': {},
+            }
+
+
+def atlasLandmarks(lldata):
+    """validModelLandmarks that the loaded atlas evaluates
+    """
+    return [l for l in llstep.validModelLandmarks
+            if l in lldata.LL.models[l.split('-')[0]].landmarks]
+
+
+def peakRSS():
+    """Peak resident set size of this process in MB, or None if unknown
+    """
+    if resource is None:
+        return None
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxRSS / 2.0 ** 20
+    return maxRSS / 2.0 ** 10
+
+
+def framePose(i, rate=100.0):
+    """Pelvis rigid, hip rot and knee rot of frame i of a 1 Hz gait cycle
+    walking at 1.2 m/s
+    """
+    phase = 2.0 * np.pi * i / rate
+    pelvisRigid = np.array([1200.0 * i / rate, 0.0, 10.0 * np.sin(2.0 * phase),
+                            0.05 * np.sin(phase), 0.03 * np.cos(phase), 0.0])
+    hipRot = np.array([0.4 * np.sin(phase), 0.05 * np.sin(phase), 0.05 * np.cos(phase)])
+    kneeRot = np.array([0.5 + 0.5 * np.sin(phase - 1.0)])
+    return pelvisRigid, hipRot, kneeRot
+
+
+def makeFrames(lldata, weights, nFrames, noise, poses, seed=0):
+    """Generate the landmark dicts of each frame, recording its pose in
+    poses
+    """
+    rng = np.random.RandomState(seed)
+    atlas = landmarkmodel.makeLandmarkAtlas(lldata.LL)
+    modes = np.arange(len(weights))
+    for i in range(nFrames):
+        pose = framePose(i)
+        poses.append(pose)
+        atlas.update_all_models(weights, modes, *pose)
+        yield dict((l, np.array(atlas.models[l.split('-')[0]].landmarks[l]) + rng.normal(0.0, noise, 3))
+                   for l in lldata.landmarkNames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=500)
+    parser.add_argument('--pcs', type=int, default=3, help='number of pcs to fit')
+    parser.add_argument('--noise', type=float, default=0.0, help='landmark noise sd in mm')
+    parser.add_argument('--side', default='left', choices=('left', 'right'))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    lldata = llstep.LLStepData(makeConfig(args.side, args.pcs))
+    lldata.loadData()
+    lldata.config['landmarks'] = dict((l, l) for l in atlasLandmarks(lldata))
+    lldata.updateFromConfig()
+    lldata.minArgs = copy.deepcopy(llstep.LLStepData.minArgs)
+    lldata.minArgs['jac'] = 'analytic'
+    weights = np.random.RandomState(args.seed).normal(0.0, 0.5, args.pcs)
+
+    poses = []
+    trial = lldata.registerTrial(makeFrames(lldata, weights, args.frames, args.noise, poses, args.seed))
+    t0 = time.time()
+    results = [next(trial)]
+    shapeTime = time.time() - t0
+    firstRSS = peakRSS()
+
+    nfev = []
+    rmse = []
+    hipErr = []
+    kneeErr = []
+    t0 = time.time()
+    for r in itertools.chain(results, trial):
+        pelvisRigid, hipRot, kneeRot = poses[r['frame']]
+        nfev.append(r['nfev'])
+        rmse.append(r['landmarkRMSE'])
+        hipErr.append(np.abs(r['hipRot'] - hipRot).max())
+        kneeErr.append(np.abs(r['kneeRot'] - kneeRot).max())
+    frameTime = time.time() - t0
+    lastRSS = peakRSS()
+
+    print('')
+    print('shape registration    {:.2f} s, rmse {:.4f} mm'.format(shapeTime, lldata.landmarkRMSE))
+    print('frames                {:d} in {:.2f} s, {:.1f} frames/s'.format(
+        args.frames, frameTime, (args.frames - 1) / frameTime))
+    print('evaluations per frame {:.1f} mean, {:d} max (first frame {:d})'.format(
+        np.mean(nfev[1:]), int(np.max(nfev[1:])), nfev[0]))
+    print('landmark rmse (mm)    {:.4f} mean, {:.4f} max'.format(np.mean(rmse), np.max(rmse)))
+    print('hip angle error (rad) {:.2e} max'.format(np.max(hipErr)))
+    print('knee angle error (rad){:.2e} max'.format(np.max(kneeErr)))
+    if firstRSS is not None:
+        print('peak rss (MB)         {:.0f} after first frame, {:.0f} after last'.format(firstRSS, lastRSS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark the trialstore writer and reader with frames the size of
+LLStepData.writeTrial output with nodes: the pose arrays and the node
+coordinates of each bone of the atlas, filled with random values.
+
+Reports write throughput and peak RSS growth while writing, which should
+not depend on the number of frames, and the time to read a frame range
+within one shard and across shards.
+
+Usage:
+    python benchmarks/trial_store.py [--frames N] [--chunk N]
+        [--side left|right] [--dir DIR]
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+from mapclientplugins.fieldworklowerlimbgenerationstep import trialstore
+
+
+def peakRSS():
+    """Peak resident set size of this process in MB, or None if unknown
+    """
+    if resource is None:
+        return None
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxRSS / 2.0 ** 20
+    return maxRSS / 2.0 ** 10
+
+
+def makeFrame(rng, nNodes, nLandmarks):
+    frame = {'pelvisRigid': rng.normal(size=6),
+             'hipRot': rng.normal(size=3),
+             'kneeRot': rng.normal(size=1),
+             'landmarkErrors': rng.normal(size=nLandmarks),
+             'landmarkRMSE': rng.normal(),
+             }
+    for name, n in nNodes.items():
+        frame['nodes_' + name] = rng.normal(size=(n, 3))
+    return frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=5000)
+    parser.add_argument('--chunk', type=int, default=trialstore.DEFAULT_CHUNK_FRAMES, help='frames per shard')
+    parser.add_argument('--side', default='left', choices=('left', 'right'))
+    parser.add_argument('--dir', help='store directory, a temporary directory if not given')
+    args = parser.parse_args()
+
+    lldata = llstep.LLStepData({'side': args.side})
+    lldata.loadData()
+    nNodes = dict((name, m.gf.field_parameters.shape[1]) for name, m in lldata.LL.models.items())
+    del lldata
+
+    directory = args.dir or tempfile.mkdtemp(prefix='trialstore_')
+    rng = np.random.RandomState(0)
+    # frames are generated from a few templates so that generating them
+    # does not dominate the timing
+    templates = [makeFrame(rng, nNodes, 7) for i in range(8)]
+    frameBytes = sum(np.asarray(v).nbytes for v in templates[0].values())
+
+    try:
+        startRSS = peakRSS()
+        t0 = time.time()
+        with trialstore.TrialWriter(directory, args.chunk) as writer:
+            for i in range(args.frames):
+                writer.append(templates[i % len(templates)])
+        writeWall = time.time() - t0
+        endRSS = peakRSS()
+
+        reader = trialstore.TrialReader(directory)
+        ranges = {'within shard': (args.chunk // 4, args.chunk // 4 + args.chunk // 2),
+                  'across shards': (max(0, args.frames // 2 - args.chunk), args.frames // 2 + args.chunk),
+                  }
+        print('')
+        print('frames                {:d} of {:.2f} MB, {:d} per shard'.format(
+            args.frames, frameBytes / 2.0 ** 20, args.chunk))
+        print('write                 {:.2f} s, {:.0f} frames/s, {:.0f} MB/s'.format(
+            writeWall, args.frames / writeWall, args.frames * frameBytes / 2.0 ** 20 / writeWall))
+        if startRSS is not None:
+            print('peak rss growth (MB)  {:.0f}'.format(endRSS - startRSS))
+        for label, (start, stop) in ranges.items():
+            t0 = time.time()
+            nodes = reader.read('nodes_pelvis', start, stop)
+            # touch every value so that mapped pages are read
+            np.asarray(nodes).sum()
+            wall = time.time() - t0
+            print('read {:<16s} frames {:d}-{:d} of nodes_pelvis in {:.4f} s'.format(label, start, stop, wall))
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+"""
+Compact binary bundles of the atlas bone meshes.
+
+Each bone's .geof/.ens/.mesh triple is converted once into a directory of
+.npy arrays plus a small JSON header. Bundles are memory-mapped on load
+instead of parsing the verbose JSON text files, and the element to ensemble
+point mapping is stored so that it does not have to be regenerated from the
+connectivity. The header records the size and modification time of each
+source file, and a bundle whose sources have changed since it was written
+is ignored.
+
+Usage:
+    python -m mapclientplugins.fieldworklowerlimbgenerationstep.atlasbundle [bundle_root]
+"""
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+from gias3.fieldwork.field import ensemble_field_function as EFF
+from gias3.fieldwork.field import geometric_field
+from gias3.fieldwork.field.topology import element_types
+from gias3.fieldwork.field.topology import mesh
+from gias3.musculoskeletal.bonemodels import bonemodels
+
+log = logging.getLogger(__name__)
+
+BUNDLE_VERSION = 2
+HEADER_FILENAME = 'header.json'
+BUNDLE_ARRAYS = (
+    'field_parameters',
+    'element_numbers',
+    'connectivity_keys',
+    'connectivity_offsets',
+    'connectivity_values',
+    'custom_map',
+    'ensemble_map',
+)
+
+
+def _splitPair(s):
+    a, b = s.split('_')
+    return int(a), int(b)
+
+
+def bundleDirectory(bundleRoot, gfFilename):
+    """Directory of the bundle for a .geof file under bundleRoot
+    """
+    return os.path.join(
+        bundleRoot, os.path.splitext(os.path.basename(gfFilename))[0]
+    )
+
+
+def bundleFilenames(bundleDir):
+    """The files of the bundle in bundleDir, whether or not they exist
+    """
+    return [os.path.join(bundleDir, name + '.npy') for name in BUNDLE_ARRAYS] + \
+           [os.path.join(bundleDir, HEADER_FILENAME)]
+
+
+def sourceStats(filenames):
+    """Basename, size and modification time of each source file, as
+    recorded in bundle headers
+    """
+    stats = []
+    for f in filenames:
+        st = os.stat(f)
+        stats.append({'name': os.path.basename(f),
+                      'size': st.st_size,
+                      'mtime_ns': st.st_mtime_ns,
+                      })
+    return stats
+
+
+def writeBundle(gfFilename, ensFilename, meshFilename, bundleDir):
+    """Convert a .geof/.ens/.mesh triple into a bundle in bundleDir
+    """
+    with open(gfFilename, 'r') as f:
+        gfDict = json.load(f)
+    with open(ensFilename, 'r') as f:
+        ensDict = json.load(f)
+    with open(meshFilename, 'r') as f:
+        meshDict = json.load(f)
+
+    if ensDict['subfields']:
+        raise ValueError('Ensemble fields with subfields are not supported')
+
+    # field parameters, in node order
+    nodeKeys = sorted(gfDict['field_parameters'].keys())
+    dimKeys = sorted(gfDict['field_parameters'][nodeKeys[0]].keys())
+    fieldParameters = np.array([
+        [[float(x) for x in gfDict['field_parameters'][nk][dk].split(' ')] for nk in nodeKeys]
+        for dk in dimKeys
+    ])
+
+    # elements, keeping the file order
+    elementNumbers = []
+    elementTypes = []
+    for en, e in meshDict['elements'].items():
+        isSubmesh, etype = e.split(' ')
+        if int(isSubmesh) != 0:
+            raise ValueError('Meshes with submeshes are not supported')
+        elementNumbers.append(int(en))
+        elementTypes.append(etype)
+
+    # connectivity as keys plus offsets into a flat array of values
+    connKeys = []
+    connOffsets = [0]
+    connValues = []
+    for k, v in meshDict['connectivity'].items():
+        if _splitPair(k)[0] == -1:
+            raise ValueError('Meshes with hanging points are not supported')
+        connKeys.append(_splitPair(k))
+        connValues.extend(_splitPair(vi) for vi in v.split())
+        connOffsets.append(len(connValues))
+
+    if ensDict['custom_map'] is None:
+        customMap = np.zeros((0, 2), dtype=np.int64)
+    else:
+        customMap = np.array(
+            [(int(k), int(v)) for k, v in ensDict['custom_map'].items()],
+            dtype=np.int64,
+        ).reshape((-1, 2))
+
+    # (element, element point, ensemble point) in the mapper's order
+    gf = geometric_field.load_geometric_field(gfFilename, ensFilename, meshFilename)
+    mapper = gf.ensemble_field_function.mapper
+    ensembleMap = []
+    for gp in range(mapper.get_number_of_ensemble_points()):
+        for e, points in mapper._ensemble_to_element_map[gp].items():
+            for p in points:
+                ensembleMap.append((e, p, gp))
+
+    arrays = {
+        'field_parameters': fieldParameters,
+        'element_numbers': np.array(elementNumbers, dtype=np.int64),
+        'connectivity_keys': np.array(connKeys, dtype=np.int64).reshape((-1, 2)),
+        'connectivity_offsets': np.array(connOffsets, dtype=np.int64),
+        'connectivity_values': np.array(connValues, dtype=np.int64).reshape((-1, 2)),
+        'custom_map': customMap,
+        'ensemble_map': np.array(ensembleMap, dtype=np.int64).reshape((-1, 3)),
+    }
+
+    header = {
+        'version': BUNDLE_VERSION,
+        'sources': sourceStats([gfFilename, ensFilename, meshFilename]),
+        'gf': {'name': gfDict['name'],
+               'dimensions': int(gfDict['dimensions']),
+               'ensemble_point_counter': int(gfDict['ensemble_point_counter']),
+               },
+        'ens': {'name': ensDict['name'],
+                'dimensions': int(ensDict['dimensions']),
+                'subfield_counter': int(ensDict['subfield_counter']),
+                'basis': ensDict['basis'],
+                'has_custom_map': ensDict['custom_map'] is not None,
+                },
+        'mesh': {'name': meshDict['name'],
+                 'dimensions': int(meshDict['dimensions']),
+                 'number_of_points': int(meshDict['number_of_points']),
+                 'number_of_ensemble_points': mapper.get_number_of_ensemble_points(),
+                 'submesh_counter': int(meshDict['submesh_counter']),
+                 'element_types': elementTypes,
+                 },
+    }
+
+    if not os.path.isdir(bundleDir):
+        os.makedirs(bundleDir)
+    for name in BUNDLE_ARRAYS:
+        np.save(os.path.join(bundleDir, name + '.npy'), arrays[name])
+    # header is written last so that a partial bundle is never used
+    with open(os.path.join(bundleDir, HEADER_FILENAME), 'w') as f:
+        json.dump(header, f, indent=4, sort_keys=True)
+
+    return bundleDir
+
+
+def readBundleHeader(bundleDir):
+    """Returns the bundle header, or None if there is no valid bundle in
+    bundleDir
+    """
+    try:
+        with open(os.path.join(bundleDir, HEADER_FILENAME), 'r') as f:
+            header = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    if header.get('version') != BUNDLE_VERSION:
+        return None
+    return header
+
+
+def _setMapping(eff, nEnsemblePoints, ensembleMap):
+    """Set the mapper state that EnsembleFieldFunction.map_parameters
+    would generate from the mesh connectivity
+    """
+    mapper = eff.mapper
+    mapper.field = eff
+    mapper.number_of_ensemble_points = nEnsemblePoints
+    mapper._ensemble_to_element_map = dict((i, {}) for i in range(nEnsemblePoints))
+    mapper._element_to_ensemble_map = {}
+    for en in sorted(eff.mesh.elements.keys()):
+        nPoints = eff.mesh.elements[en].get_number_of_ensemble_points()
+        mapper._element_to_ensemble_map[en] = dict((j, ([], [])) for j in range(nPoints))
+
+    for e, p, gp in ensembleMap.tolist():
+        try:
+            mapper._ensemble_to_element_map[gp][e][p] = 1.0
+        except KeyError:
+            mapper._ensemble_to_element_map[gp][e] = {p: 1.0}
+        mapper._element_to_ensemble_map[e][p][0].append(gp)
+        mapper._element_to_ensemble_map[e][p][1].append(1.0)
+
+
+def loadBundle(bundleDir, header=None):
+    """Load a geometric field from a bundle. Arrays are memory-mapped
+    read-only; the field parameters are copied into the geometric field.
+    """
+    if header is None:
+        header = readBundleHeader(bundleDir)
+        if header is None:
+            raise IOError('No valid atlas bundle in {}'.format(bundleDir))
+
+    arrays = dict(
+        (name, np.load(os.path.join(bundleDir, name + '.npy'), mmap_mode='r'))
+        for name in BUNDLE_ARRAYS
+    )
+
+    # mesh
+    meshHeader = header['mesh']
+    m = mesh.MeshEnsemble(None, None)
+    m.name = meshHeader['name']
+    m.dimensions = meshHeader['dimensions']
+    m.number_of_points = meshHeader['number_of_points']
+    m.submesh_counter = meshHeader['submesh_counter']
+    for en, etype in zip(arrays['element_numbers'].tolist(), meshHeader['element_types']):
+        elem = element_types.create_element(etype)
+        m.elements[en] = elem
+        m.element_points[en] = [(en, i) for i in range(elem.get_number_of_ensemble_points())]
+    m.element_counter = max(m.elements.keys()) + 1
+
+    connValues = [tuple(v) for v in arrays['connectivity_values'].tolist()]
+    connOffsets = arrays['connectivity_offsets'].tolist()
+    for ki, k in enumerate(arrays['connectivity_keys'].tolist()):
+        m.connectivity[tuple(k)] = connValues[connOffsets[ki]:connOffsets[ki + 1]]
+
+    # ensemble field function
+    ensHeader = header['ens']
+    eff = EFF.EnsembleFieldFunction(None, None)
+    eff.name = ensHeader['name']
+    eff.dimensions = ensHeader['dimensions']
+    eff.subfield_counter = ensHeader['subfield_counter']
+    eff.set_basis(dict((str(k), v) for k, v in ensHeader['basis'].items()))
+    eff.mesh = m
+    _setMapping(eff, meshHeader['number_of_ensemble_points'], arrays['ensemble_map'])
+    if ensHeader['has_custom_map']:
+        eff.mapper.set_custom_ensemble_ordering(
+            dict((k, v) for k, v in arrays['custom_map'].tolist())
+        )
+
+    # geometric field
+    gfHeader = header['gf']
+    gf = geometric_field.GeometricField('none', 1)
+    gf.name = gfHeader['name']
+    gf.dimensions = gfHeader['dimensions']
+    gf.ensemble_point_counter = gfHeader['ensemble_point_counter']
+    gf.ensemble_field_function = eff
+    gf.triangulator.f = eff
+    gf.create_ensemble_points()
+    gf.set_field_parameters(np.array(arrays['field_parameters']))
+
+    return gf
+
+
+def loadGeometricField(gfFilename, ensFilename, meshFilename, bundleRoot=None):
+    """Load a geometric field from its bundle under bundleRoot if one exists
+    for the same, unchanged, source files, else from the text files.
+    """
+    if bundleRoot is not None:
+        bundleDir = bundleDirectory(bundleRoot, gfFilename)
+        header = readBundleHeader(bundleDir)
+        if header is not None:
+            if header['sources'] == sourceStats([gfFilename, ensFilename, meshFilename]):
+                return loadBundle(bundleDir, header)
+            log.warning('atlas bundle %s is out of date, loading %s', bundleDir, gfFilename)
+
+    return geometric_field.load_geometric_field(gfFilename, ensFilename, meshFilename)
+
+
+def convertAtlas(boneFiles, bundleRoot):
+    """Write a bundle under bundleRoot for each bone in boneFiles, a dict of
+    bone name : (geof, ens, mesh) filenames
+    """
+    bundleDirs = {}
+    for bn, (gfFilename, ensFilename, meshFilename) in sorted(boneFiles.items()):
+        bundleDirs[bn] = writeBundle(
+            gfFilename, ensFilename, meshFilename,
+            bundleDirectory(bundleRoot, gfFilename),
+        )
+    return bundleDirs
+
+
+class BundledAtlasMixin(object):
+    """
+    Mixin for MultiBoneAtlas subclasses that loads bone models from
+    bundles under bundle_root when available.
+    """
+    bundle_root = None
+
+    def load_models(self, model_names, model_classes, model_filenames,
+                    combined_gf_name=None, combined_ens_name=None,
+                    combined_mesh_name=None):
+        if combined_gf_name is None:
+            combined_gf_name = self.name
+        if combined_ens_name is None:
+            combined_ens_name = self.name
+        if combined_mesh_name is None:
+            combined_mesh_name = self.name
+
+        self.combined_model_gf = geometric_field.GeometricField(
+            combined_gf_name, 3, field_dimensions=2,
+            field_basis=self.combined_model_field_basis
+        )
+        self.combined_model_gf.ensemble_field_function.name = combined_ens_name
+        self.combined_model_gf.ensemble_field_function.mesh.name = combined_mesh_name
+
+        self.models = {}
+        self.model_elem_map = {}
+        for mn in model_names:
+            self.models[mn] = model_classes[mn](
+                mn,
+                loadGeometricField(
+                    model_filenames[mn][0],
+                    model_filenames[mn][1],
+                    model_filenames[mn][2],
+                    self.bundle_root,
+                )
+            )
+            elem_i = self.combined_model_gf.add_element_with_parameters(
+                self.models[mn].gf.ensemble_field_function,
+                self.models[mn].gf.get_field_parameters(),
+                tol=0
+            )
+            self.model_elem_map[mn] = elem_i
+
+        # get the global node numbers for each model
+        elem2ens = self.combined_model_gf.ensemble_field_function.mapper._element_to_ensemble_map
+        self._combined_param_map = {}
+        for mn, combined_elem in self.model_elem_map.items():
+            self._combined_param_map[mn] = [elem2ens[combined_elem][x][0][0] for x in
+                                            sorted(elem2ens[combined_elem].keys())]
+
+
+class BundledLowerLimbLeftAtlas(BundledAtlasMixin, bonemodels.LowerLimbLeftAtlas):
+    pass
+
+
+class BundledLowerLimbRightAtlas(BundledAtlasMixin, bonemodels.LowerLimbRightAtlas):
+    pass
+
+
+def main(argv):
+    from mapclientplugins.fieldworklowerlimbgenerationstep.llstep import DEFAULT_BUNDLE_ROOT, _atlasFilenames
+
+    if len(argv) > 1:
+        bundleRoot = argv[1]
+    else:
+        bundleRoot = DEFAULT_BUNDLE_ROOT
+
+    for side in ('left', 'right'):
+        boneFiles = _atlasFilenames(side)[1]
+        for bn, bundleDir in convertAtlas(boneFiles, bundleRoot).items():
+            print('{}: {}'.format(bn, bundleDir))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
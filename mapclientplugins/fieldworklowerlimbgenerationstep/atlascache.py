@@ -0,0 +1,99 @@
+"""
+Process-wide in-memory cache of loaded lower limb atlases
+"""
+import copy
+import os
+import threading
+
+
+def _fileMTimes(filenames):
+    mtimes = []
+    for f in filenames:
+        try:
+            mtimes.append(os.path.getmtime(f))
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+def copyAtlas(atlas):
+    """Return a copy of a loaded atlas that can be transformed independently
+    of the original. The combined principal components are read-only during
+    fitting so they are shared rather than copied.
+    """
+    memo = {}
+    if atlas.combined_pcs is not None:
+        memo[id(atlas.combined_pcs)] = atlas.combined_pcs
+    return copy.deepcopy(atlas, memo)
+
+
+class AtlasCache(object):
+    """
+    Holds one pristine loaded atlas per side and set of atlas files, and
+    hands out copies of it. An entry is reloaded when the modification time
+    of any of its files, or of the extra files it was loaded from, e.g.
+    atlas bundles, changes.
+    """
+
+    def __init__(self):
+        self._atlases = {}  # (side, files): (mtimes, atlas)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _makeKey(side, boneFiles, shapeModelFilename):
+        files = tuple((bn, tuple(boneFiles[bn])) for bn in sorted(boneFiles))
+        return side, files, shapeModelFilename
+
+    @staticmethod
+    def _keyFilenames(key):
+        side, files, shapeModelFilename = key
+        filenames = [f for bn, bf in files for f in bf]
+        filenames.append(shapeModelFilename)
+        return filenames
+
+    def getAtlas(self, side, boneFiles, shapeModelFilename, loader, extraFiles=()):
+        """Return a copy of the atlas for the given side and files. On a
+        miss, loader(side, boneFiles, shapeModelFilename) is called to load
+        the atlas. extraFiles are other files the loader may read; they
+        need not exist.
+        """
+        key = self._makeKey(side, boneFiles, shapeModelFilename)
+        mtimes = _fileMTimes(self._keyFilenames(key) + list(extraFiles))
+        with self._lock:
+            entry = self._atlases.get(key)
+            if (entry is not None) and (entry[0] == mtimes):
+                self.hits += 1
+                atlas = entry[1]
+            else:
+                self.misses += 1
+                atlas = loader(side, boneFiles, shapeModelFilename)
+                self._atlases[key] = (mtimes, atlas)
+
+            return copyAtlas(atlas)
+
+    def invalidate(self, side=None):
+        """Drop cached atlases for the given side, or all if side is None
+        """
+        with self._lock:
+            for key in list(self._atlases.keys()):
+                if (side is None) or (key[0] == side):
+                    del self._atlases[key]
+
+    def clear(self):
+        """Drop all cached atlases and reset the hit/miss counters
+        """
+        with self._lock:
+            self._atlases = {}
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._atlases),
+                }
+
+
+atlasCache = AtlasCache()
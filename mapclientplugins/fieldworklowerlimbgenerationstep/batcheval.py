@@ -0,0 +1,233 @@
+"""
+Batch evaluation of the lower limb shape model.
+
+Evaluates landmarks, and optionally the nodes of every bone, for a (K x
+nParams) matrix of shape model parameters [pc weights, pelvis rigid (6),
+hip rot (3), knee rot (1 or 2)], the x of the shapemodel registration
+mode, instead of calling update_all_models once per row:
+
+- shape: the pc weights of all rows are reconstructed with one matrix
+  multiply per bone.
+- joints: the whole limb is placed relative to the pelvis, so bones are
+  placed once per distinct row of pc weights, hip and knee rotations, with
+  a neutral pelvis, on a reduced atlas (see landmarkmodel). The placement
+  of each bone is recorded as an affine transform.
+- pelvis: the pelvis rigid transforms of all rows are applied at once to
+  the neutral-pelvis landmarks and, for nodes, composed with the bone
+  placements and applied to the reconstructed nodes of all rows.
+
+Rows that differ only in pelvis parameters, e.g. finite differences or
+population members around a pose, therefore share one placement. The
+results equal those of update_all_models to round-off.
+"""
+import numpy as np
+
+from gias3.common import transform3D
+from gias3.musculoskeletal.bonemodels import modelcore
+
+from mapclientplugins.fieldworklowerlimbgenerationstep.landmarkmodel import LandmarkField, makeLandmarkAtlas
+
+# origin and unit axes, transformed with a bone to record its placement
+_FRAME = np.hstack([np.zeros((3, 1)), np.eye(3)])
+
+
+def _rotationMatrices(r):
+    """Returns R = Rx.Ry.Rz as used by gias3 transform3D.transformRigid3D
+    for each row of rotations r (K x 3)
+    """
+    c = np.cos(r)
+    s = np.sin(r)
+    zero = np.zeros(len(r))
+    one = np.ones(len(r))
+    Rx = np.stack([one, zero, zero,
+                   zero, c[:, 0], -s[:, 0],
+                   zero, s[:, 0], c[:, 0]], axis=1).reshape((-1, 3, 3))
+    Ry = np.stack([c[:, 1], zero, s[:, 1],
+                   zero, one, zero,
+                   -s[:, 1], zero, c[:, 1]], axis=1).reshape((-1, 3, 3))
+    Rz = np.stack([c[:, 2], -s[:, 2], zero,
+                   s[:, 2], c[:, 2], zero,
+                   zero, zero, one], axis=1).reshape((-1, 3, 3))
+    return Rx @ Ry @ Rz
+
+
+def _reconstruct(mean, modes, sd, weights):
+    """Shape model reconstruction of each row of weights (K x m). mean and
+    sd have shape s, modes s + (m,). Returns shape s + (K,).
+    """
+    params = modes.dot(weights.T)
+    if sd is not None:
+        params *= sd[..., np.newaxis]
+    return params + mean[..., np.newaxis]
+
+
+class _TrackedField(LandmarkField):
+    """
+    LandmarkField that also records the affine transform applied to it
+    since it was last reset, by transforming a frame along with its nodes.
+    """
+    frame = _FRAME
+
+    def reset(self, params):
+        self.params = params
+        self.frame = _FRAME
+
+    def affine(self):
+        """Returns A, c such that the current nodes are A.x + c for nodes
+        x at the last reset
+        """
+        c = self.frame[:, 0]
+        return self.frame[:, 1:] - c[:, np.newaxis], c
+
+    def _transform(self, func, *args):
+        x = func(np.hstack([self.params, self.frame]).T, *args).T
+        self.params = x[:, :-4]
+        self.frame = x[:, -4:]
+
+    def transformAffine(self, T):
+        self._transform(transform3D.transformAffine, T)
+
+    def transformTranslate(self, T):
+        super(_TrackedField, self).transformTranslate(T)
+        self.frame = self.frame + np.asarray(T)[:, np.newaxis]
+
+    def transformRigidRotateAboutP(self, T, P):
+        self._transform(transform3D.transformRigid3DAboutP, T, P)
+
+    def transformRotateAboutAxis(self, theta, p0, p1):
+        self._transform(transform3D.transformRotateAboutAxis, theta, p0, p1)
+
+
+class BatchEvaluator(object):
+    """
+    Evaluates lower limb atlas ll for many rows of shape model parameters
+    of shapeModes. Knee options are those of ll when the evaluator is
+    made. ll is not modified.
+    """
+
+    def __init__(self, ll, landmarkNames, shapeModes):
+        self.ll = ll
+        self.landmarkNames = list(landmarkNames)
+        self.shapeModes = np.array(shapeModes, dtype=int)
+        self.nModes = len(self.shapeModes)
+        self.nParams = self.nModes + ll.N_PARAMS_RIGID
+        self.getSourceLandmarks = modelcore.make_source_landmark_getter(self.landmarkNames)
+
+        self.atlas = makeLandmarkAtlas(ll)
+        for model in self.atlas.models.values():
+            gf = model.gf
+            model.gf = _TrackedField(gf.usedNodes, gf._fullParams.shape[1])
+        self._sdScale = ll.combined_pcs.getWeightsBySD(self.shapeModes, np.ones(self.nModes))
+
+    def splitX(self, X):
+        """Split rows X (K x nParams) into pc weights, pelvis rigid, hip
+        rot and knee rot columns
+        """
+        iPelvis = self.nModes
+        iHip = iPelvis + self.ll.N_PARAMS_PELVIS
+        iKnee = iHip + self.ll.N_PARAMS_HIP
+        return X[:, :iPelvis], X[:, iPelvis:iHip], X[:, iHip:iKnee], X[:, iKnee:]
+
+    def _checkX(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        if X.ndim != 2 or X.shape[1] != self.nParams:
+            raise ValueError('Incorrect number of parameters, need {}, given {}'.format(
+                self.nParams, X.shape[-1])
+            )
+        return X
+
+    def _reconstructUsedNodes(self, weights):
+        """Used nodes of each bone of the reduced atlas for each row of
+        weights, shape (3, nUsed, K)
+        """
+        params = {}
+        for name, (mean, modes, sd) in self.atlas._landmark_pc_rows.items():
+            params[name] = _reconstruct(mean, modes[:, :, self.shapeModes], sd, weights)
+        return params
+
+    def _place(self, params, hipRot, kneeRot, placeShape):
+        """Place the reduced atlas with a neutral pelvis from reconstructed
+        used nodes params. The pelvis is only reset if placeShape.
+        """
+        for name, model in self.atlas.models.items():
+            if name == 'pelvis' and not placeShape:
+                continue
+            model.gf.reset(params[name])
+            model.update_landmarks()
+            model.update_acs()
+        self.atlas.update_femur(hipRot)
+        self.atlas.update_tibiafibula(kneeRot)
+        self.atlas.update_patella()
+
+    def _placeRows(self, X):
+        """Place the bones once for each distinct row of pc weights, hip
+        and knee rotations in X. Returns the neutral-pelvis landmarks (U x
+        n x 3) and bone affines {bone: (A (U x 3 x 3), c (U x 3))} of the
+        distinct rows, and the index of each row of X into them.
+        """
+        w, pelvisRigid, hipRot, kneeRot = self.splitX(X)
+        jointX = np.hstack([w, hipRot, kneeRot])
+        rows, inverse = np.unique(jointX, axis=0, return_inverse=True)
+        inverse = np.ravel(inverse)
+        # rows are sorted, so rows with the same weights are adjacent
+        rowW, rowHip, rowKnee = np.split(rows, [self.nModes, self.nModes + self.ll.N_PARAMS_HIP], axis=1)
+        params = self._reconstructUsedNodes(rowW * self._sdScale)
+
+        nRows = len(rows)
+        landmarks = np.zeros((nRows, len(self.landmarkNames), 3))
+        affines = {name: (np.zeros((nRows, 3, 3)), np.zeros((nRows, 3))) for name in self.atlas.models}
+        for i in range(nRows):
+            placeShape = i == 0 or not np.array_equal(rowW[i], rowW[i - 1])
+            self._place({n: p[:, :, i] for n, p in params.items()}, rowHip[i], rowKnee[i], placeShape)
+            self.getSourceLandmarks(self.atlas, landmarks[i])
+            for name, model in self.atlas.models.items():
+                A, c = affines[name]
+                A[i], c[i] = model.gf.affine()
+
+        return landmarks, affines, inverse
+
+    def _reconstructNodes(self, weights):
+        """All nodes of each bone for each row of weights, shape (3,
+        nNodes, K)
+        """
+        pcs = self.ll.combined_pcs
+        nCombinedNodes = pcs.mean.shape[0] // 3
+        params = _reconstruct(
+            pcs.mean,
+            pcs.modes[:, self.shapeModes],
+            pcs.SD if pcs.sdNorm else None,
+            weights,
+        ).reshape((3, nCombinedNodes, -1))
+        return {name: params[:, self.ll._combined_param_map[name], :] for name in self.ll.models}
+
+    def evaluate(self, X, nodes=False):
+        """Landmark positions (K x nLandmarks x 3) for each row of
+        parameters X (K x nParams). If nodes, also returns a dict of the
+        node coordinates (K x nNodes x 3) of each bone, which needs
+        K x all nodes x 3 floats of memory.
+        """
+        X = self._checkX(X)
+        w, pelvisRigid, hipRot, kneeRot = self.splitX(X)
+        landmarks, affines, inverse = self._placeRows(X)
+
+        o = self.ll.pelvis_origin
+        t = pelvisRigid[:, :3]
+        R = _rotationMatrices(pelvisRigid[:, 3:])
+        L = np.einsum('kij,klj->kli', R, landmarks[inverse] - o) + (o + t)[:, np.newaxis, :]
+        if not nodes:
+            return L
+
+        boneNodes = {}
+        for name, params in self._reconstructNodes(w * self._sdScale).items():
+            A, c = affines[name]
+            M = R @ A[inverse]
+            d = np.einsum('kij,kj->ki', R, c[inverse] - o) + o + t
+            boneNodes[name] = np.einsum('kij,jnk->kni', M, params) + d[:, np.newaxis, :]
+        return L, boneNodes
+
+
+def evaluateBatch(ll, landmarkNames, shapeModes, X, nodes=False):
+    """Evaluate atlas ll for rows of shape model parameters X, see
+    BatchEvaluator.evaluate
+    """
+    return BatchEvaluator(ll, landmarkNames, shapeModes).evaluate(X, nodes)
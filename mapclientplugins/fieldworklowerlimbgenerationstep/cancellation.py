@@ -0,0 +1,39 @@
+"""
+Cancellation of running registrations.
+
+Pass a CancellationToken to LLStepData.register and call its cancel
+method from another thread to stop the fit. The fit raises
+RegistrationCancelled internally at its next check, and register returns
+the best parameters found so far with fitInfo['cancelled'] True.
+"""
+import threading
+
+
+class RegistrationCancelled(Exception):
+    """Raised inside a fit to stop it. x is the best fitted parameters so
+    far, split as returned by the fit function, or None if there are none.
+    """
+
+    def __init__(self, x=None):
+        super(RegistrationCancelled, self).__init__('registration cancelled')
+        self.x = x
+
+
+class CancellationToken(object):
+
+    def __init__(self, event=None):
+        """event is the threading.Event or multiprocessing Event that is
+        set on cancel, e.g. one shared with worker processes. A new
+        threading.Event if None.
+        """
+        self._event = threading.Event() if event is None else event
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def reset(self):
+        self._event.clear()
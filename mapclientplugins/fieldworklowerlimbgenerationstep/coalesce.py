@@ -0,0 +1,51 @@
+"""
+Coalescing of bursts of changes into one update per interval.
+
+Dragging a spinbox emits a change per step, and each change would
+otherwise re-place the lower limb model and redraw it. A Coalescer starts
+a single-shot timer on the first change, ignores further changes while it
+is running, and applies one update of the latest state when it fires. The
+timer is anything with start, stop and isActive whose timeout calls
+Coalescer.fire, a single-shot QTimer in the dialog, so the logic has no
+Qt dependency.
+"""
+
+
+class Coalescer(object):
+
+    def __init__(self, timer, update):
+        self.timer = timer
+        self.update = update
+        # changes are ignored while locked, e.g. while the dialog sets the
+        # spinboxes from the model
+        self.locked = False
+
+    @property
+    def pending(self):
+        """True if a change is waiting for the timer
+        """
+        return self.timer.isActive()
+
+    def changed(self):
+        """Schedule an update at the end of the interval, unless one is
+        already pending
+        """
+        if not self.locked and not self.timer.isActive():
+            self.timer.start()
+
+    def fire(self):
+        """Apply the update now and cancel the pending one
+        """
+        self.timer.stop()
+        self.update()
+
+    def flush(self):
+        """Apply the pending update now, if there is one
+        """
+        if self.timer.isActive():
+            self.fire()
+
+    def discard(self):
+        """Drop the pending update
+        """
+        self.timer.stop()
@@ -1,6 +1,7 @@
 from PySide6 import QtWidgets
 from mapclientplugins.fieldworklowerlimbgenerationstep.ui_configuredialog import Ui_Dialog
 from mapclientplugins.fieldworklowerlimbgenerationstep.llstep import validModelLandmarks
+from mapclientplugins.fieldworklowerlimbgenerationstep.pcschedule import parsePCSchedule
 from mapclientplugins.fieldworklowerlimbgenerationstep.landmarktablewidget import LandmarkComboBoxTextTable
 
 INVALID_STYLE_SHEET = 'background-color: rgba(239, 0, 0, 50)'
@@ -47,6 +48,8 @@ class ConfigureDialog(QtWidgets.QDialog):
 
     def _makeConnections(self):
         self._ui.lineEdit_id.textChanged.connect(self.validate)
+        self._ui.lineEdit_pcSchedule.textChanged.connect(self.validate)
+        self._ui.spinBox_pcsToFit.valueChanged.connect(self.validate)
         self._ui.pushButton_addLandmark.clicked.connect(self.landmarkTable.addLandmark)
         self._ui.pushButton_removeLandmark.clicked.connect(self.landmarkTable.removeLandmark)
 
@@ -80,7 +83,17 @@ class ConfigureDialog(QtWidgets.QDialog):
         else:
             self._ui.lineEdit_id.setStyleSheet(INVALID_STYLE_SHEET)
 
-        return valid
+        try:
+            parsePCSchedule(self._ui.lineEdit_pcSchedule.text(), self._ui.spinBox_pcsToFit.value())
+            pcScheduleValid = True
+        except ValueError:
+            pcScheduleValid = False
+        if pcScheduleValid:
+            self._ui.lineEdit_pcSchedule.setStyleSheet(DEFAULT_STYLE_SHEET)
+        else:
+            self._ui.lineEdit_pcSchedule.setStyleSheet(INVALID_STYLE_SHEET)
+
+        return valid and pcScheduleValid
 
     def getConfig(self):
         '''
@@ -110,6 +123,13 @@ class ConfigureDialog(QtWidgets.QDialog):
             config['GUI'] = 'True'
         else:
             config['GUI'] = 'False'
+        config['pc_schedule'] = self._ui.lineEdit_pcSchedule.text()
+        config['warm_start_dir'] = self._ui.lineEdit_warmStartDir.text()
+        config['result_cache_dir'] = self._ui.lineEdit_resultCacheDir.text()
+        if self._ui.checkBox_outputViews.isChecked():
+            config['output_submesh_views'] = 'True'
+        else:
+            config['output_submesh_views'] = 'False'
         return config
 
     def setConfig(self, config):
@@ -159,3 +179,7 @@ class ConfigureDialog(QtWidgets.QDialog):
             self._ui.checkBox_GUI.setChecked(bool(True))
         else:
             self._ui.checkBox_GUI.setChecked(bool(False))
+        self._ui.lineEdit_pcSchedule.setText(config.get('pc_schedule', ''))
+        self._ui.lineEdit_warmStartDir.setText(config.get('warm_start_dir', ''))
+        self._ui.lineEdit_resultCacheDir.setText(config.get('result_cache_dir', ''))
+        self._ui.checkBox_outputViews.setChecked(config.get('output_submesh_views', 'False') == 'True')
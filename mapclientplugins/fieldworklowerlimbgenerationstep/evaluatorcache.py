@@ -0,0 +1,50 @@
+"""
+Process-wide cache of sparse geometric field evaluators.
+
+A gias3 sparse evaluator is a precomputed matrix of basis function values
+at the points of one discretisation of a mesh. Building it evaluates the
+basis at every point of every element, which costs far more than using
+it, and it only depends on the mesh topology and the discretisation. It
+is therefore built once per mesh and discretisation and shared by every
+field with that mesh, e.g. every copy of an atlas bone.
+"""
+import threading
+
+from gias3.fieldwork.field import geometric_field
+
+
+class EvaluatorCache(object):
+    """
+    Sparse evaluators by key and discretisation, built on first use. Keys
+    should identify the mesh topology, e.g. its source files.
+    """
+
+    def __init__(self):
+        self._evaluators = {}
+        self._lock = threading.Lock()
+
+    def getEvaluator(self, key, gf, discretisation):
+        """Returns a function of flattened field parameters returning the
+        (3, n) coordinates of gf's mesh at discretisation
+        """
+        cacheKey = (key, tuple(discretisation))
+        with self._lock:
+            evaluator = self._evaluators.get(cacheKey)
+            if evaluator is None:
+                evaluator = geometric_field.makeGeometricFieldEvaluatorSparse(gf, list(discretisation))
+                self._evaluators[cacheKey] = evaluator
+            return evaluator
+
+    def getModelEvaluator(self, ll, bone, discretisation):
+        """Evaluator of a bone of lower limb model ll. The key is the type
+        of ll and the bone's mesh files, which differ between sides.
+        """
+        key = (type(ll).__name__, tuple(ll.bone_files[bone]))
+        return self.getEvaluator(key, ll.models[bone].gf, discretisation)
+
+    def clear(self):
+        with self._lock:
+            self._evaluators = {}
+
+
+evaluatorCache = EvaluatorCache()
@@ -0,0 +1,143 @@
+"""
+Timing and counter instrumentation for lower limb registration.
+
+An Instrumentation records:
+
+- phases: count, total and last duration in seconds of named blocks of
+  work, e.g. loadData or the optimiser run.
+- counters: named integer counts, e.g. objective evaluations.
+- latency: histograms of the duration of individual named calls, e.g.
+  each model evaluation made by the objective function.
+
+asDict returns all of them as plain dicts. If jsonLinesFile is set, each
+phase, counter update and summary is also written to it as a line of
+JSON.
+"""
+import contextlib
+import json
+import threading
+import time
+
+import numpy as np
+
+# upper edges of the latency histogram bins in milliseconds. The last bin
+# counts everything longer.
+LATENCY_BINS_MS = (0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, 1000.0)
+
+
+class Instrumentation(object):
+
+    def __init__(self, jsonLinesFile=None):
+        """jsonLinesFile is a filename to append records to or a file-like
+        object to write them to, or None to not write records.
+        """
+        self.jsonLinesFile = jsonLinesFile
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._phases = {}
+            self._counters = {}
+            self._latency = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager that records the duration of its block as phase
+        name.
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addPhase(name, time.perf_counter() - t0)
+
+    def addPhase(self, name, seconds):
+        with self._lock:
+            p = self._phases.get(name)
+            if p is None:
+                p = self._phases[name] = {'count': 0, 'total': 0.0, 'last': 0.0}
+            p['count'] += 1
+            p['total'] += seconds
+            p['last'] = seconds
+        self.emit({'event': 'phase', 'name': name, 'seconds': seconds})
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + int(n)
+        self.emit({'event': 'count', 'name': name, 'n': int(n)})
+
+    def addLatency(self, name, seconds):
+        """Add one call of the given duration to latency histogram name.
+        Not written to jsonLinesFile, see emitSummary.
+        """
+        with self._lock:
+            h = self._latency.get(name)
+            if h is None:
+                h = self._latency[name] = {
+                    'count': 0, 'total': 0.0, 'min': None, 'max': None,
+                    'binsMs': list(LATENCY_BINS_MS), 'counts': [0, ] * (len(LATENCY_BINS_MS) + 1),
+                }
+            h['count'] += 1
+            h['total'] += seconds
+            h['min'] = seconds if h['min'] is None else min(h['min'], seconds)
+            h['max'] = seconds if h['max'] is None else max(h['max'], seconds)
+            h['counts'][int(np.searchsorted(LATENCY_BINS_MS, seconds * 1e3))] += 1
+
+    @contextlib.contextmanager
+    def timeCalls(self, obj, methodName, name):
+        """Context manager that adds every call of obj.methodName within
+        its block to latency histogram name. The method is wrapped by an
+        instance attribute that is removed on exit.
+        """
+        method = getattr(obj, methodName)
+        shadowed = methodName in vars(obj)
+
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.addLatency(name, time.perf_counter() - t0)
+
+        setattr(obj, methodName, timed)
+        try:
+            yield
+        finally:
+            if shadowed:
+                setattr(obj, methodName, method)
+            else:
+                delattr(obj, methodName)
+
+    def asDict(self):
+        """Returns a copy of the recorded phases, counters and latency
+        histograms.
+        """
+        with self._lock:
+            return {
+                'phases': dict((k, dict(v)) for k, v in self._phases.items()),
+                'counters': dict(self._counters),
+                'latency': dict((k, dict(v, counts=list(v['counts']))) for k, v in self._latency.items()),
+            }
+
+    def emitSummary(self, **extra):
+        """Write everything recorded so far, and any extra items, to
+        jsonLinesFile as one record.
+        """
+        if self.jsonLinesFile is not None:
+            record = {'event': 'summary'}
+            record.update(extra)
+            record.update(self.asDict())
+            self.emit(record)
+
+    def emit(self, record):
+        if self.jsonLinesFile is None:
+            return
+        record = dict(record, time=time.time())
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            if isinstance(self.jsonLinesFile, str):
+                with open(self.jsonLinesFile, 'a') as f:
+                    f.write(line)
+            else:
+                self.jsonLinesFile.write(line)
@@ -0,0 +1,174 @@
+"""
+Reduced lower limb atlas for landmark fitting.
+
+Placing the bones and evaluating landmarks only reads a small subset of
+each bone's nodes: the landmark nodes, the acetabulum and femoral head
+nodes used for sphere fits, and the knee articular surfaces. The atlas
+returned by makeLandmarkAtlas stores and transforms only those nodes, and
+reconstructs them from the precomputed rows of the shape model, so each
+update costs O(landmark nodes x modes) instead of O(all nodes x modes).
+
+The full meshes of the source atlas are not touched. After fitting, update
+the source atlas once with the fitted parameters.
+"""
+import copy
+import types
+
+import numpy as np
+
+from gias3.common import transform3D
+
+
+def _boneOutputs(model, params, pointNodes):
+    """Everything the placement chain reads from a bone's field parameters
+    """
+    outputs = [np.ravel(e(params)) for e in model._landmark_evaluators.values()]
+    kneeSurfEvaluator = getattr(model, 'knee_surf_evaluator', None)
+    if kneeSurfEvaluator is not None:
+        outputs.append(np.ravel(kneeSurfEvaluator(params)))
+    for n in pointNodes:
+        outputs.append(params[:, n, 0])
+    return np.hstack(outputs)
+
+
+# (atlas class, bone name, bone files): used node indices
+_usedNodesCache = {}
+
+
+def _findUsedNodes(model, pointNodes=()):
+    """Find the nodes that a bone's landmark and knee surface evaluators
+    read, by bisecting over nodes set to NaN.
+    """
+    params = model.gf.field_parameters
+    nNodes = params.shape[1]
+    testParams = params.copy()
+    used = []
+    stack = [np.arange(nNodes)]
+    with np.errstate(all='ignore'):
+        while stack:
+            nodes = stack.pop()
+            testParams[:, nodes] = np.nan
+            try:
+                depends = not np.isfinite(_boneOutputs(model, testParams, pointNodes)).all()
+            except (ValueError, np.linalg.LinAlgError):
+                # sphere fits reject NaN input
+                depends = True
+            testParams[:, nodes] = params[:, nodes]
+
+            if depends:
+                if len(nodes) == 1:
+                    used.append(nodes[0])
+                else:
+                    half = len(nodes) // 2
+                    stack.append(nodes[half:])
+                    stack.append(nodes[:half])
+
+    return np.array(sorted(used), dtype=int)
+
+
+class LandmarkField(object):
+    """
+    Stand-in for a bone's geometric field that holds only the nodes in
+    usedNodes. field_parameters returns a full-size array in which only
+    the used nodes are valid, which is all the bone's evaluators read.
+    """
+
+    def __init__(self, usedNodes, nNodes, params=None):
+        self.usedNodes = usedNodes
+        self.dimensions = 3
+        self._fullParams = np.zeros((3, nNodes, 1), dtype=float)
+        self.params = np.zeros((3, len(usedNodes)), dtype=float)
+        if params is not None:
+            self.params[:] = params[:, usedNodes, 0]
+
+    @property
+    def field_parameters(self):
+        self._fullParams[:, self.usedNodes, 0] = self.params
+        return self._fullParams
+
+    @field_parameters.setter
+    def field_parameters(self, value):
+        # rigid and scaling transforms of the bone models set all nodes
+        self.params = np.array(value[:, self.usedNodes, 0], dtype=float)
+
+    def get_field_parameters(self):
+        return self.field_parameters
+
+    def get_point_position(self, point):
+        return np.array(self.field_parameters[:, point, 0])
+
+    def transformAffine(self, T):
+        self.params = transform3D.transformAffine(self.params.T, T).T
+
+    def transformTranslate(self, T):
+        self.params = self.params + np.asarray(T)[:, np.newaxis]
+
+    def transformRigidRotateAboutP(self, T, P):
+        self.params = transform3D.transformRigid3DAboutP(self.params.T, T, P).T
+
+    def transformRotateAboutAxis(self, theta, p0, p1):
+        self.params = transform3D.transformRotateAboutAxis(self.params.T, theta, p0, p1).T
+
+
+def _update_models_by_pcweights_sd(self, pc_weights, pc_modes):
+    """Shape model reconstruction of the used nodes only. Bound to reduced
+    atlases in place of MultiBoneAtlas.update_models_by_pcweights_sd.
+    """
+    pcs = self.combined_pcs
+    weights = pcs.getWeightsBySD(pc_modes, pc_weights)
+    for model_name, model in self.models.items():
+        mean, modes, sd = self._landmark_pc_rows[model_name]
+        if pcs.sdNorm:
+            params = modes[:, :, pc_modes].dot(weights) * sd + mean
+        else:
+            params = modes[:, :, pc_modes].dot(weights) + mean
+        model.gf.params = params
+        model.update_landmarks()
+        model.update_acs()
+
+
+def makeLandmarkAtlas(ll):
+    """Return a copy of lower limb atlas ll that only evaluates the nodes
+    needed to place its bones and evaluate its landmarks. The copy starts
+    in the current state of ll and supports update_all_models,
+    update_all_models_uniform_scaling, update_all_models_multi_scaling,
+    update_femur, update_tibiafibula and update_patella. ll is not
+    modified.
+    """
+    reduced = copy.copy(ll)
+
+    # rebind instance-level methods, e.g. the knee gap function
+    for name, value in vars(ll).items():
+        if isinstance(value, types.MethodType) and value.__self__ is ll:
+            setattr(reduced, name, types.MethodType(value.__func__, reduced))
+
+    pcs = ll.combined_pcs
+    nCombinedNodes = pcs.mean.shape[0] // 3
+    pcMean = pcs.mean.reshape((3, nCombinedNodes))
+    pcModes = pcs.modes.reshape((3, nCombinedNodes, -1))
+    pcSD = pcs.SD.reshape((3, nCombinedNodes)) if pcs.sdNorm else None
+
+    reduced.models = {}
+    reduced._landmark_pc_rows = {}
+    for name, model in ll.models.items():
+        pointNodes = (ll.tp_lat_node, ll.tp_med_node) if name == 'tibiafibula' else ()
+        key = (type(ll).__name__, name, tuple(ll.bone_files[name]))
+        usedNodes = _usedNodesCache.get(key)
+        if usedNodes is None:
+            usedNodes = _findUsedNodes(model, pointNodes)
+            _usedNodesCache[key] = usedNodes
+        combinedNodes = np.asarray(ll._combined_param_map[name])[usedNodes]
+
+        m = copy.copy(model)
+        m.gf = LandmarkField(usedNodes, model.gf.field_parameters.shape[1], model.gf.field_parameters)
+        m.landmarks = dict(model.landmarks)
+        m.acs = copy.deepcopy(model.acs)
+        reduced.models[name] = m
+        reduced._landmark_pc_rows[name] = (
+            pcMean[:, combinedNodes],
+            pcModes[:, combinedNodes, :],
+            None if pcSD is None else pcSD[:, combinedNodes],
+        )
+
+    reduced.update_models_by_pcweights_sd = types.MethodType(_update_models_by_pcweights_sd, reduced)
+    return reduced
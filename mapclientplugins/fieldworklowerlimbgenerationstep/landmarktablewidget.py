@@ -17,9 +17,12 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
     You should have received a copy of the GNU General Public License
     along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
 '''
+import logging
 
 from PySide6.QtWidgets import QAbstractItemView, QTableWidgetItem, QComboBox
 
+log = logging.getLogger(__name__)
+
 
 class LandmarkComboBoxTable(object):
 
@@ -66,7 +69,7 @@ class LandmarkComboBoxTable(object):
         combInput = self._addComboBox(self._rowCount, 1, self.inputLandmarks, inputLandmark)
         self._comboBoxes.append((combMode, combInput))
         self._rowCount += 1
-        print('row added {}'.format(self._rowCount))
+        log.debug('row added %d', self._rowCount)
 
     def removeLandmark(self, selectedRow=None):
         """
@@ -116,7 +119,7 @@ class LandmarkComboBoxTable(object):
             if currentItem in items:
                 comb.setCurrentIndex(items.index(currentItem))
             else:
-                print('invalid item: {}'.format(currentItem))
+                log.warning('invalid item: %s', currentItem)
 
         return comb
 
@@ -165,7 +168,7 @@ class LandmarkComboBoxTextTable(object):
         elemInput = self._addTableItem(self._rowCount, 1, inputLandmark)
         self._rowElems.append((combMode, elemInput))
         self._rowCount += 1
-        print('row added {}'.format(self._rowCount))
+        log.debug('row added %d', self._rowCount)
 
     def removeLandmark(self, selectedRow=None):
         """
@@ -215,7 +218,7 @@ class LandmarkComboBoxTextTable(object):
             if currentItem in items:
                 comb.setCurrentIndex(items.index(currentItem))
             else:
-                print('invalid item: {}'.format(currentItem))
+                log.warning('invalid item: %s', currentItem)
 
         return comb
 
@@ -1,17 +1,35 @@
 """
 Auto lower limb registration
 """
+import contextlib
+import logging
 import os
 import numpy as np
 import copy
-
-import musculoskeletal.models as mm
-
-from gias3.fieldwork.field import geometric_field
-from gias3.musculoskeletal import mocap_landmark_preprocess
-from gias3.musculoskeletal.bonemodels import bonemodels
-from gias3.musculoskeletal.bonemodels import lowerlimbatlasfit
-from gias3.musculoskeletal.bonemodels import lowerlimbatlasfitscaling
+import itertools
+import multiprocessing
+import threading
+import time
+import traceback
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from mapclientplugins.fieldworklowerlimbgenerationstep.atlascache import atlasCache
+from mapclientplugins.fieldworklowerlimbgenerationstep.cancellation import CancellationToken, RegistrationCancelled
+from mapclientplugins.fieldworklowerlimbgenerationstep.instrumentation import Instrumentation
+from mapclientplugins.fieldworklowerlimbgenerationstep.pcschedule import parsePCSchedule
+from mapclientplugins.fieldworklowerlimbgenerationstep.progress import ProgressReporter
+from mapclientplugins.fieldworklowerlimbgenerationstep import resultcache
+from mapclientplugins.fieldworklowerlimbgenerationstep.snapshot import SnapshotBuffer
+from mapclientplugins.fieldworklowerlimbgenerationstep import warmstart
+from mapclientplugins.fieldworklowerlimbgenerationstep import trialstore
+
+# gias3, and the modules of this package that use it, are imported by the
+# functions that need them, so that importing llstep, e.g. to create a
+# step or start a batch worker, does not load gias3 until an atlas is
+# loaded or a fit is run.
+
+log = logging.getLogger(__name__)
 
 validModelLandmarks = (
     'femur-GT',
@@ -40,6 +58,14 @@ validModelLandmarks = (
 )
 
 
+def _paramsEqual(a, b):
+    """Equality of nested tuples of arrays and scalars
+    """
+    if isinstance(a, tuple):
+        return len(a) == len(b) and all(_paramsEqual(i, j) for i, j in zip(a, b))
+    return np.array_equal(a, b)
+
+
 def _trimAngle(a):
     if a < -np.pi:
         return a + 2 * np.pi
@@ -49,6 +75,40 @@ def _trimAngle(a):
         return a
 
 
+class OutputModelDict(Mapping):
+    """
+    Read-only dict of output geometric fields whose values are built on
+    first access and then kept. builders is a dict of key: function
+    returning the value. values is an optional dict of already built
+    values. Pickles as a plain dict of all values.
+    """
+
+    def __init__(self, builders, values=None):
+        self._builders = builders
+        self._values = dict(values or {})
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        builder = self._builders[key]
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = builder()
+            return self._values[key]
+
+    def __iter__(self):
+        return iter(self._builders)
+
+    def __len__(self):
+        return len(self._builders)
+
+    def __reduce__(self):
+        return dict, (dict(self.items()),)
+
+
 class LLTransformData(object):
     SHAPEMODESMAX = 100
 
@@ -62,7 +122,7 @@ class LLTransformData(object):
         self.uniformScaling = 1.0
         self.pelvisScaling = 1.0
         self.femurScaling = 1.0
-        self.petallaScaling = 1.0
+        self.patellaScaling = 1.0
         self.tibfibScaling = 1.0
         self.kneeDOF = False
         self.kneeCorr = False
@@ -199,8 +259,43 @@ class LLTransformData(object):
         self.kneeRot = value[3]
         self.lastTransformSet = self.perBoneScalingX
 
+    def toDict(self):
+        """Returns the transform as a JSON-serialisable dict
+        """
+        return {'nShapeModes': int(self.nShapeModes),
+                'shapeModeWeights': self._shapeModeWeights[:self.nShapeModes].tolist(),
+                'pelvisRigid': self._pelvisRigid.tolist(),
+                'hipRot': self._hipRot.tolist(),
+                'kneeRot': self._kneeRot.tolist(),
+                'uniformScaling': float(self.uniformScaling),
+                'pelvisScaling': float(self.pelvisScaling),
+                'femurScaling': float(self.femurScaling),
+                'patellaScaling': float(self.patellaScaling),
+                'tibfibScaling': float(self.tibfibScaling),
+                'kneeDOF': bool(self.kneeDOF),
+                'kneeCorr': bool(self.kneeCorr),
+                }
+
+    def setFromDict(self, d):
+        """Set the transform from a dict made by toDict. nShapeModes is
+        not changed.
+        """
+        self._shapeModeWeights[:] = 0.0
+        self.shapeModeWeights = d['shapeModeWeights'][:self.SHAPEMODESMAX]
+        self.pelvisRigid = d['pelvisRigid']
+        self.hipRot = d['hipRot']
+        self._kneeRot = np.array(d['kneeRot'], dtype=float)
+        self.uniformScaling = d['uniformScaling']
+        self.pelvisScaling = d['pelvisScaling']
+        self.femurScaling = d['femurScaling']
+        self.patellaScaling = d['patellaScaling']
+        self.tibfibScaling = d['tibfibScaling']
+        self.kneeDOF = d['kneeDOF']
+        self.kneeCorr = d['kneeCorr']
+
 
 SELF_DIRECTORY = os.path.split(__file__)[0]
+DEFAULT_BUNDLE_ROOT = os.path.join(SELF_DIRECTORY, 'data', 'atlas_bundles')
 PELVIS_SUBMESHES = ('RH', 'LH', 'sac')
 PELVIS_SUBMESH_ELEMS = {'RH': range(0, 73),
                         'LH': range(73, 146),
@@ -214,67 +309,135 @@ TIBFIB_SUBMESH_ELEMS = {'tibia': range(0, 46),
                         }
 TIBFIB_BASISTYPES = {'tri10': 'simplex_L3_L3', 'quad44': 'quad_L3_L3'}
 
-
-class LLStepData(object):
-    _shapeModelFilenameRight = mm.get_model_path("shape_models/LLP26_right_mirrored_from_left_rigid.pc")
-    _boneModelFilenamesRight = {
+PERBONE_SCALING_BONES = ('pelvis', 'femur', 'patella', 'tibiafibula')
+# bones moved by each group of manual registration parameters. Bones are
+# placed in the order pelvis, femur, tibiafibula, patella, each relative to
+# the previous one.
+PARAMETER_GROUP_BONES = {'shape': ('pelvis', 'femur', 'tibiafibula', 'patella'),
+                         'pelvis': ('pelvis', 'femur', 'tibiafibula', 'patella'),
+                         'hip': ('femur', 'tibiafibula', 'patella'),
+                         'knee': ('tibiafibula', 'patella'),
+                         }
+# the bone each output model is made from
+OUTPUT_MODEL_BONES = {'pelvis': 'pelvis',
+                      'pelvis flat': 'pelvis',
+                      'hemipelvis-left': 'pelvis',
+                      'sacrum': 'pelvis',
+                      'hemipelvis-right': 'pelvis',
+                      'femur': 'femur',
+                      'patella': 'patella',
+                      'tibiafibula': 'tibiafibula',
+                      'tibia': 'tibiafibula',
+                      'fibula': 'tibiafibula',
+                      }
+# updateLLModel does a full update after this many partial ones, to
+# discard the round-off of repeatedly re-placing bones
+MAX_PARTIAL_UPDATES = 100
+
+
+# atlas files relative to the musculoskeletal models package, see
+# _atlasFilenames
+_SHAPE_MODEL_FILES = {
+    'left': 'shape_models/LLP26_rigid.pc',
+    'right': 'shape_models/LLP26_right_mirrored_from_left_rigid.pc',
+}
+_BONE_MODEL_FILES = {
+    'left': {
         'pelvis': (
-            mm.get_model_path('atlas_meshes/pelvis_combined_cubic_mean_rigid_LLP26.geof'),
-            mm.get_model_path('atlas_meshes/pelvis_combined_cubic_flat.ens'),
-            mm.get_model_path('atlas_meshes/pelvis_combined_cubic_flat.mesh'),
+            'atlas_meshes/pelvis_combined_cubic_mean_rigid_LLP26.geof',
+            'atlas_meshes/pelvis_combined_cubic_flat.ens',
+            'atlas_meshes/pelvis_combined_cubic_flat.mesh',
         ),
         'femur': (
-            mm.get_model_path('atlas_meshes/femur_right_mirrored_from_left_mean_rigid_LLP26.geof'),
-            mm.get_model_path('atlas_meshes/femur_right_quartic_flat.ens'),
-            mm.get_model_path('atlas_meshes/femur_right_quartic_flat.mesh'),
+            'atlas_meshes/femur_left_mean_rigid_LLP26.geof',
+            'atlas_meshes/femur_left_quartic_flat.ens',
+            'atlas_meshes/femur_left_quartic_flat.mesh',
         ),
         'patella': (
-            mm.get_model_path('atlas_meshes/patella_right_mirrored_from_left_mean_rigid_LLP26.geof'),
-            mm.get_model_path('atlas_meshes/patella_11_right.ens'),
-            mm.get_model_path('atlas_meshes/patella_11_right.mesh'),
+            'atlas_meshes/patella_left_mean_rigid_LLP26.geof',
+            'atlas_meshes/patella_11_left.ens',
+            'atlas_meshes/patella_11_left.mesh',
         ),
         'tibiafibula': (
-            mm.get_model_path('atlas_meshes/tibia_fibula_cubic_right_mirrored_from_left_mean_rigid_LLP26.geof'),
-            mm.get_model_path('atlas_meshes/tibia_fibula_right_cubic_flat.ens'),
-            mm.get_model_path('atlas_meshes/tibia_fibula_right_cubic_flat.mesh'),
+            'atlas_meshes/tibia_fibula_cubic_left_mean_rigid_LLP26.geof',
+            'atlas_meshes/tibia_fibula_left_cubic_flat.ens',
+            'atlas_meshes/tibia_fibula_left_cubic_flat.mesh',
         ),
-    }
-    _shapeModelFilenameLeft = mm.get_model_path("shape_models/LLP26_rigid.pc")
-    _boneModelFilenamesLeft = {
+    },
+    'right': {
         'pelvis': (
-            mm.get_model_path('atlas_meshes/pelvis_combined_cubic_mean_rigid_LLP26.geof'),
-            mm.get_model_path('atlas_meshes/pelvis_combined_cubic_flat.ens'),
-            mm.get_model_path('atlas_meshes/pelvis_combined_cubic_flat.mesh'),
+            'atlas_meshes/pelvis_combined_cubic_mean_rigid_LLP26.geof',
+            'atlas_meshes/pelvis_combined_cubic_flat.ens',
+            'atlas_meshes/pelvis_combined_cubic_flat.mesh',
         ),
         'femur': (
-            mm.get_model_path('atlas_meshes/femur_left_mean_rigid_LLP26.geof'),
-            mm.get_model_path('atlas_meshes/femur_left_quartic_flat.ens'),
-            mm.get_model_path('atlas_meshes/femur_left_quartic_flat.mesh'),
+            'atlas_meshes/femur_right_mirrored_from_left_mean_rigid_LLP26.geof',
+            'atlas_meshes/femur_right_quartic_flat.ens',
+            'atlas_meshes/femur_right_quartic_flat.mesh',
         ),
         'patella': (
-            mm.get_model_path('atlas_meshes/patella_left_mean_rigid_LLP26.geof'),
-            mm.get_model_path('atlas_meshes/patella_11_left.ens'),
-            mm.get_model_path('atlas_meshes/patella_11_left.mesh'),
+            'atlas_meshes/patella_right_mirrored_from_left_mean_rigid_LLP26.geof',
+            'atlas_meshes/patella_11_right.ens',
+            'atlas_meshes/patella_11_right.mesh',
         ),
         'tibiafibula': (
-            mm.get_model_path('atlas_meshes/tibia_fibula_cubic_left_mean_rigid_LLP26.geof'),
-            mm.get_model_path('atlas_meshes/tibia_fibula_left_cubic_flat.ens'),
-            mm.get_model_path('atlas_meshes/tibia_fibula_left_cubic_flat.mesh'),
+            'atlas_meshes/tibia_fibula_cubic_right_mirrored_from_left_mean_rigid_LLP26.geof',
+            'atlas_meshes/tibia_fibula_right_cubic_flat.ens',
+            'atlas_meshes/tibia_fibula_right_cubic_flat.mesh',
         ),
-    }
+    },
+}
+_atlasFilenamesCache = {}
+
+
+def _atlasFilenames(side):
+    """Returns the shape model filename and the dict of bone model
+    filenames of the atlas for side. Resolved on first use, so that
+    importing this module does not need the models package.
+    """
+    filenames = _atlasFilenamesCache.get(side)
+    if filenames is None:
+        import musculoskeletal.models as mm
+
+        filenames = (
+            mm.get_model_path(_SHAPE_MODEL_FILES[side]),
+            {b: tuple(mm.get_model_path(f) for f in files) for b, files in _BONE_MODEL_FILES[side].items()},
+        )
+        _atlasFilenamesCache[side] = filenames
+    return filenames
+
+
+class LLStepData(object):
     _validRegistrationModes = ('shapemodel', 'uniformscaling', 'perbonescaling')
     # landmarkNames = ('pelvis-LASIS', 'pelvis-RASIS', 'pelvis-Sacral',
     #                   'femur-LEC', 'femur-MEC', 'tibiafibula-LM',
     #                   'tibiafibula-MM',
     #                   )
+    # scipy.optimize.minimize arguments. Set 'jac' to 'analytic' to fit the
+    # shape model with the gradient from shapemodelfit instead of finite
+    # differences over the whole model. Other modes then use 'jac': False.
     minArgs = {'method': 'L-BFGS-B',
                'jac': False,
                'bounds': None, 'tol': 1e-6,
                'options': {'eps': 1e-5},
                }
+    # standard deviations of the random start perturbations used by
+    # registerMultiStart. Translations in mm, rotations in radians.
+    multiStartSD = {'pelvisTranslation': 10.0,
+                    'pelvisRotation': 0.1,
+                    'hipRot': 0.2,
+                    'kneeRot': 0.2,
+                    }
+    # size limit of the registration result cache, see resultCacheDir
+    resultCacheMaxBytes = resultcache.DEFAULT_MAX_BYTES
+    # scipy.optimize.least_squares arguments of the per-frame pose fits of
+    # registerTrial. Scaling by the jacobian copes with pelvis rotations
+    # moving landmarks far more than the other parameters do.
+    trialFitArgs = {'x_scale': 'jac', 'ftol': 1e-6, 'xtol': 1e-6, 'gtol': 1e-6}
 
     def __init__(self, config):
         self.config = config
+        self.LL = None
         self.T = LLTransformData()
         self.inputLandmarks = None  # a dict of landmarks
         # self._targetLandmarksNames = None # list of strings matching keys in self.inputLandmarks
@@ -283,52 +446,133 @@ class LLStepData(object):
         self.inputPCs = None
         self._inputModelDict = None
         self._outputModelDict = None
+        self._outputModelDirty = True
+        # LL model change counts of each bone, see _modelChanged
+        self._boneVersions = {}
+        self._outputBoneVersions = {}
+        # manual registration parameters last applied by updateLLModel
+        self._appliedParams = None
+        self._partialUpdates = 0
         self.landmarkErrors = None
         self.landmarkRMSE = None
         self.fitMDist = None
+        self.registrationStages = None
+        self.registrationCancelled = False
+        # phase timings, evaluation counts and latencies, see stats
+        self.instrumentation = Instrumentation()
+        # per-iteration registration progress, see progress
+        self.progress = ProgressReporter()
+        # live parameter snapshots during registration, see snapshot
+        self.snapshots = SnapshotBuffer()
+        # (key, batcheval.BatchEvaluator) of the last evaluateBatch
+        self._batchEvaluator = None
 
         # self.regCallback = None
 
     def loadData(self):
-        if self.config['side'] == 'left':
-            self.LL = bonemodels.LowerLimbLeftAtlas('lower_limb_left')
-            self.LL.bone_files = self._boneModelFilenamesLeft
-            self.LL.combined_pcs_filename = self._shapeModelFilenameLeft
-        elif self.config['side'] == 'right':
-            self.LL = bonemodels.LowerLimbRightAtlas('lower_limb_right')
-            self.LL.bone_files = self._boneModelFilenamesRight
-            self.LL.combined_pcs_filename = self._shapeModelFilenameRight
-
-        self.LL.load_bones()
+        """Get a copy of the atlas for the configured side. The atlas files
+        are only parsed the first time, or after they are modified or the
+        cache is invalidated.
+        """
+        with self.instrumentation.phase('loadData'):
+            side = self.config['side']
+            if side in ('left', 'right'):
+                shapeModelFilename, boneModelFilenames = _atlasFilenames(side)
+                self.LL = atlasCache.getAtlas(
+                    side,
+                    boneModelFilenames,
+                    shapeModelFilename,
+                    _loadAtlas,
+                    _atlasBundleFiles(boneModelFilenames),
+                )
+        self._modelChanged()
 
     def resetLL(self):
         self.LL.update_all_models(*self.LL._neutral_params)
+        self._modelChanged()
         self.T = LLTransformData()
         self.landmarkErrors = None
         self.landmarkRMSE = None
+        self.registrationStages = None
 
     def updateFromConfig(self):
         # self.targetLandmarkNames = [self.config['landmarks'][ln] for ln in self.landmarkNames]
-        self.nShapeModes = self.config['pcs_to_fit']
-        if self.kneeCorr:
-            self.LL.enable_knee_adduction_correction()
-        else:
-            self.LL.disable_knee_adduction_correction()
-        if self.kneeDOF:
-            self.LL.enable_knee_adduction_dof
-        else:
-            self.LL.disable_knee_adduction_dof()
+        with self.instrumentation.phase('updateFromConfig'):
+            self.nShapeModes = self.config['pcs_to_fit']
+            if self.kneeCorr:
+                self.LL.enable_knee_adduction_correction()
+            else:
+                self.LL.disable_knee_adduction_correction()
+            if self.kneeDOF:
+                self.LL.enable_knee_adduction_dof
+            else:
+                self.LL.disable_knee_adduction_dof()
 
     def updateLLModel(self):
         """update LL model using current transformations.
         Just shape model deformations
+
+        Only the bones downstream of the parameter groups that changed
+        since the last call are updated, see PARAMETER_GROUP_BONES.
+        Returns the names of the updated bones.
+        """
+        params = self._manualParams()
+        if self._appliedParams is None:
+            changed = set(PARAMETER_GROUP_BONES)
+        else:
+            changed = set(g for g, p in params.items() if not _paramsEqual(p, self._appliedParams[g]))
+        if not changed:
+            return ()
+
+        if ('shape' in changed) or ('pelvis' in changed) or (self._partialUpdates >= MAX_PARTIAL_UPDATES):
+            self.LL.update_all_models(self.T.shapeModeWeights,
+                                      self.T.shapeModes,
+                                      self.T.pelvisRigid,
+                                      self.T.hipRot,
+                                      self.T.kneeRot
+                                      )
+            changed = set(PARAMETER_GROUP_BONES)
+            self._partialUpdates = 0
+        else:
+            # each bone is placed relative to the one before it in the
+            # chain, so everything after the first changed bone is updated
+            if 'hip' in changed:
+                self.LL.update_femur(self.T.hipRot)
+            self.LL.update_tibiafibula(self.T.kneeRot)
+            self.LL.update_patella()
+            self._partialUpdates += 1
+
+        bones = set()
+        for group in changed:
+            bones.update(PARAMETER_GROUP_BONES[group])
+        bones = tuple(mn for mn in self.LL.models if mn in bones)
+        self._modelChanged(bones)
+        self._appliedParams = params
+        return bones
+
+    def _manualParams(self):
+        """Current parameters of each group in PARAMETER_GROUP_BONES.
+        Knee options are part of the knee group as they change how the
+        tibiafibula is placed.
+        """
+        return {'shape': (np.array(self.T.shapeModeWeights), np.array(self.T.shapeModes)),
+                'pelvis': np.array(self.T.pelvisRigid),
+                'hip': np.array(self.T.hipRot),
+                'knee': (np.array(self.T.kneeRot), self.LL._allow_knee_adduction_dof,
+                         self.LL._allow_knee_adduction_correction),
+                }
+
+    def _modelChanged(self, bones=None):
+        """Record that bones of the LL model changed, all if None. If None,
+        the change was not made by updateLLModel, so its next call updates
+        the whole model.
         """
-        self.LL.update_all_models(self.T.shapeModeWeights,
-                                  self.T.shapeModes,
-                                  self.T.pelvisRigid,
-                                  self.T.hipRot,
-                                  self.T.kneeRot
-                                  )
+        if bones is None:
+            bones = PERBONE_SCALING_BONES
+            self._appliedParams = None
+        for mn in bones:
+            self._boneVersions[mn] = self._boneVersions.get(mn, 0) + 1
+        self._outputModelDirty = True
 
     def _preprocessLandmarks(self, l):
         return l
@@ -340,63 +584,132 @@ class LLStepData(object):
 
     @property
     def outputModelDict(self):
-        self._outputModelDict = dict([(m[0], m[1].gf) for m in self.LL.models.items()])
+        """Output geometric fields. Each entry is built on first access and
+        the dict is reused until the LL model is changed by updateLLModel,
+        register, resetLL or loadData. Entries already built from bones
+        that have not changed since are carried over to the new dict.
+        Entries show the LL model as it was when the dict was made, however
+        late they are built, see _makeOutputModelDict.
+        """
+        if self._outputModelDirty or (self._outputModelDict is None):
+            unchanged = self._unchangedOutputModels()
+            self._outputBoneVersions = dict(self._boneVersions)
+            self._outputModelDict = self._makeOutputModelDict(unchanged)
+            self._outputModelDirty = False
+
+        return self._outputModelDict
+
+    def _unchangedOutputModels(self):
+        """Built entries of the current outputModelDict whose bones have
+        not changed since it was made
+        """
+        previous = self._outputModelDict
+        if previous is None:
+            return {}
+        return dict((k, v) for k, v in previous._values.items()
+                    if self._outputBoneVersions.get(OUTPUT_MODEL_BONES[k]) == self._boneVersions.get(OUTPUT_MODEL_BONES[k]))
+
+    def _makeOutputModelDict(self, values=None):
+        """OutputModelDict of the current LL model. The bone fields are
+        captured now, as shallow copies that keep the current field
+        parameter arrays, or as read-only views in outputSubmeshViews mode.
+        LL model updates assign new arrays, so entries built later are
+        built from the captured fields and still show the model as it is
+        now.
+        """
+        from mapclientplugins.fieldworklowerlimbgenerationstep.submeshmap import viewGF
+
+        views = self.outputSubmeshViews
+        if views:
+            parents = dict((mn, viewGF(m.gf)) for mn, m in self.LL.models.items())
+        else:
+            parents = dict((mn, copy.copy(m.gf)) for mn, m in self.LL.models.items())
+        builders = dict((mn, (lambda gf=gf: gf)) for mn, gf in parents.items())
 
         # add pelvis submeshes
-        self._outputModelDict['pelvis flat'] = copy.deepcopy(self._outputModelDict['pelvis'])
-        lh_gf, sac_gf, rh_gf = self._splitPelvisGFs()
-        self._outputModelDict['hemipelvis-left'] = lh_gf
-        self._outputModelDict['sacrum'] = sac_gf
-        self._outputModelDict['hemipelvis-right'] = rh_gf
-        # self._outputModelDict['pelvis'] = self._createNestedPelvis(self._outputModelDict['pelvis flat'])
+        if views:
+            builders['pelvis flat'] = lambda: viewGF(parents['pelvis'])
+        else:
+            builders['pelvis flat'] = lambda: copy.deepcopy(parents['pelvis'])
+        builders['hemipelvis-left'] = lambda: self._makePelvisSubmeshGF('hemipelvis-left', 'LH', parents['pelvis'], views)
+        builders['sacrum'] = lambda: self._makePelvisSubmeshGF('sacrum', 'sac', parents['pelvis'], views)
+        builders['hemipelvis-right'] = lambda: self._makePelvisSubmeshGF('hemipelvis-right', 'RH', parents['pelvis'], views)
+        # builders['pelvis'] = lambda: self._createNestedPelvis(copy.deepcopy(parents['pelvis']))
 
         # add seperate tibia and fibula
-        tibia_gf, fibula_gf = self._splitTibiaFibulaGFs()
-        self._outputModelDict['tibia'] = tibia_gf
-        self._outputModelDict['fibula'] = fibula_gf
+        builders['tibia'] = lambda: self._makeTibiaFibulaSubmeshGF('tibia', parents['tibiafibula'], views)
+        builders['fibula'] = lambda: self._makeTibiaFibulaSubmeshGF('fibula', parents['tibiafibula'], views)
+        return OutputModelDict(self._timedBuilders(builders), values)
 
-        return self._outputModelDict
+    def _timedBuilders(self, builders):
+        """Wrap outputModelDict builders to record their run time as the
+        outputModelDict phase
+        """
+        def timed(builder):
+            def build():
+                with self.instrumentation.phase('outputModelDict'):
+                    return builder()
+            return build
+
+        return dict((k, timed(b)) for k, b in builders.items())
+
+    def _makeSubmeshGF(self, bone, name, elements, basisTypes, parent=None, view=False):
+        """Make a submesh of a bone by slicing the field parameters of
+        parent, the bone's current field if None, with a node map that is
+        computed once per atlas mesh. If view, return a read-only view of
+        parent's field parameters instead of a copy.
+        """
+        from mapclientplugins.fieldworklowerlimbgenerationstep.submeshmap import submeshMapCache
+
+        gf = self.LL.models[bone].gf
+        if parent is None:
+            parent = gf
+        key = (type(self.LL).__name__, tuple(self.LL.bone_files[bone]), name)
+        submeshMap = submeshMapCache.getMap(key, gf, name, elements, basisTypes)
+        if view:
+            return submeshMap.makeView(parent)
+        else:
+            return submeshMap.makeGF(parent)
 
-    def _splitTibiaFibulaGFs(self):
-        tibfib = self.LL.models['tibiafibula'].gf
-        tib = tibfib.makeGFFromElements(
-            'tibia',
-            TIBFIB_SUBMESH_ELEMS['tibia'],
+    def _makeTibiaFibulaSubmeshGF(self, name, parent=None, view=False):
+        return self._makeSubmeshGF(
+            'tibiafibula',
+            name,
+            TIBFIB_SUBMESH_ELEMS[name],
             TIBFIB_BASISTYPES,
+            parent,
+            view,
         )
-        fib = tibfib.makeGFFromElements(
-            'fibula',
-            TIBFIB_SUBMESH_ELEMS['fibula'],
-            TIBFIB_BASISTYPES,
+
+    def _makePelvisSubmeshGF(self, name, submesh, parent=None, view=False):
+        return self._makeSubmeshGF(
+            'pelvis',
+            name,
+            PELVIS_SUBMESH_ELEMS[submesh],
+            PELVIS_BASISTYPES,
+            parent,
+            view,
         )
 
+    def _splitTibiaFibulaGFs(self):
+        tib = self._makeTibiaFibulaSubmeshGF('tibia')
+        fib = self._makeTibiaFibulaSubmeshGF('fibula')
         return tib, fib
 
     def _splitPelvisGFs(self):
         """ Given a flattened pelvis model, create left hemi, sacrum,
         and right hemi meshes
         """
-        gf = self.LL.models['pelvis'].gf
-        lhgf = gf.makeGFFromElements(
-            'hemipelvis-left',
-            PELVIS_SUBMESH_ELEMS['LH'],
-            PELVIS_BASISTYPES
-        )
-        sacgf = gf.makeGFFromElements(
-            'sacrum',
-            PELVIS_SUBMESH_ELEMS['sac'],
-            PELVIS_BASISTYPES
-        )
-        rhgf = gf.makeGFFromElements(
-            'hemipelvis-right',
-            PELVIS_SUBMESH_ELEMS['RH'],
-            PELVIS_BASISTYPES
-        )
+        lhgf = self._makePelvisSubmeshGF('hemipelvis-left', 'LH')
+        sacgf = self._makePelvisSubmeshGF('sacrum', 'sac')
+        rhgf = self._makePelvisSubmeshGF('hemipelvis-right', 'RH')
         return lhgf, sacgf, rhgf
 
     def _createNestedPelvis(self, gf):
         """ Given a flattened pelvis model, create a hierarchical model
         """
+        from gias3.fieldwork.field import geometric_field
+
         newgf = geometric_field.GeometricField(
             gf.name, 3,
             field_dimensions=2,
@@ -466,10 +779,24 @@ class LLStepData(object):
         if '' in self.targetLandmarkNames:
             raise ValueError('Null string in targetLandmarkNames')
 
-        self._targetLandmarks = np.array([self.inputLandmarks[n] for n in self.targetLandmarkNames])
-        self._targetLandmarks = self._preprocessLandmarks(self._targetLandmarks)
+        with self.instrumentation.phase('targetLandmarks'):
+            self._targetLandmarks = np.array([self.inputLandmarks[n] for n in self.targetLandmarkNames])
+            self._targetLandmarks = self._preprocessLandmarks(self._targetLandmarks)
         return self._targetLandmarks
 
+    @property
+    def stats(self):
+        """Phase timings, counters and latency histograms recorded by
+        self.instrumentation, as a dict with keys 'phases', 'counters' and
+        'latency'. Phases are loadData, updateFromConfig, targetLandmarks,
+        optimizer, outputModelDict and register. Counters are
+        objectiveEvaluations and iterations of the optimiser. Latency
+        'modelEvaluation' is each evaluation of the model by the objective
+        function. Set self.instrumentation.jsonLinesFile to also write
+        them as JSON lines.
+        """
+        return self.instrumentation.asDict()
+
     @property
     def inputModelDict(self):
         return self._inputModelDict
@@ -490,6 +817,52 @@ class LLStepData(object):
     def nShapeModes(self):
         return int(self.config['pcs_to_fit'])
 
+    @property
+    def pcSchedule(self):
+        """Numbers of shape modes to fit in successive stages of a shape
+        model registration, or None to fit all in one stage. Set by the
+        'pc_schedule' config entry: '' for none, 'auto' for rigid-only
+        then 1, 2, 4, ... modes, or comma-separated numbers of modes with
+        0 for rigid-only. The last stage always fits nShapeModes.
+        """
+        return parsePCSchedule(self.config.get('pc_schedule', ''), self.nShapeModes)
+
+    @property
+    def warmStartDir(self):
+        """Directory of fitted transforms keyed by target landmarks, set by
+        the 'warm_start_dir' config entry. If set, register starts from
+        the saved fit of the same landmarks when it would otherwise start
+        from the default transform, and saves its result there. '' to
+        disable.
+        """
+        return self.config.get('warm_start_dir', '')
+
+    def _warmStartKey(self):
+        return warmstart.landmarkSetHash(self.config['side'], self.landmarkNames, self.targetLandmarks)
+
+    def loadWarmStart(self):
+        """Set self.T from the fit saved in warmStartDir for the current
+        target landmarks. The saved fit is only used if its knee options
+        match the config. Returns True if it was used.
+        """
+        d = warmstart.loadTransform(self.warmStartDir, self._warmStartKey())
+        if d is None:
+            return False
+        if (d['kneeDOF'] != self.kneeDOF) or (d['kneeCorr'] != self.kneeCorr):
+            log.info('not warm starting, saved fit has different knee options')
+            return False
+        self.T.setFromDict(d)
+        log.info('warm starting from saved fit')
+        return True
+
+    def saveWarmStart(self):
+        """Save self.T to warmStartDir for the current target landmarks
+        """
+        d = self.T.toDict()
+        d['kneeDOF'] = self.kneeDOF
+        d['kneeCorr'] = self.kneeCorr
+        warmstart.saveTransform(self.warmStartDir, self._warmStartKey(), d)
+
     @property
     def markerRadius(self):
         return float(self.config['marker_radius'])
@@ -541,8 +914,16 @@ class LLStepData(object):
             self.config['knee_dof'] = 'False'
             self.LL.disable_knee_adduction_dof()
 
-    def register(self, callbackSignal=None):
+    def register(self, callbackSignal=None, cancelToken=None):
+        """Register the lower limb to the target landmarks using the
+        current config. If cancelToken, a cancellation.CancellationToken,
+        is cancelled during the fit, the fit stops and the best parameters
+        so far are applied and returned with fitInfo['cancelled'] True.
+        """
+        t0 = time.perf_counter()
+        self.progress.start()
         self.updateFromConfig()
+        self._modelChanged()
         mode = self.config['registration_mode']
 
         if self.targetLandmarks is None:
@@ -554,38 +935,952 @@ class LLStepData(object):
         else:
             callback = None
 
+        output = None
+        if self.resultCacheDir:
+            cacheKey = self._resultCacheKey()
+            output = self._loadCachedResult(cacheKey)
+        if output is None:
+            output = self._registerMode(mode, callback, cancelToken)
+            if self.resultCacheDir and not output[3].get('cancelled'):
+                self._saveCachedResult(cacheKey, output)
+        self.registrationCancelled = bool(output[3].get('cancelled'))
+
+        self._modelChanged()
+        self.progress.finish(output[2], self.T.nShapeModes if mode == 'shapemodel' else None)
+        self.instrumentation.addPhase('register', time.perf_counter() - t0)
+        self.instrumentation.emitSummary(mode=mode, rmse=float(output[2]))
+        return output
+
+    def applySnapshot(self, snapshot):
+        """Update the lower limb model with the parameters of a
+        snapshot.ModelSnapshot published during registration. Call from
+        SnapshotBuffer.apply while self.snapshots is open.
+        """
+        _updateAtlasFromX(self.LL, snapshot.mode, snapshot.shapeModes, snapshot.x)
+        self._modelChanged()
+
+    def _registerMode(self, mode, callback=None, cancelToken=None):
+        self.registrationStages = None
+        if self.warmStartDir and _isDefaultTransform(self.T, mode):
+            self.loadWarmStart()
+
         if mode == 'shapemodel':
             if self.T.shapeModes is None:
                 raise RuntimeError('Number of pcs to fit not defined')
             else:
-                print('shape models {}'.format(self.T.shapeModes))
+                log.debug('shape models %s', self.T.shapeModes)
             if self.mWeight is None:
                 raise RuntimeError('Mahalanobis penalty weight not defined')
-            output = _registerShapeModel(self, callback)
+            if self.pcSchedule is None:
+                output = _registerShapeModel(self, callback, cancelToken)
+            else:
+                output = _registerShapeModelSchedule(self, callback, cancelToken)
         elif mode == 'uniformscaling':
-            output = _registerUniformScaling(self)
+            output = _registerUniformScaling(self, cancelToken=cancelToken)
         elif mode == 'perbonescaling':
-            output = _registerPerBoneScaling(self)
+            output = _registerPerBoneScaling(self, cancelToken=cancelToken)
+        if self.warmStartDir and not output[3].get('cancelled'):
+            self.saveWarmStart()
         return output
 
+    @property
+    def resultCacheDir(self):
+        """Directory of the registration result cache, set by the
+        'result_cache_dir' config entry. If set, register returns the
+        cached result of a registration with the same target landmarks,
+        config, starting transform and atlas files instead of fitting. ''
+        to disable.
+        """
+        return self.config.get('result_cache_dir', '')
+
+    @property
+    def outputSubmeshViews(self):
+        """If True, set by the 'output_submesh_views' config entry,
+        outputModelDict entries are snapshots of the LL model whose field
+        parameters are read-only views sharing storage with it instead of
+        copies. Writing into them in place raises; gias3 transforms give
+        them their own parameters. See submeshmap.
+        """
+        return self.config.get('output_submesh_views', 'False') == 'True'
+
+    @outputSubmeshViews.setter
+    def outputSubmeshViews(self, value):
+        self.config['output_submesh_views'] = str(bool(value))
+        # entries of the other mode are not carried over
+        self._outputModelDict = None
+
+    def _atlasFiles(self):
+        shapeModelFilename, boneModelFilenames = _atlasFilenames(
+            'left' if self.config['side'] == 'left' else 'right')
+        return [shapeModelFilename] + [f for b in sorted(boneModelFilenames) for f in boneModelFilenames[b]]
+
+    def _resultCacheKey(self):
+        """Hash of everything a registration result depends on. Call
+        before the registration changes self.T.
+        """
+        config = self.config
+        # the saved fit _registerMode would warm start from, if any
+        warmStart = None
+        if self.warmStartDir and _isDefaultTransform(self.T, config['registration_mode']):
+            warmStart = warmstart.loadTransform(self.warmStartDir, self._warmStartKey())
+        return resultcache.makeKey({
+            'targetLandmarks': np.round(self.targetLandmarks, warmstart.HASH_DECIMALS) + 0.0,
+            'landmarks': [[n, config['landmarks'][n]] for n in self.landmarkNames],
+            'registration_mode': config['registration_mode'],
+            'pcs_to_fit': config['pcs_to_fit'],
+            'mweight': config['mweight'],
+            'knee_corr': config['knee_corr'],
+            'knee_dof': config['knee_dof'],
+            'side': config['side'],
+            'pc_schedule': config.get('pc_schedule', ''),
+            'warm_start': warmStart,
+            'minArgs': self.minArgs,
+            'start': self.T.toDict(),
+            'atlas': [resultcache.fileChecksum(f) for f in self._atlasFiles()],
+        })
+
+    def _loadCachedResult(self, key):
+        """Apply the cached registration result for key and return it as
+        returned by register, or return None if there is none
+        """
+        entry = resultcache.ResultCache(self.resultCacheDir, self.resultCacheMaxBytes).get(key)
+        if entry is None:
+            self.instrumentation.count('resultCacheMisses')
+            return None
+
+        self.T.setFromDict(entry['transform'])
+        x = _xFromTransform(self)
+        _setTransformX(self, x)
+        _updateLLFromX(self, x)
+        self.landmarkErrors = np.array(entry['landmarkErrors'])
+        self.landmarkRMSE = entry['landmarkRMSE']
+        self.fitMDist = entry['fitMDist']
+        self.registrationStages = entry['registrationStages']
+        self.instrumentation.count('resultCacheHits')
+        log.info('registration result loaded from cache')
+        fitInfo = {'result_cache_hit': True}
+        if self.registrationStages is not None:
+            fitInfo['stages'] = self.registrationStages
+        return [x], self.landmarkErrors, self.landmarkRMSE, fitInfo
+
+    def _saveCachedResult(self, key, output):
+        entry = {'transform': self.T.toDict(),
+                 'landmarkErrors': np.asarray(output[1]).tolist(),
+                 'landmarkRMSE': float(output[2]),
+                 'fitMDist': float(self.fitMDist),
+                 'registrationStages': self.registrationStages,
+                 }
+        resultcache.ResultCache(self.resultCacheDir, self.resultCacheMaxBytes).put(key, entry)
+
+    def registerBatch(self, landmarksList, nWorkers=None, outputModels=True):
+        """Register the lower limb to each landmark dict in landmarksList
+        using the current config, in parallel over nWorkers processes.
+
+        The atlas is loaded once in this process before the workers start.
+        Where processes are forked, workers get it from the atlas cache
+        without reloading; otherwise each worker loads it once.
+
+        Returns a list of result dicts in the same order as landmarksList.
+        Each has keys 'xFitted', 'landmarkErrors', 'landmarkRMSE',
+        'fitMDist', 'transform', 'outputModelDict' (None if outputModels is
+        False) and 'error'. If a subject's registration raises, 'error' is
+        the formatted traceback and the other values are None.
+
+        Results from worker processes are pickled, so in
+        outputSubmeshViews mode their outputModelDict entries no longer
+        share storage, and their field parameters are writeable copies.
+        """
+        if self.LL is None:
+            self.loadData()
+
+        config = copy.deepcopy(self.config)
+        if nWorkers is None:
+            nWorkers = os.cpu_count() or 1
+        nWorkers = max(1, min(nWorkers, len(landmarksList)))
+
+        if nWorkers == 1:
+            lldata = LLStepData(config)
+            lldata.loadData()
+            results = []
+            for l in landmarksList:
+                result = _registerSubject(lldata, l, outputModels)
+                # bone fields share their meshes and field parameter
+                # arrays with lldata.LL, copy them as the workers' results
+                # are. Views are read-only.
+                if not lldata.outputSubmeshViews:
+                    result['outputModelDict'] = copy.deepcopy(result['outputModelDict'])
+                results.append(result)
+            return results
+
+        with _makeWorkerPool(config, nWorkers) as executor:
+            results = list(executor.map(
+                _registerBatchWorker,
+                landmarksList,
+                [outputModels, ] * len(landmarksList),
+            ))
+
+        return results
+
+    def registerMultiStart(self, nStarts, nWorkers=None, rmseThreshold=None, seed=None):
+        """Register from nStarts initial poses in parallel over nWorkers
+        processes and keep the fit with the lowest landmark RMSE.
+
+        Start 0 is the current pelvisRigid, hipRot and kneeRot, or the
+        initial pelvis alignment of the fit functions if the pose has not
+        been set. The other starts perturb it by multiStartSD. Shape mode
+        weights and scalings start from their defaults. If rmseThreshold
+        is given, the other starts are cancelled as soon as a fit reaches
+        an RMSE at or below it: starts that have not begun are dropped and
+        running starts stop at their next model evaluation.
+
+        The best fit is applied to this LLStepData as by register. Returns
+        a list of result dicts as for registerBatch (without
+        outputModelDict), in start order, with an extra key 'start'.
+        Cancelled starts are None.
+        """
+        if self.LL is None:
+            self.loadData()
+        self.updateFromConfig()
+        if self.targetLandmarks is None:
+            raise RuntimeError('Target Landmarks not set')
+
+        starts = self._makeStarts(nStarts, seed)
+        config = copy.deepcopy(self.config)
+        # starts neither warm start nor save, the best fit is saved below
+        config['warm_start_dir'] = ''
+        if nWorkers is None:
+            nWorkers = os.cpu_count() or 1
+        nWorkers = max(1, min(nWorkers, nStarts))
+
+        results = [None, ] * nStarts
+
+        def done(result):
+            return (rmseThreshold is not None) and \
+                   (result['error'] is None) and \
+                   (result['landmarkRMSE'] <= rmseThreshold)
+
+        if nWorkers == 1:
+            lldata = LLStepData(config)
+            lldata.loadData()
+            for i, start in enumerate(starts):
+                results[i] = _registerSubject(lldata, self.inputLandmarks, False, start)
+                results[i]['start'] = start
+                if done(results[i]):
+                    break
+        else:
+            # set to stop the starts running in the workers
+            cancelEvent = _workerContext().Event()
+            with _makeWorkerPool(config, nWorkers, cancelEvent) as executor:
+                futures = dict(
+                    (executor.submit(_registerStartWorker, self.inputLandmarks, start), i)
+                    for i, start in enumerate(starts)
+                )
+                for future in as_completed(futures):
+                    i = futures[future]
+                    results[i] = future.result()
+                    results[i]['start'] = starts[i]
+                    if done(results[i]):
+                        cancelEvent.set()
+                        executor.shutdown(wait=True, cancel_futures=True)
+                        break
+
+        fitted = [r for r in results if (r is not None) and (r['error'] is None)]
+        if not fitted:
+            raise RuntimeError('All registration starts failed')
+        best = min(fitted, key=lambda r: r['landmarkRMSE'])
+
+        self.T = copy.deepcopy(best['transform'])
+        self.landmarkErrors = best['landmarkErrors']
+        self.landmarkRMSE = best['landmarkRMSE']
+        self.fitMDist = best['fitMDist']
+        _updateLLFromX(self, best['xFitted'][-1])
+        self._modelChanged()
+        if self.warmStartDir:
+            self.saveWarmStart()
+        return results
+
+    def _makeStarts(self, nStarts, seed=None):
+        """Initial poses for registerMultiStart. Each is a dict of
+        pelvisRigid, hipRot and kneeRot.
+        """
+        from gias3.musculoskeletal.bonemodels import modelcore
+        from mapclientplugins.fieldworklowerlimbgenerationstep import landmarkmodel
+        from mapclientplugins.fieldworklowerlimbgenerationstep import shapemodelfit
+
+        pelvisRigid = np.array(self.T.pelvisRigid)
+        hipRot = np.array(self.T.hipRot)
+        kneeRot = np.array(self.T.kneeRot)
+        if np.all(pelvisRigid == 0.0):
+            # initial alignment of the fit functions, from the neutral model
+            ll = landmarkmodel.makeLandmarkAtlas(self.LL)
+            ll.update_all_models(*ll._neutral_params)
+            getSourceLandmarks = modelcore.make_source_landmark_getter(self.landmarkNames)
+            sourceLandmarks = getSourceLandmarks(ll, np.zeros((len(self.landmarkNames), 3)))
+            pelvisRigid = shapemodelfit.initialPelvisRigid(self.targetLandmarks, sourceLandmarks)
+
+        rng = np.random.RandomState(seed)
+        sd = self.multiStartSD
+        starts = []
+        for i in range(nStarts):
+            start = {'pelvisRigid': pelvisRigid.copy(),
+                     'hipRot': hipRot.copy(),
+                     'kneeRot': kneeRot.copy(),
+                     }
+            if i > 0:
+                start['pelvisRigid'][:3] += rng.normal(0.0, sd['pelvisTranslation'], 3)
+                start['pelvisRigid'][3:] += rng.normal(0.0, sd['pelvisRotation'], 3)
+                start['hipRot'] += rng.normal(0.0, sd['hipRot'], 3)
+                start['kneeRot'][0] += rng.normal(0.0, sd['kneeRot'])
+            starts.append(start)
+
+        return starts
+
+    def evaluateBatch(self, X, shapeModes=None, landmarkNames=None, nodes=False):
+        """Evaluate the shape model for each row of parameters X (K x
+        nParams), laid out as the x of the shapemodel registration mode:
+        [pc weights, pelvis rigid (6), hip rot (3), knee rot (1 or 2)].
+        shapeModes defaults to those of self.T and landmarkNames to
+        self.landmarkNames.
+
+        Returns the landmark positions (K x nLandmarks x 3) and, if nodes,
+        also a dict of the node coordinates (K x nNodes x 3) of each bone.
+        self.LL is not modified. See batcheval.
+        """
+        from mapclientplugins.fieldworklowerlimbgenerationstep import batcheval
+
+        if self.LL is None:
+            self.loadData()
+        if shapeModes is None:
+            shapeModes = self.T.shapeModes
+        if landmarkNames is None:
+            landmarkNames = self.landmarkNames
+
+        key = (id(self.LL), tuple(np.ravel(shapeModes)), tuple(landmarkNames), self.kneeCorr, self.kneeDOF)
+        if self._batchEvaluator is None or self._batchEvaluator[0] != key:
+            self._batchEvaluator = (key, batcheval.BatchEvaluator(self.LL, landmarkNames, shapeModes))
+        return self._batchEvaluator[1].evaluate(X, nodes)
+
+    def registerTrial(self, frames, shapeLandmarks=None):
+        """Pose the lower limb through a motion capture trial. frames is an
+        iterable of landmark dicts like inputLandmarks, e.g. a generator
+        reading a trial file. The subject's shape is registered once with
+        the current config to shapeLandmarks, or to the first frame if
+        None. Then only pelvisRigid, hipRot and kneeRot are fitted to each
+        frame by least squares, see trialFitArgs, starting from the pose of
+        the previous frame.
+
+        Returns a generator that yields a dict per frame with keys
+        'frame', 'pelvisRigid', 'hipRot', 'kneeRot', 'landmarkErrors',
+        'landmarkRMSE', 'nfev' and 'error', reading one frame at a time.
+        Target landmarks that are missing from a frame or NaN are left out
+        of its fit, and their errors are NaN. A frame without any keeps
+        the previous pose and has 'error' set. self.T and self.LL keep the
+        shape registration.
+        """
+        from mapclientplugins.fieldworklowerlimbgenerationstep import landmarkmodel
+        from mapclientplugins.fieldworklowerlimbgenerationstep import shapemodelfit
+
+        frames = iter(frames)
+        if shapeLandmarks is None:
+            try:
+                shapeLandmarks = next(frames)
+            except StopIteration:
+                return
+            frames = itertools.chain([shapeLandmarks], frames)
+        self.inputLandmarks = shapeLandmarks
+        self.register()
+
+        mode = self.config['registration_mode']
+        shapeX = _xFromTransform(self)[0]
+        pose = [np.array(self.T.pelvisRigid), np.array(self.T.hipRot), np.array(self.T.kneeRot)]
+        landmarkNames = self.landmarkNames
+        targetNames = self.targetLandmarkNames
+        eps = self.minArgs.get('options', {}).get('eps', shapemodelfit.DEFAULT_EPS)
+        atlas = landmarkmodel.makeLandmarkAtlas(self.LL)
+        missing = np.full(3, np.nan)
+
+        for i, frame in enumerate(frames):
+            targets = np.array([frame.get(n, missing) for n in targetNames], dtype=float)
+            targets = self._preprocessLandmarks(targets)
+            valid = np.isfinite(targets).all(1)
+            result = {'frame': i,
+                      'pelvisRigid': np.array(pose[0]),
+                      'hipRot': np.array(pose[1]),
+                      'kneeRot': np.array(pose[2]),
+                      'landmarkErrors': None,
+                      'landmarkRMSE': None,
+                      'nfev': 0,
+                      'error': None,
+                      }
+            if not valid.any():
+                result['error'] = 'no target landmarks in frame'
+                yield result
+                continue
+
+            # the fitted shape with a neutral pelvis, reset every frame so
+            # that re-placing the joints does not accumulate round-off
+            _updateAtlasFromX(atlas, mode, self.T.shapeModes,
+                              [shapeX, np.zeros(atlas.N_PARAMS_PELVIS), pose[1], pose[2]])
+            pose, dist, rmse, optResults = shapemodelfit.fitPose(
+                atlas,
+                targets[valid],
+                [ln for ln, v in zip(landmarkNames, valid) if v],
+                np.hstack(pose),
+                least_squares_args=self.trialFitArgs,
+                eps=eps,
+            )
+            errors = np.full(len(landmarkNames), np.nan)
+            errors[valid] = dist
+            result.update({'pelvisRigid': pose[0],
+                           'hipRot': pose[1],
+                           'kneeRot': pose[2],
+                           'landmarkErrors': errors,
+                           'landmarkRMSE': rmse,
+                           'nfev': optResults['nfev'],
+                           })
+            yield result
+
+    def writeTrial(self, directory, frames, shapeLandmarks=None, nodes=False,
+                   chunkFrames=trialstore.DEFAULT_CHUNK_FRAMES):
+        """Pose the lower limb through a motion capture trial with
+        registerTrial and append each frame to the trialstore in
+        directory, as arrays pelvisRigid, hipRot, kneeRot, landmarkErrors
+        and landmarkRMSE, NaN for frames without landmarks, and if nodes
+        the node coordinates (nNodes x 3) of each bone as nodes_<bone>.
+        The store's attrs record the side, registration mode, landmark
+        names and the shape registration transform. Memory use does not
+        grow with the number of frames. Read the store with
+        trialstore.TrialReader.
+
+        Returns the number of frames written.
+        """
+        mode = self.config['registration_mode']
+        nFrames = 0
+        writer = None
+        try:
+            for result in self.registerTrial(frames, shapeLandmarks):
+                if writer is None:
+                    # the shape is registered before the first frame
+                    shapeX = _xFromTransform(self)[0]
+                    attrs = {'side': self.config['side'],
+                             'registrationMode': mode,
+                             'landmarkNames': self.landmarkNames,
+                             'transform': self.T.toDict(),
+                             }
+                    writer = trialstore.TrialWriter(directory, chunkFrames, attrs)
+
+                frame = {'pelvisRigid': result['pelvisRigid'],
+                         'hipRot': result['hipRot'],
+                         'kneeRot': result['kneeRot'],
+                         'landmarkErrors': result['landmarkErrors'],
+                         'landmarkRMSE': result['landmarkRMSE'],
+                         }
+                if result['error'] is not None:
+                    frame['landmarkErrors'] = np.full(len(self.landmarkNames), np.nan)
+                    frame['landmarkRMSE'] = np.nan
+                if nodes:
+                    _updateAtlasFromX(self.LL, mode, self.T.shapeModes,
+                                      [shapeX, result['pelvisRigid'], result['hipRot'], result['kneeRot']])
+                    for name, model in self.LL.models.items():
+                        frame['nodes_' + name] = model.gf.field_parameters[:, :, 0].T
+                writer.append(frame)
+                nFrames += 1
+        finally:
+            if writer is not None:
+                writer.close()
+                if nodes:
+                    # back to the shape registration
+                    _updateLLFromX(self, _xFromTransform(self))
+                    self._modelChanged()
+        return nFrames
+
+
+def _atlasBundleFiles(boneFiles):
+    """The files of the bundles _loadAtlas would use for boneFiles
+    """
+    from mapclientplugins.fieldworklowerlimbgenerationstep.atlasbundle import bundleDirectory, bundleFilenames
+
+    return [f for bn in sorted(boneFiles)
+            for f in bundleFilenames(bundleDirectory(DEFAULT_BUNDLE_ROOT, boneFiles[bn][0]))]
+
+
+def _loadAtlas(side, boneFiles, shapeModelFilename):
+    """Load an atlas, using binary bundles under DEFAULT_BUNDLE_ROOT for
+    the bone models where they have been generated.
+    """
+    # gias3 bonemodels is only imported once an atlas is needed
+    from mapclientplugins.fieldworklowerlimbgenerationstep.atlasbundle import BundledLowerLimbLeftAtlas, \
+        BundledLowerLimbRightAtlas
+
+    if side == 'left':
+        LL = BundledLowerLimbLeftAtlas('lower_limb_left')
+    elif side == 'right':
+        LL = BundledLowerLimbRightAtlas('lower_limb_right')
+    else:
+        raise ValueError('Invalid side {}'.format(side))
+
+    LL.bundle_root = DEFAULT_BUNDLE_ROOT
+    LL.bone_files = boneFiles
+    LL.combined_pcs_filename = shapeModelFilename
+    LL.load_bones()
+    return LL
+
+
+def _workerContext():
+    """Multiprocessing context of worker pools. Workers are forked where
+    possible so that they start with the atlases already in the atlas
+    cache.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def _makeWorkerPool(config, nWorkers, cancelEvent=None):
+    """Process pool whose workers each hold an LLStepData for config.
+    If cancelEvent, an Event of _workerContext(), is given, registrations
+    run by _registerStartWorker are cancelled when it is set.
+    """
+    return ProcessPoolExecutor(max_workers=nWorkers,
+                               mp_context=_workerContext(),
+                               initializer=_initBatchWorker,
+                               initargs=(config, cancelEvent))
+
+
+def _updateAtlasFromX(ll, mode, shapeModes, x):
+    """Update atlas ll with parameters x, split as returned by the fit
+    function of registration mode
+    """
+    if mode == 'shapemodel':
+        ll.update_all_models(x[0], shapeModes, x[1], x[2], x[3])
+    elif mode == 'uniformscaling':
+        ll.update_all_models_uniform_scaling(x[0], x[1], x[2], x[3])
+    elif mode == 'perbonescaling':
+        ll.update_all_models_multi_scaling(x[0], x[1], x[2], x[3])
+
+
+def _updateLLFromX(lldata, x):
+    """Update the LL model with fitted parameters x, split as returned by
+    the fit function of the current registration mode
+    """
+    _updateAtlasFromX(lldata.LL, lldata.config['registration_mode'], lldata.T.shapeModes, x)
+
+
+def _xFromTransform(lldata):
+    """The fitted parameters of the current registration mode from
+    lldata.T, split as returned by the mode's fit function
+    """
+    T = lldata.T
+    mode = lldata.config['registration_mode']
+    if mode == 'shapemodel':
+        first = np.array(T.shapeModeWeights)
+    elif mode == 'uniformscaling':
+        first = T.uniformScaling
+    elif mode == 'perbonescaling':
+        first = [PERBONE_SCALING_BONES,
+                 np.array([T.pelvisScaling, T.femurScaling, T.patellaScaling, T.tibfibScaling])]
+    return [first, np.array(T.pelvisRigid), np.array(T.hipRot), np.array(T.kneeRot)]
+
+
+def _setTransformX(lldata, x):
+    """Set the parameters of the current registration mode in lldata.T
+    from x, as after a fit of the mode
+    """
+    mode = lldata.config['registration_mode']
+    if mode == 'shapemodel':
+        lldata.T.shapeModelX = x
+    elif mode == 'uniformscaling':
+        lldata.T.uniformScalingX = x
+    elif mode == 'perbonescaling':
+        lldata.T.perBoneScalingX = x
+
+
+def _registerSubject(lldata, landmarks, outputModels=True, start=None, cancelToken=None):
+    result = {'xFitted': None,
+              'landmarkErrors': None,
+              'landmarkRMSE': None,
+              'fitMDist': None,
+              'transform': None,
+              'outputModelDict': None,
+              'error': None,
+              }
+    try:
+        lldata.resetLL()
+        lldata.inputLandmarks = landmarks
+        if start is not None:
+            lldata.T.kneeDOF = lldata.kneeDOF
+            lldata.T.pelvisRigid = start['pelvisRigid']
+            lldata.T.hipRot = start['hipRot']
+            lldata.T.kneeRot = start['kneeRot']
+        xFitted = lldata.register(cancelToken=cancelToken)[0]
+        result['xFitted'] = xFitted
+        result['landmarkErrors'] = lldata.landmarkErrors
+        result['landmarkRMSE'] = lldata.landmarkRMSE
+        result['fitMDist'] = lldata.fitMDist
+        result['transform'] = copy.deepcopy(lldata.T)
+        if outputModels:
+            # build every entry before lldata moves on to the next subject
+            result['outputModelDict'] = dict(lldata.outputModelDict)
+    except Exception:
+        result['error'] = traceback.format_exc()
+
+    return result
+
+
+# per-process LLStepData used by registerBatch workers, and the token
+# that cancels their registrations of multi-start starts
+_batchWorkerData = None
+_batchWorkerCancelToken = None
+
+
+def _initBatchWorker(config, cancelEvent=None):
+    global _batchWorkerData, _batchWorkerCancelToken
+    _batchWorkerData = LLStepData(config)
+    _batchWorkerData.loadData()
+    if cancelEvent is not None:
+        _batchWorkerCancelToken = CancellationToken(cancelEvent)
+
+
+def _registerBatchWorker(landmarks, outputModels):
+    return _registerSubject(_batchWorkerData, landmarks, outputModels)
+
+
+def _registerStartWorker(landmarks, start):
+    return _registerSubject(_batchWorkerData, landmarks, False, start, _batchWorkerCancelToken)
+
+
+def _scipyMinArgs(minArgs):
+    if minArgs.get('jac') == 'analytic':
+        minArgs = dict(minArgs)
+        minArgs['jac'] = False
+    return minArgs
+
+
+def _runFit(lldata, updateMethodName, fitFunc, ll, *args, cancelToken=None, **kwargs):
+    """Run fitFunc(ll, *args, **kwargs) as the optimizer phase of
+    lldata.instrumentation. Each call of ll.updateMethodName is timed as a
+    model evaluation, and the optimiser's objective evaluations and
+    iterations are counted.
+
+    If cancelToken is given, calls of ll.updateMethodName raise
+    RegistrationCancelled once it is cancelled, see _cancellableUpdates.
+    If the fit is cancelled, by that or by its callback, returns the
+    output of _cancelledFit.
+
+    lldata.snapshots is open during the fit, so ll must not be lldata.LL.
+    """
+    instrumentation = lldata.instrumentation
+    try:
+        with instrumentation.phase('optimizer'), \
+                instrumentation.timeCalls(ll, updateMethodName, 'modelEvaluation'), \
+                _cancellableUpdates(lldata, ll, updateMethodName, cancelToken), \
+                lldata.snapshots.publishing():
+            output = fitFunc(ll, *args, **kwargs)
+    except RegistrationCancelled as e:
+        log.info('registration cancelled')
+        return _cancelledFit(lldata, e.x)
+    optResults = output[3]['min_results']
+    instrumentation.count('objectiveEvaluations', optResults['nfev'])
+    instrumentation.count('iterations', optResults.get('nit', 0))
+    return output
+
+
+def _cancelledFit(lldata, xOpt=None):
+    """Update lldata.LL with the parameters xOpt of a cancelled fit,
+    split as returned by the fit function of the registration mode, or
+    with lldata.T if None. Returns outputs as for the fit function.
+    """
+    from gias3.musculoskeletal.bonemodels import modelcore
+
+    if xOpt is None:
+        xOpt = _xFromTransform(lldata)
+    _updateLLFromX(lldata, xOpt)
+    getSourceLandmarks = modelcore.make_source_landmark_getter(lldata.landmarkNames)
+    targetLandmarks = lldata.targetLandmarks
+    sourceLandmarks = getSourceLandmarks(lldata.LL, np.zeros(targetLandmarks.shape, dtype=float))
+    optLandmarkDist = np.sqrt(((targetLandmarks - sourceLandmarks) ** 2.0).sum(1))
+    optLandmarkRMSE = np.sqrt((optLandmarkDist ** 2.0).mean())
+    if lldata.config['registration_mode'] == 'shapemodel':
+        mDist = np.sqrt((np.asarray(xOpt[0]) ** 2.0).sum())
+    else:
+        mDist = -1.0
+    fitInfo = {'cancelled': True,
+               'min_results': None,
+               'mahalanobis_distance': mDist,
+               }
+    return [xOpt], optLandmarkDist, optLandmarkRMSE, fitInfo
+
+
+def _makeShapeModelCancelCallback(ll, nModes, cancelToken, callback=None):
+    """Returns an optimiser callback for a shape model fit of nModes on
+    atlas ll that calls callback if given, then raises
+    RegistrationCancelled with the current iterate if cancelToken has been
+    cancelled. Iterates of descent methods such as the default L-BFGS-B
+    only decrease the objective, so the current iterate is the best so
+    far.
+    """
+    iHip = nModes + ll.N_PARAMS_PELVIS
+    iKnee = iHip + ll.N_PARAMS_HIP
+
+    def cancelCallback(x):
+        if callback is not None:
+            callback(x)
+        if cancelToken.cancelled:
+            x = np.array(x)
+            raise RegistrationCancelled([x[:nModes], x[nModes:iHip], x[iHip:iKnee], x[iKnee:]])
+
+    return cancelCallback
+
+
+@contextlib.contextmanager
+def _cancellableUpdates(lldata, ll, methodName, cancelToken=None):
+    """Within the block, calls of atlas ll's methodName raise
+    RegistrationCancelled once cancelToken has been cancelled. The
+    exception carries the arguments of the call that gave the lowest sum
+    of squared landmark distances to lldata's targets, the objective of
+    the scaling fits. Does nothing if cancelToken is None.
+    """
+    from gias3.musculoskeletal.bonemodels import modelcore
+
+    if cancelToken is None:
+        yield
+        return
+
+    method = getattr(ll, methodName)
+    shadowed = methodName in vars(ll)
+    getSourceLandmarks = modelcore.make_source_landmark_getter(lldata.landmarkNames)
+    targetLandmarks = lldata.targetLandmarks
+    sourceLandmarks = np.zeros(targetLandmarks.shape, dtype=float)
+    best = {'ssdist': np.inf, 'x': None}
+
+    def cancellable(*args):
+        if cancelToken.cancelled:
+            raise RegistrationCancelled(best['x'])
+        output = method(*args)
+        ssdist = ((getSourceLandmarks(ll, sourceLandmarks) - targetLandmarks) ** 2.0).sum()
+        if ssdist < best['ssdist']:
+            best['ssdist'] = ssdist
+            best['x'] = copy.deepcopy(list(args))
+        return output
+
+    setattr(ll, methodName, cancellable)
+    try:
+        yield
+    finally:
+        if shadowed:
+            setattr(ll, methodName, method)
+        else:
+            delattr(ll, methodName)
+
+
+def _makeShapeModelSnapshotCallback(lldata, ll, callback=None):
+    """Returns an optimiser callback for a shape model fit on atlas ll
+    that publishes the current iterate to lldata.snapshots when one is
+    due, then calls callback if given.
+    """
+    pcModes = lldata.T.shapeModes
+    iPelvis = len(pcModes)
+    iHip = iPelvis + ll.N_PARAMS_PELVIS
+    iKnee = iHip + ll.N_PARAMS_HIP
+
+    def snapshotCallback(x):
+        if lldata.snapshots.due:
+            lldata.snapshots.publish('shapemodel', pcModes, [x[:iPelvis], x[iPelvis:iHip], x[iHip:iKnee], x[iKnee:]])
+        if callback is not None:
+            callback(x)
+
+    return snapshotCallback
+
+
+@contextlib.contextmanager
+def _snapshotUpdates(lldata, ll, methodName):
+    """Within the block, calls of atlas ll's methodName publish their
+    arguments to lldata.snapshots when one is due. For the scaling fits,
+    which take no optimiser callback. Does nothing if lldata.snapshots has
+    no listener.
+    """
+    if not lldata.snapshots.enabled:
+        yield
+        return
+
+    method = getattr(ll, methodName)
+    shadowed = methodName in vars(ll)
+    mode = lldata.config['registration_mode']
+
+    def publishing(*args):
+        output = method(*args)
+        if lldata.snapshots.due:
+            lldata.snapshots.publish(mode, None, args)
+        return output
+
+    setattr(ll, methodName, publishing)
+    try:
+        yield
+    finally:
+        if shadowed:
+            setattr(ll, methodName, method)
+        else:
+            delattr(ll, methodName)
+
+
+def _flattenArgs(args):
+    """Numbers in nested args as a flat array, skipping bone names
+    """
+    flat = []
+    for a in args:
+        if isinstance(a, str):
+            continue
+        elif isinstance(a, (list, tuple)):
+            flat.append(_flattenArgs(a))
+        else:
+            flat.append(np.ravel(a))
+    return np.hstack(flat).astype(float) if flat else np.zeros(0)
+
+
+@contextlib.contextmanager
+def _progressUpdates(lldata, ll, methodName, minArgs):
+    """Within the block, calls of atlas ll's methodName record the landmark
+    RMSE of their arguments. Yields minArgs with an optimiser callback
+    that reports the RMSE of the current iterate to lldata.progress after
+    each iteration. For the scaling fits, which take no callback of their
+    own and whose parameters x are the flattened arguments of
+    methodName. Yields minArgs unchanged if lldata.progress has no
+    listeners.
+    """
+    from gias3.musculoskeletal.bonemodels import modelcore
+
+    if not lldata.progress.enabled:
+        yield minArgs
+        return
+
+    method = getattr(ll, methodName)
+    shadowed = methodName in vars(ll)
+    getSourceLandmarks = modelcore.make_source_landmark_getter(lldata.landmarkNames)
+    targetLandmarks = lldata.targetLandmarks
+    sourceLandmarks = np.zeros(targetLandmarks.shape, dtype=float)
+    # RMSE of each evaluation since the last iteration, by parameters
+    evaluated = {}
+
+    def recording(*args):
+        output = method(*args)
+        source = getSourceLandmarks(ll, sourceLandmarks)
+        evaluated[_flattenArgs(args).tobytes()] = np.sqrt(((source - targetLandmarks) ** 2.0).sum(1).mean())
+        return output
+
+    callback = minArgs.get('callback')
+
+    def progressCallback(x, *args):
+        rmse = evaluated.get(np.asarray(x, dtype=float).tobytes())
+        if rmse is None:
+            # not evaluated at x, e.g. by a method that does not evaluate
+            # its iterates, report the best evaluation
+            rmse = min(evaluated.values(), default=np.nan)
+        evaluated.clear()
+        lldata.progress.iterate(rmse, None)
+        if callback is not None:
+            callback(x, *args)
+
+    minArgs = dict(minArgs)
+    minArgs['callback'] = progressCallback
+    setattr(ll, methodName, recording)
+    try:
+        yield minArgs
+    finally:
+        if shadowed:
+            setattr(ll, methodName, method)
+        else:
+            delattr(ll, methodName)
+
+
+def _makeShapeModelProgressCallback(lldata, ll, callback=None):
+    """Returns an optimiser callback for a shape model fit on atlas ll
+    that reports the landmark RMSE after each iteration to
+    lldata.progress, then calls callback if given. Costs one model
+    evaluation per iteration, which is not counted as an objective's
+    model evaluation.
+    """
+    from gias3.musculoskeletal.bonemodels import modelcore
+
+    getSourceLandmarks = modelcore.make_source_landmark_getter(lldata.landmarkNames)
+    targetLandmarks = lldata.targetLandmarks
+    sourceLandmarks = np.zeros(targetLandmarks.shape, dtype=float)
+    pcModes = lldata.T.shapeModes
+    iPelvis = len(pcModes)
+    iHip = iPelvis + ll.N_PARAMS_PELVIS
+    iKnee = iHip + ll.N_PARAMS_HIP
+    # the class method, bypassing the instance wrappers of _runFit that
+    # time, count and track the objective's model evaluations
+    updateAllModels = type(ll).update_all_models
+
+    def progressCallback(x):
+        # the objective fully updates the model at every evaluation, so
+        # moving it here does not affect the fit
+        updateAllModels(ll, x[:iPelvis], pcModes, x[iPelvis:iHip], x[iHip:iKnee], x[iKnee:])
+        source = getSourceLandmarks(ll, sourceLandmarks)
+        rmse = np.sqrt(((source - targetLandmarks) ** 2.0).sum(1).mean())
+        lldata.progress.iterate(rmse, len(pcModes))
+        if callback is not None:
+            callback(x)
+
+    return progressCallback
+
+
+def _isDefaultTransform(T, mode):
+    """True if the parameters of T fitted in registration mode have not
+    changed from their defaults
+    """
+    if mode == 'shapemodel':
+        return np.all(T.shapeModelX == 0.0)
+    elif mode == 'uniformscaling':
+        x = T.uniformScalingX
+        return (x[0] == 1.0) and np.all(x[1:] == 0.0)
+    elif mode == 'perbonescaling':
+        x = T.perBoneScalingX
+        return np.all(x[:4] == 1.0) and np.all(x[4:] == 0.0)
+    raise ValueError('Invalid registration mode {}'.format(mode))
+
+
+def _registerShapeModel(lldata, callback=None, cancelToken=None):
+    from mapclientplugins.fieldworklowerlimbgenerationstep import landmarkmodel
+    from mapclientplugins.fieldworklowerlimbgenerationstep import shapemodelfit
 
-def _registerShapeModel(lldata, callback=None):
     # if lladata.T.shapeModelX has not changed from the default,
     # use None for x0 so that it is automatically calculated
-    x0Temp = lldata.T.shapeModelX
-    if np.all(x0Temp == 0.0):
+    if _isDefaultTransform(lldata.T, 'shapemodel'):
         x0 = None
     else:
-        x0 = x0Temp
-    print(x0)
+        x0 = lldata.T.shapeModelX
+    log.debug('x0: %s', x0)
 
     # do the fit
-    print(lldata.T.nShapeModes, lldata.T.shapeModes, lldata.mWeight)
+    log.debug('shape modes %s, mweight %s', lldata.T.shapeModes, lldata.mWeight)
+    # lowerlimbatlasfit.fit needs at least one mode, the rigid-only stage
+    # of a pc schedule always uses shapemodelfit
+    if lldata.minArgs.get('jac') == 'analytic' or lldata.T.nShapeModes == 0:
+        fitFunc = shapemodelfit.fit
+        fitKwargs = {'eps': lldata.minArgs.get('options', {}).get('eps', shapemodelfit.DEFAULT_EPS)}
+    else:
+        from gias3.musculoskeletal.bonemodels import lowerlimbatlasfit
+
+        fitFunc = lowerlimbatlasfit.fit
+        fitKwargs = {}
+    # fit on a copy of the atlas that only evaluates the nodes needed for
+    # landmarks, then update the full meshes once with the result
+    atlas = landmarkmodel.makeLandmarkAtlas(lldata.LL)
+    if lldata.progress.enabled:
+        callback = _makeShapeModelProgressCallback(lldata, atlas, callback)
+    if lldata.snapshots.enabled:
+        callback = _makeShapeModelSnapshotCallback(lldata, atlas, callback)
+    if cancelToken is not None:
+        callback = _makeShapeModelCancelCallback(atlas, lldata.T.nShapeModes, cancelToken, callback)
     xFitted, \
     optLandmarkDist, \
     optLandmarkRMSE, \
-    fitInfo = lowerlimbatlasfit.fit(
-        lldata.LL,
+    fitInfo = _runFit(
+        lldata,
+        'update_all_models',
+        fitFunc,
+        atlas,
         lldata.targetLandmarks,
         lldata.landmarkNames,
         lldata.T.shapeModes,
@@ -593,71 +1888,138 @@ def _registerShapeModel(lldata, callback=None):
         x0=x0,
         minimise_args=lldata.minArgs,
         callback=callback,
+        **fitKwargs
     )
+    xOpt = xFitted[-1]
+    lldata.LL.update_all_models(xOpt[0], lldata.T.shapeModes, xOpt[1], xOpt[2], xOpt[3])
     lldata.landmarkRMSE = optLandmarkRMSE
     lldata.landmarkErrors = optLandmarkDist
     lldata.fitMDist = fitInfo['mahalanobis_distance']
     lldata.T.shapeModelX = xFitted[-1]
-    print('new X:' + str(lldata.T.shapeModelX))
+    log.debug('new X: %s', lldata.T.shapeModelX)
     return xFitted, optLandmarkDist, optLandmarkRMSE, fitInfo
 
 
-def _registerUniformScaling(lldata, callback=None):
+def _registerShapeModelSchedule(lldata, callback=None, cancelToken=None):
+    """Shape model registration in stages of increasing numbers of shape
+    modes given by lldata.pcSchedule. Each stage starts from the result of
+    the previous one. Stage timings and RMSEs are stored in
+    lldata.registrationStages and in the returned fitInfo['stages'].
+
+    However the schedule ends, lldata.T is left with the full number of
+    shape modes, the weights of modes after the last fitted stage zeroed.
+    """
+    schedule = lldata.pcSchedule
+    stages = []
+    # number of modes of the last stage that set lldata.T
+    fittedModes = None
+    try:
+        for nModes in schedule:
+            lldata.T.nShapeModes = nModes
+            t0 = time.perf_counter()
+            output = _registerShapeModel(lldata, callback, cancelToken)
+            fittedModes = nModes
+            stage = {'nShapeModes': nModes,
+                     'time': time.perf_counter() - t0,
+                     'rmse': output[2],
+                     'nit': (output[3]['min_results'] or {}).get('nit'),
+                     }
+            stages.append(stage)
+            log.info('stage %d: %d shape modes, rmse %.4f, %.2f s',
+                     len(stages), nModes, stage['rmse'], stage['time'])
+            if output[3].get('cancelled'):
+                break
+    finally:
+        lldata.T.nShapeModes = schedule[-1]
+        if fittedModes is not None:
+            weights = np.zeros(schedule[-1], dtype=float)
+            weights[:fittedModes] = lldata.T.shapeModeWeights[:fittedModes]
+            lldata.T.shapeModeWeights = weights
+        lldata.registrationStages = stages
+
+    output[3]['stages'] = stages
+    return output
+
+
+def _registerUniformScaling(lldata, callback=None, cancelToken=None):
+    from gias3.musculoskeletal.bonemodels import lowerlimbatlasfitscaling
+    from mapclientplugins.fieldworklowerlimbgenerationstep import landmarkmodel
+
     # if lladata.T.uniformScalingX has not changed from the default,
     # use None for x0 so that it is automatically calculated
-    x0Temp = lldata.T.uniformScalingX
-    if (x0Temp[0] == 1.0) and np.all(x0Temp[1:] == 0.0):
+    if _isDefaultTransform(lldata.T, 'uniformscaling'):
         x0 = None
     else:
-        x0 = x0Temp
-    print(x0)
-
-    # do the fit
-    xFitted, \
-    optLandmarkDist, \
-    optLandmarkRMSE, \
-    fitInfo = lowerlimbatlasfitscaling.fit(
-        lldata.LL,
-        lldata.targetLandmarks,
-        lldata.landmarkNames,
-        bones_to_scale='uniform',
-        x0=x0,
-        minimise_args=lldata.minArgs,
-        # callback=callback,
-    )
+        x0 = lldata.T.uniformScalingX
+    log.debug('x0: %s', x0)
+
+    # do the fit on a copy of the atlas that only evaluates the nodes needed for
+    # landmarks, then update the full meshes once with the result
+    atlas = landmarkmodel.makeLandmarkAtlas(lldata.LL)
+    progressUpdates = _progressUpdates(lldata, atlas, 'update_all_models_uniform_scaling', _scipyMinArgs(lldata.minArgs))
+    with _snapshotUpdates(lldata, atlas, 'update_all_models_uniform_scaling'), progressUpdates as minArgs:
+        xFitted, \
+        optLandmarkDist, \
+        optLandmarkRMSE, \
+        fitInfo = _runFit(
+            lldata,
+            'update_all_models_uniform_scaling',
+            lowerlimbatlasfitscaling.fit,
+            atlas,
+            lldata.targetLandmarks,
+            lldata.landmarkNames,
+            bones_to_scale='uniform',
+            x0=x0,
+            minimise_args=minArgs,
+            # callback=callback,
+            cancelToken=cancelToken,
+        )
+    _updateLLFromX(lldata, xFitted[-1])
     lldata.landmarkRMSE = optLandmarkRMSE
     lldata.landmarkErrors = optLandmarkDist
     lldata.fitMDist = -1.0
     lldata.T.uniformScalingX = xFitted[-1]
-    print('new X:' + str(lldata.T.uniformScalingX))
+    log.debug('new X: %s', lldata.T.uniformScalingX)
     return xFitted, optLandmarkDist, optLandmarkRMSE, fitInfo
 
 
-def _registerPerBoneScaling(lldata, callback=None):
+def _registerPerBoneScaling(lldata, callback=None, cancelToken=None):
+    from gias3.musculoskeletal.bonemodels import lowerlimbatlasfitscaling
+    from mapclientplugins.fieldworklowerlimbgenerationstep import landmarkmodel
+
     # if lladata.T.perboneScalingX has not changed from the default,
     # use None for x0 so that it is automatically calculated
-    x0Temp = lldata.T.perBoneScalingX
-    if np.all(x0Temp[:4] == 1.0) and np.all(x0Temp[4:] == 0.0):
+    if _isDefaultTransform(lldata.T, 'perbonescaling'):
         x0 = None
     else:
-        x0 = x0Temp
-    print(x0)
-    bones = ('pelvis', 'femur', 'patella', 'tibiafibula')
-    xFitted, \
-    optLandmarkDist, \
-    optLandmarkRMSE, \
-    fitInfo = lowerlimbatlasfitscaling.fit(
-        lldata.LL,
-        lldata.targetLandmarks,
-        lldata.landmarkNames,
-        bones_to_scale=bones,
-        x0=x0,
-        minimise_args=lldata.minArgs,
-        # callback=callback,
-    )
+        x0 = lldata.T.perBoneScalingX
+    log.debug('x0: %s', x0)
+    bones = PERBONE_SCALING_BONES
+    # fit on a copy of the atlas that only evaluates the nodes needed for
+    # landmarks, then update the full meshes once with the result
+    atlas = landmarkmodel.makeLandmarkAtlas(lldata.LL)
+    progressUpdates = _progressUpdates(lldata, atlas, 'update_all_models_multi_scaling', _scipyMinArgs(lldata.minArgs))
+    with _snapshotUpdates(lldata, atlas, 'update_all_models_multi_scaling'), progressUpdates as minArgs:
+        xFitted, \
+        optLandmarkDist, \
+        optLandmarkRMSE, \
+        fitInfo = _runFit(
+            lldata,
+            'update_all_models_multi_scaling',
+            lowerlimbatlasfitscaling.fit,
+            atlas,
+            lldata.targetLandmarks,
+            lldata.landmarkNames,
+            bones_to_scale=bones,
+            x0=x0,
+            minimise_args=minArgs,
+            # callback=callback,
+            cancelToken=cancelToken,
+        )
+    _updateLLFromX(lldata, xFitted[-1])
     lldata.landmarkRMSE = optLandmarkRMSE
     lldata.landmarkErrors = optLandmarkDist
     lldata.fitMDist = -1.0
     lldata.T.perBoneScalingX = xFitted[-1]
-    print('new X:' + str(lldata.T.perBoneScalingX))
+    log.debug('new X: %s', lldata.T.perBoneScalingX)
     return xFitted, optLandmarkDist, optLandmarkRMSE, fitInfo
@@ -17,14 +17,16 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
     You should have received a copy of the GNU General Public License
     along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
 '''
+import logging
 import os
+import time
 
 os.environ['ETS_TOOLKIT'] = 'qt'
 
 from PySide6.QtWidgets import QDialog, QAbstractItemView, QTableWidgetItem
 from PySide6.QtGui import QIntValidator
 from PySide6.QtCore import Qt
-from PySide6.QtCore import QThread, Signal
+from PySide6.QtCore import QThread, QTimer, Signal
 
 from mapclientplugins.fieldworklowerlimbgenerationstep.ui_lowerlimbgenerationdialog import Ui_Dialog
 from traits.api import HasTraits, Instance, on_trait_change, \
@@ -33,25 +35,41 @@ from traits.api import HasTraits, Instance, on_trait_change, \
 from gias3.mapclientpluginutilities.viewers import MayaviViewerObjectsContainer, MayaviViewerFieldworkModel, MayaviViewerLandmark, colours
 
 from mapclientplugins.fieldworklowerlimbgenerationstep.landmarktablewidget import LandmarkComboBoxTable
+from mapclientplugins.fieldworklowerlimbgenerationstep.cancellation import CancellationToken
+from mapclientplugins.fieldworklowerlimbgenerationstep.coalesce import Coalescer
+from mapclientplugins.fieldworklowerlimbgenerationstep.evaluatorcache import evaluatorCache
 from mapclientplugins.fieldworklowerlimbgenerationstep.llstep import validModelLandmarks
 
 import numpy as np
 import copy
 
+log = logging.getLogger(__name__)
+
 
 class _ExecThread(QThread):
     update = Signal(tuple)
     callback = Signal(tuple)
+    progress = Signal(object)
+    snapshot = Signal()
 
     def __init__(self, func):
         QThread.__init__(self)
         self.func = func
+        self.cancelToken = CancellationToken()
+
+    def start(self):
+        self.cancelToken.reset()
+        QThread.start(self)
+
+    def cancel(self):
+        self.cancelToken.cancel()
 
     def run(self):
         # NOT USING CALLBACK since (probably due to threading) not all 
-        # bone models update in synchrony
+        # bone models update in synchrony. Live updates come through
+        # the data's snapshot buffer instead
         # output = self.func(self.callback)
-        output = self.func()
+        output = self.func(cancelToken=self.cancelToken)
         self.update.emit(output)
 
 
@@ -64,13 +82,19 @@ class LowerLimbGenerationDialog(QDialog):
     backgroundColour = (0.0, 0.0, 0.0)
     _modelRenderArgs = {}
     _modelDisc = [8, 8]
+    # while models are changing continuously, e.g. while dragging a spinbox
+    # or streaming a registration, they are drawn at _modelDiscCoarse, and
+    # refined to _modelDisc once nothing has changed for _lodIdleInterval
+    _adaptiveLOD = True
+    _modelDiscCoarse = [3, 3]
+    _lodIdleInterval = 300  # ms
     _landmarkRenderArgs = {'mode': 'sphere', 'scale_factor': 20.0, 'color': (0, 1, 0)}
+    _manualRegInterval = 33  # ms, manual reg changes are applied at most once per interval
 
     def __init__(self, data, doneExecution, parent=None):
         '''
         Constructor
         '''
-        print('###0')
         QDialog.__init__(self, parent)
         self._ui = Ui_Dialog()
         self._ui.setupUi(self)
@@ -81,13 +105,34 @@ class LowerLimbGenerationDialog(QDialog):
         self.data = data
         self.data.regCallback = self._regCallback
         self.doneExecution = doneExecution
-        self._lockManualRegUpdate = False
+        # manual reg update pending while the timer is active
+        self._manualRegTimer = QTimer(self)
+        self._manualRegTimer.setSingleShot(True)
+        self._manualRegTimer.setInterval(self._manualRegInterval)
+        self._manualReg = Coalescer(self._manualRegTimer, self._manualRegUpdate)
+        self._manualRegTimer.timeout.connect(self._manualReg.fire)
+        # level of detail of the models in the scene
+        self._lodCoarse = False
+        self._lastModelChange = 0.0
+        self._lodTimer = QTimer(self)
+        self._lodTimer.setSingleShot(True)
+        self._lodTimer.setInterval(self._lodIdleInterval)
+        self._lodTimer.timeout.connect(self._lodIdle)
 
         self.selectedObjectName = None
 
         self._worker = _ExecThread(self.data.register)
         self._worker.update.connect(self._regUpdate)
         self._worker.callback.connect(self._regCallback)
+        # progress events arrive on the worker thread, pass them to the
+        # GUI thread through a signal
+        self._worker.progress.connect(self._regProgress)
+        self._progressListener = self._worker.progress.emit
+        self.data.progress.addListener(self._progressListener)
+        # live model snapshots are published on the worker thread and
+        # applied to all bones at once on the GUI thread
+        self._worker.snapshot.connect(self._regSnapshot)
+        self.data.snapshots.setListener(self._worker.snapshot.emit)
 
         # print 'init...', self._config
 
@@ -107,6 +152,7 @@ class LowerLimbGenerationDialog(QDialog):
                                     MayaviViewerFieldworkModel(mn,
                                                                m.gf,
                                                                self._modelDisc,
+                                                               evaluator=self._modelEvaluator(mn, self._modelDisc),
                                                                render_args=self._modelRenderArgs
                                                                )
                                     )
@@ -185,7 +231,7 @@ class LowerLimbGenerationDialog(QDialog):
     def _saveConfigs(self):
         # landmarks page
         self.data.config['landmarks'] = self.landmarkTable.getLandmarkPairs()
-        print(self.data.config['landmarks'])
+        log.debug('landmarks %s', self.data.config['landmarks'])
         self.data.markerRadius = self._ui.doubleSpinBox_markerRadius.value()
         self.data.skinPad = self._ui.doubleSpinBox_skinPad.value()
 
@@ -234,23 +280,23 @@ class LowerLimbGenerationDialog(QDialog):
         self._ui.pushButton_removeLandmark.clicked.connect(self.landmarkTable.removeLandmark)
 
         # manual reg
-        self._ui.doubleSpinBox_pc1.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_pc2.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_pc3.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_pc4.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_scaling.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_ptx.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_pty.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_ptz.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_prx.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_pry.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_prz.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_hipx.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_hipy.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_hipz.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_kneex.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_kneey.valueChanged.connect(self._manualRegUpdate)
-        self._ui.doubleSpinBox_kneez.valueChanged.connect(self._manualRegUpdate)
+        self._ui.doubleSpinBox_pc1.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_pc2.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_pc3.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_pc4.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_scaling.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_ptx.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_pty.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_ptz.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_prx.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_pry.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_prz.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_hipx.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_hipy.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_hipz.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_kneex.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_kneey.valueChanged.connect(self._manualRegChanged)
+        self._ui.doubleSpinBox_kneez.valueChanged.connect(self._manualRegChanged)
         self._ui.pushButton_manual_reset.clicked.connect(self._reset)
         self._ui.pushButton_manual_accept.clicked.connect(self._accept)
 
@@ -284,7 +330,7 @@ class LowerLimbGenerationDialog(QDialog):
 
     def _addObjectToTable(self, row, name, obj, checked=True):
         typeName = obj.typeName
-        print('adding to table: %s (%s)' % (name, typeName))
+        log.debug('adding to table: %s (%s)', name, typeName)
         tableItem = QTableWidgetItem(name)
         if checked:
             tableItem.setCheckState(Qt.Checked)
@@ -299,8 +345,7 @@ class LowerLimbGenerationDialog(QDialog):
             selectedRow,
             self.objectTableHeaderColumns['Visible']
         ).text()
-        print(selectedRow)
-        print(self.selectedObjectName)
+        log.debug('selected row %s: %s', selectedRow, self.selectedObjectName)
 
     def _visibleBoxChanged(self, tableItem):
         # get name of object selected
@@ -312,17 +357,15 @@ class LowerLimbGenerationDialog(QDialog):
             name = tableItem.text()
             visible = tableItem.checkState().name == 'Checked'
 
-            print('visibleboxchanged name', name)
-            print('visibleboxchanged visible', visible)
+            log.debug('visibleboxchanged name %s visible %s', name, visible)
 
             # toggle visibility
             obj = self._objects.getObject(name)
-            print(obj.name)
             if obj.sceneObject:
-                print('changing existing visibility')
+                log.debug('changing existing visibility of %s', obj.name)
                 obj.setVisibility(visible)
             else:
-                print('drawing new')
+                log.debug('drawing new %s', obj.name)
                 obj.draw(self._scene)
 
     def _getSelectedObjectName(self):
@@ -335,16 +378,65 @@ class LowerLimbGenerationDialog(QDialog):
         for name in self._objects.getObjectNames():
             self._objects.getObject(name).draw(self._scene)
 
-    def _updateSceneModels(self):
-        for mn in self.data.LL.models:
+    def _updateSceneModels(self, modelNames=None):
+        if modelNames is None:
+            modelNames = self.data.LL.models
+        for mn in modelNames:
             meshObj = self._objects.getObject(mn)
             meshObj.updateGeometry(None, self._scene)
 
+    def _modelEvaluator(self, mn, disc):
+        # evaluators only depend on the bone mesh and discretisation, so
+        # they are shared across dialogs and levels of detail
+        return evaluatorCache.getModelEvaluator(self.data.LL, mn, disc)
+
+    def _setModelDisc(self, disc):
+        # the number of vertices changes, so redraw the meshes
+        for mn in self.data.LL.models:
+            meshObj = self._objects.getObject(mn)
+            meshObj.discrete = disc
+            meshObj.evaluator = self._modelEvaluator(mn, disc)
+            if meshObj.sceneObject is not None:
+                visible = meshObj.sceneObject.mesh.visible
+                meshObj.remove()
+                meshObj.draw(self._scene)
+                meshObj.setVisibility(visible)
+
+    def _modelsChanging(self, continuous=False):
+        # drop to the coarse level of detail when changes come faster than
+        # the idle interval, so single edits are drawn at full detail
+        now = time.perf_counter()
+        continuous = continuous or (now - self._lastModelChange) * 1000.0 < self._lodIdleInterval
+        self._lastModelChange = now
+        if not self._adaptiveLOD:
+            return
+        if continuous and not self._lodCoarse:
+            self._lodCoarse = True
+            self._setModelDisc(self._modelDiscCoarse)
+        if self._lodCoarse:
+            self._lodTimer.start()
+
+    def _lodIdle(self):
+        # a streaming registration refines when it finishes, see _regUpdate
+        if not self._worker.isRunning():
+            self._lodRefine()
+
+    def _lodRefine(self):
+        self._lodTimer.stop()
+        if self._lodCoarse:
+            self._lodCoarse = False
+            self._setModelDisc(self._modelDisc)
+
+    def _manualRegChanged(self, value=None):
+        # coalesce changes until the timer fires so that dragging a
+        # spinbox does not queue an update per step
+        self._manualReg.changed()
+
     def _manualRegUpdate(self):
-        if not self._lockManualRegUpdate:
-            self._saveConfigs()
-            self.data.updateLLModel()
-            self._updateSceneModels()
+        self._saveConfigs()
+        self._modelsChanging()
+        # only the bones moved by the changed parameters are updated
+        self._updateSceneModels(self.data.updateLLModel())
 
     def _autoRegChanged(self):
         self.data.kneeCorr = self._ui.checkBox_kneecorr.isChecked()
@@ -382,7 +474,8 @@ class LowerLimbGenerationDialog(QDialog):
         self._ui.checkBox_kneedof.setEnabled(False)
         self._ui.pushButton_auto_accept.setEnabled(False)
         self._ui.pushButton_auto_reset.setEnabled(False)
-        self._ui.pushButton_auto_abort.setEnabled(False)
+        # abort stays enabled to cancel the registration
+        self._ui.pushButton_auto_abort.setEnabled(True)
         self._ui.pushButton_auto_reg.setEnabled(False)
 
     def _regUnlockUI(self):
@@ -421,7 +514,11 @@ class LowerLimbGenerationDialog(QDialog):
         self._ui.pushButton_auto_reg.setEnabled(True)
 
     def _regUpdate(self, output):
+        # run has returned once update is emitted, join the thread
+        self._worker.wait()
+
         # update models in scene
+        self._lodRefine()
         self._updateSceneModels()
 
         # update error field
@@ -432,23 +529,38 @@ class LowerLimbGenerationDialog(QDialog):
         self._regUnlockUI()
 
         # update configs
-        self._lockManualRegUpdate = True
+        self._manualReg.locked = True
         self._updateConfigs()
-        self._lockManualRegUpdate = False
+        self._manualReg.locked = False
 
     def _regCallback(self, output):
         self._updateSceneModels()
 
+    def _regSnapshot(self):
+        self.data.snapshots.apply(self._applySnapshot)
+
+    def _applySnapshot(self, snapshot):
+        self.data.applySnapshot(snapshot)
+        self._modelsChanging(continuous=True)
+        self._updateSceneModels()
+
+    def _regProgress(self, event):
+        if not event.done:
+            self._ui.lineEdit_landmarkError.setText('{:5.2f}'.format(event.rmse))
+
     def _autoReg(self):
+        # apply pending manual changes before the worker uses the model
+        self._manualReg.flush()
         self._saveConfigs()
         self._worker.start()
         self._regLockUI()
 
     def _reset(self):
+        self._manualReg.discard()
         self.data.resetLL()
-        self._lockManualRegUpdate = True
+        self._manualReg.locked = True
         self._updateConfigs()
-        self._lockManualRegUpdate = False
+        self._manualReg.locked = False
         self._updateSceneModels()
 
         # clear error fields
@@ -456,15 +568,29 @@ class LowerLimbGenerationDialog(QDialog):
         self._ui.lineEdit_mDist.clear()
 
     def _accept(self):
+        self._manualReg.flush()
         self._saveConfigs()
         self._close()
         self.doneExecution()
 
     def _abort(self):
+        if self._worker.isRunning():
+            # stop the registration, _regUpdate shows the best fit so far
+            self._worker.cancel()
+            self._ui.pushButton_auto_abort.setEnabled(False)
+            return
+
         self._reset()
         self._close()
 
     def _close(self):
+        self._manualReg.discard()
+        self._lodTimer.stop()
+        if self._worker.isRunning():
+            self._worker.cancel()
+            self._worker.wait()
+        self.data.progress.removeListener(self._progressListener)
+        self.data.snapshots.setListener(None)
         for name in self._objects.getObjectNames():
             self._objects.getObject(name).remove()
 
@@ -477,12 +603,11 @@ class LowerLimbGenerationDialog(QDialog):
             name = tableItem.text()
             visible = tableItem.checkState().name == 'Checked'
             obj = self._objects.getObject(name)
-            print(obj.name)
             if obj.sceneObject:
-                print('changing existing visibility')
+                log.debug('changing existing visibility of %s', obj.name)
                 obj.setVisibility(visible)
             else:
-                print('drawing new')
+                log.debug('drawing new %s', obj.name)
                 obj.draw(self._scene)
 
     def _saveScreenShot(self):
@@ -497,7 +622,7 @@ class LowerLimbGenerationDialog(QDialog):
         # This function is called when the view is opened. We don't
         # populate the scene when the view is not yet open, as some
         # VTK features require a GLContext.
-        print('trait_changed')
+        log.debug('trait_changed')
 
         # We can do normal mlab calls on the embedded scene.
         self._scene.mlab.test_points3d()
@@ -0,0 +1,34 @@
+"""
+Parsing of the pc_schedule config entry, the numbers of shape modes of
+each stage of a staged shape model registration. It has no GUI or gias3
+dependencies, so that configs can be validated without importing either.
+"""
+
+
+def parsePCSchedule(spec, nShapeModes):
+    """Numbers of shape modes of each stage of pc_schedule spec when
+    fitting nShapeModes, or None for no schedule. Stages of nShapeModes or
+    more are dropped and the last stage is always nShapeModes, so a
+    schedule with only that stage is None. Raises ValueError if spec is
+    malformed or its stages are not strictly increasing.
+    """
+    spec = spec.strip().lower()
+    if spec in ('', 'false', 'none'):
+        return None
+
+    if spec == 'auto':
+        stages = [0, ]
+        n = 1
+        while n < nShapeModes:
+            stages.append(n)
+            n *= 2
+    else:
+        stages = [int(n) for n in spec.split(',') if n.strip()]
+        if any(n < 0 for n in stages) or any(b <= a for a, b in zip(stages[:-1], stages[1:])):
+            raise ValueError('Invalid pc_schedule {}, must be increasing numbers of modes'.format(spec))
+
+    stages = [n for n in stages if n < nShapeModes]
+    if not stages:
+        return None
+    stages.append(nShapeModes)
+    return stages
@@ -0,0 +1,70 @@
+"""
+Registration progress events.
+
+A ProgressReporter passes a ProgressEvent to each of its listeners every
+optimiser iteration of a registration, and once when the registration
+finishes. If it has no listeners, the registration does not compute the
+events at all.
+
+Listeners are called from the thread running the registration. A GUI
+should pass the event on to its own thread, e.g. with a Qt signal.
+"""
+import collections
+import threading
+import time
+
+ProgressEvent = collections.namedtuple('ProgressEvent', (
+    'iteration',  # optimiser iterations so far
+    'rmse',  # landmark RMSE at the current parameters
+    'elapsed',  # seconds since the registration started
+    'stage',  # number of shape modes being fitted, or None
+    'done',  # True for the last event of a registration
+))
+
+
+class ProgressReporter(object):
+
+    def __init__(self):
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._iteration = 0
+
+    @property
+    def enabled(self):
+        return len(self._listeners) > 0
+
+    def addListener(self, listener):
+        """listener is called with a ProgressEvent
+        """
+        with self._lock:
+            self._listeners = self._listeners + [listener, ]
+
+    def removeListener(self, listener):
+        with self._lock:
+            self._listeners = [l for l in self._listeners if l != listener]
+
+    def start(self):
+        """Start timing and counting iterations for a new registration
+        """
+        self._t0 = time.perf_counter()
+        self._iteration = 0
+
+    def iterate(self, rmse, stage=None):
+        """Report the end of an optimiser iteration
+        """
+        self._iteration += 1
+        self._report(rmse, stage, False)
+
+    def finish(self, rmse, stage=None):
+        """Report the end of a registration
+        """
+        self._report(rmse, stage, True)
+
+    def _report(self, rmse, stage, done):
+        listeners = self._listeners
+        if not listeners:
+            return
+        event = ProgressEvent(self._iteration, float(rmse), time.perf_counter() - self._t0, stage, done)
+        for listener in listeners:
+            listener(event)
@@ -0,0 +1,140 @@
+"""
+On-disk cache of registration results.
+
+Each entry is a small JSON file named by a key that hashes everything the
+result depends on. Reading an entry updates its modification time, and
+entries are evicted least recently used first when the total size of the
+cache exceeds its limit.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 64 * 2 ** 20
+ENTRY_PREFIX = 'llresult_'
+
+_checksums = {}  # (path, size, mtime): checksum
+_checksumsLock = threading.Lock()
+
+
+def fileChecksum(path):
+    """SHA1 of the contents of a file. Remembered while the file's size
+    and modification time are unchanged.
+    """
+    st = os.stat(path)
+    statKey = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _checksumsLock:
+        checksum = _checksums.get(statKey)
+    if checksum is None:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                h.update(block)
+        checksum = h.hexdigest()
+        with _checksumsLock:
+            _checksums[statKey] = checksum
+    return checksum
+
+
+def _jsonDefault(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    return str(o)
+
+
+def makeKey(items):
+    """Hex digest of a JSON-serialisable dict. numpy arrays are allowed.
+    """
+    s = json.dumps(items, sort_keys=True, default=_jsonDefault)
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+
+    def __init__(self, directory, maxBytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.maxBytes = maxBytes
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{}{}.json'.format(ENTRY_PREFIX, key))
+
+    def get(self, key):
+        """Returns the entry for key, or None if there is none
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warning('could not read result cache entry %s: %s', path, e)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, entry):
+        """Save entry, a JSON-serialisable dict, for key, then evict least
+        recently used entries until the cache is within maxBytes. The new
+        entry is never evicted.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        fd, tmpPath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f, default=_jsonDefault)
+            os.replace(tmpPath, self._path(key))
+        except Exception:
+            os.remove(tmpPath)
+            raise
+        self.evict(keep=key)
+
+    def _entries(self):
+        """(mtime, size, path) of each entry
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith(ENTRY_PREFIX) and name.endswith('.json'):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self, keep=None):
+        entries = sorted(self._entries())
+        total = sum(e[1] for e in entries)
+        keepPath = None if keep is None else self._path(keep)
+        for mtime, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            if path == keepPath:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        for mtime, size, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
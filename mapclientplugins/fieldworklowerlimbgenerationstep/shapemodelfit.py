@@ -0,0 +1,328 @@
+"""
+Lower limb shape model landmark fitting with an explicit objective gradient.
+
+Equivalent to gias3's lowerlimbatlasfit.fit for a single set of pc modes,
+but the objective returns its gradient along with its value:
+
+- pelvis rigid parameters: analytic. The whole limb is placed relative to
+  the pelvis, so landmarks are evaluated once with a neutral pelvis and the
+  pelvis rigid transform and its derivatives are applied to them directly.
+- mahalanobis penalty: analytic.
+- hip and knee rotations: forward differences of the landmark positions
+  that only re-place the bones below the joint instead of re-evaluating
+  the shape model.
+- pc weights: forward differences of the landmark positions, with all
+  perturbed weights evaluated in one batcheval.BatchEvaluator call. Their
+  nodes are reconstructed with one matrix multiply, but the bones are
+  still placed once per pc: the placement of the femur, tibia-fibula and
+  patella follows the shape through the joint centres and the knee gap,
+  so holding the placements fixed and using the linear pc rows alone
+  misses most of the derivative.
+
+The pc weight, hip and knee derivatives are only approximate. gias3 sets
+the knee gap from the closest points of the articular surfaces, which
+makes the placements non-smooth in those parameters. The pc and hip
+columns are usually within a few percent of central differences, but the
+knee column can be far off where the closest points switch.
+
+PoseLandmarkObjective and fitPose fit only the pelvis rigid, hip and knee
+parameters of a model whose shape is fixed, e.g. each frame of a motion
+capture trial after the subject's shape has been fitted.
+"""
+import numpy as np
+from scipy import optimize
+
+from gias3.musculoskeletal.bonemodels import modelcore
+
+from mapclientplugins.fieldworklowerlimbgenerationstep.batcheval import BatchEvaluator
+
+DEFAULT_EPS = 1e-4
+
+
+def _rotationMatrices(r):
+    """Returns R = Rx.Ry.Rz as used by gias3 transform3D.transformRigid3D,
+    and dR/drx, dR/dry, dR/drz
+    """
+    cx, sx = np.cos(r[0]), np.sin(r[0])
+    cy, sy = np.cos(r[1]), np.sin(r[1])
+    cz, sz = np.cos(r[2]), np.sin(r[2])
+    Rx = np.array([[1.0, 0.0, 0.0], [0.0, cx, -sx], [0.0, sx, cx]])
+    Ry = np.array([[cy, 0.0, sy], [0.0, 1.0, 0.0], [-sy, 0.0, cy]])
+    Rz = np.array([[cz, -sz, 0.0], [sz, cz, 0.0], [0.0, 0.0, 1.0]])
+    dRx = np.array([[0.0, 0.0, 0.0], [0.0, -sx, -cx], [0.0, cx, -sx]])
+    dRy = np.array([[-sy, 0.0, cy], [0.0, 0.0, 0.0], [-cy, 0.0, -sy]])
+    dRz = np.array([[-sz, -cz, 0.0], [cz, -sz, 0.0], [0.0, 0.0, 0.0]])
+
+    R = Rx.dot(Ry).dot(Rz)
+    dR = (dRx.dot(Ry).dot(Rz),
+          Rx.dot(dRy).dot(Rz),
+          Rx.dot(Ry).dot(dRz),
+          )
+    return R, dR
+
+
+class ShapeModelLandmarkObjective(object):
+    """
+    Sum of squared landmark distances plus mahalanobis penalty, and its
+    gradient, for the lower limb shape model parameters
+    [pc weights, pelvis rigid (6), hip rot (3), knee rot (1 or 2)].
+    """
+
+    def __init__(self, ll, targetLandmarks, landmarkNames, pcModes, mweight, eps=DEFAULT_EPS):
+        self.ll = ll
+        self.targetLandmarks = np.asarray(targetLandmarks, dtype=float)
+        self.landmarkNames = landmarkNames
+        self.pcModes = pcModes
+        self.mweight = mweight
+        self.eps = eps
+        self.nPCs = len(pcModes)
+        self.getSourceLandmarks = modelcore.make_source_landmark_getter(landmarkNames)
+        self._landmarkCoords = np.zeros((len(landmarkNames), 3), dtype=float)
+        self._batchEvaluator = None
+        self.nEvals = 0
+
+    def splitX(self, x):
+        iPelvis = self.nPCs
+        iHip = iPelvis + self.ll.N_PARAMS_PELVIS
+        iKnee = iHip + self.ll.N_PARAMS_HIP
+        return [x[:iPelvis], x[iPelvis:iHip], x[iHip:iKnee], x[iKnee:]]
+
+    def _landmarks(self):
+        return self.getSourceLandmarks(self.ll, self._landmarkCoords).copy()
+
+    def _neutralPelvisLandmarks(self, w, hipRot, kneeRot):
+        self.ll.update_all_models(
+            w, self.pcModes, np.zeros(self.ll.N_PARAMS_PELVIS), hipRot, kneeRot
+        )
+        return self._landmarks()
+
+    def _placeFemur(self, hipRot, kneeRot):
+        self.ll.update_femur(hipRot)
+        self.ll.update_tibiafibula(kneeRot)
+        return self._landmarks()
+
+    def _placeTibiaFibula(self, kneeRot):
+        self.ll.update_tibiafibula(kneeRot)
+        return self._landmarks()
+
+    def landmarkJacobian(self, x):
+        """Returns the neutral-pelvis landmarks L0 (n x 3) and their
+        derivatives (p x n x 3) with respect to the pc weights, hip rot
+        and knee rot parameters. Leaves the model with a neutral pelvis.
+        """
+        w, pelvisRigid, hipRot, kneeRot = self.splitX(np.asarray(x, dtype=float))
+        nHip = len(hipRot)
+        nKnee = len(kneeRot)
+        dL = np.zeros((self.nPCs + nHip + nKnee,) + self._landmarkCoords.shape)
+
+        L0 = self._neutralPelvisLandmarks(w, hipRot, kneeRot)
+        self.nEvals += 1
+
+        # hip rotations: femur and below
+        for i in range(nHip):
+            h = hipRot.copy()
+            h[i] += self.eps
+            dL[self.nPCs + i] = (self._placeFemur(h, kneeRot) - L0) / self.eps
+        if nHip:
+            self.ll.update_femur(hipRot)
+
+        # knee rotations: tibiafibula only
+        for i in range(nKnee):
+            k = kneeRot.copy()
+            k[i] += self.eps
+            dL[self.nPCs + nHip + i] = (self._placeTibiaFibula(k) - L0) / self.eps
+
+        # pc weights: whole model, in one batch
+        if self.nPCs:
+            dL[:self.nPCs] = self._pcJacobian(w, hipRot, kneeRot)
+
+        return L0, dL
+
+    def _pcJacobian(self, w, hipRot, kneeRot):
+        """Forward differences of the neutral-pelvis landmarks with respect
+        to the pc weights, evaluated as one batch of rows
+        """
+        if self._batchEvaluator is None:
+            self._batchEvaluator = BatchEvaluator(self.ll, self.landmarkNames, self.pcModes)
+        X = np.tile(np.hstack([w, np.zeros(self.ll.N_PARAMS_PELVIS), hipRot, kneeRot]), (self.nPCs + 1, 1))
+        X[1:, :self.nPCs] += self.eps * np.eye(self.nPCs)
+        L = self._batchEvaluator.evaluate(X)
+        self.nEvals += self.nPCs
+        # differences within the batch, which evaluates L0 to round-off
+        return (L[1:] - L[0]) / self.eps
+
+    def landmarkResiduals(self, x):
+        """Landmark positions minus target landmarks (n x 3) at x
+        """
+        w, pelvisRigid, hipRot, kneeRot = self.splitX(np.asarray(x, dtype=float))
+        L0 = self._neutralPelvisLandmarks(w, hipRot, kneeRot)
+        self.nEvals += 1
+        o = self.ll.pelvis_origin
+        R = _rotationMatrices(pelvisRigid[3:])[0]
+        return (L0 - o).dot(R.T) + o + pelvisRigid[:3] - self.targetLandmarks
+
+    def __call__(self, x):
+        """Returns the objective value and gradient at x
+        """
+        x = np.asarray(x, dtype=float)
+        w, pelvisRigid, hipRot, kneeRot = self.splitX(x)
+        L0, dL = self.landmarkJacobian(x)
+
+        o = self.ll.pelvis_origin
+        R, dR = _rotationMatrices(pelvisRigid[3:])
+        L0o = L0 - o
+        S = L0o.dot(R.T) + o + pelvisRigid[:3]
+        res = S - self.targetLandmarks
+
+        ssdist = (res ** 2.0).sum()
+        m2 = self.mweight * (w ** 2.0).sum()
+
+        grad = np.zeros_like(x)
+        # pc weights, hip rot, knee rot: dS = R.dL
+        dS = dL.dot(R.T)
+        gNonRigid = 2.0 * (dS * res).sum(axis=(1, 2))
+        grad[:self.nPCs] = gNonRigid[:self.nPCs] + 2.0 * self.mweight * w
+        grad[self.nPCs + self.ll.N_PARAMS_PELVIS:] = gNonRigid[self.nPCs:]
+        # pelvis translation and rotation
+        grad[self.nPCs:self.nPCs + 3] = 2.0 * res.sum(0)
+        for i in range(3):
+            grad[self.nPCs + 3 + i] = 2.0 * (L0o.dot(dR[i].T) * res).sum()
+
+        return ssdist + m2, grad
+
+
+class PoseLandmarkObjective(ShapeModelLandmarkObjective):
+    """
+    Landmark residuals and their jacobian for the pose parameters
+    [pelvis rigid (6), hip rot (3), knee rot (1 or 2)] of ll, keeping its
+    current shape, for least squares fitting. ll must have a neutral
+    pelvis.
+    """
+
+    def __init__(self, ll, targetLandmarks, landmarkNames, eps=DEFAULT_EPS):
+        super(PoseLandmarkObjective, self).__init__(ll, targetLandmarks, landmarkNames, [], 0.0, eps)
+
+    def _neutralPelvisLandmarks(self, w, hipRot, kneeRot):
+        self.ll.update_femur(hipRot)
+        self.ll.update_tibiafibula(kneeRot)
+        self.ll.update_patella()
+        return self._landmarks()
+
+    def residuals(self, x):
+        """Landmark position minus target landmark at pose x, flattened
+        """
+        return self.landmarkResiduals(x).ravel()
+
+    def jacobian(self, x):
+        """Derivatives of residuals (3n) with respect to x
+        """
+        x = np.asarray(x, dtype=float)
+        pelvisRigid = self.splitX(x)[1]
+        L0, dL = self.landmarkJacobian(x)
+
+        o = self.ll.pelvis_origin
+        R, dR = _rotationMatrices(pelvisRigid[3:])
+        L0o = L0 - o
+        J = np.zeros((L0.size, len(x)))
+        # pelvis translation and rotation
+        J[:, :3] = np.tile(np.eye(3), (len(L0), 1))
+        for i in range(3):
+            J[:, 3 + i] = L0o.dot(dR[i].T).ravel()
+        # hip rot, knee rot: dS = R.dL
+        J[:, self.ll.N_PARAMS_PELVIS:] = dL.dot(R.T).reshape((len(dL), -1)).T
+        return J
+
+
+def initialPelvisRigid(targetLandmarks, sourceLandmarks):
+    """Pelvis rigid transform [tx, ty, tz, rx, ry, rz] that registers the
+    first three source landmarks, the pelvis landmarks, to the targets,
+    rotating about the midpoint of the first two. This is the initial
+    pelvis alignment of the gias3 lower limb atlas fit.
+    """
+    from gias3.registration import alignment_fitting
+
+    return alignment_fitting.fitRigid(
+        sourceLandmarks[:3], targetLandmarks[:3],
+        rotcentre=0.5 * (sourceLandmarks[0] + sourceLandmarks[1]),
+        xtol=1e-6, maxfev=999999, maxfun=9999999999,
+    )[0]
+
+
+def fitPose(ll, targetLandmarks, landmarkNames, x0, least_squares_args=None, eps=DEFAULT_EPS):
+    """Fit the pose [pelvis rigid, hip rot, knee rot] of ll to landmarks,
+    keeping the shape of ll, starting from pose x0, with
+    scipy.optimize.least_squares. ll must have a neutral pelvis, and its
+    joints are left in an arbitrary pose.
+
+    Returns the fitted pose split as [pelvisRigid, hipRot, kneeRot], the
+    landmark distances, the landmark RMSE and the least_squares results.
+    """
+    least_squares_args = {} if least_squares_args is None else least_squares_args
+    targetLandmarks = np.asarray(targetLandmarks, dtype=float)
+
+    if len(targetLandmarks) != len(landmarkNames):
+        raise ValueError('Number of target landmarks not equal to number of landmark names')
+
+    x0 = np.array(x0, dtype=float)
+    if len(x0) != ll.N_PARAMS_RIGID:
+        raise ValueError('Incorrect number of elements in x0, need {}, given {}'.format(
+            ll.N_PARAMS_RIGID, len(x0))
+        )
+
+    obj = PoseLandmarkObjective(ll, targetLandmarks, landmarkNames, eps)
+    optResults = optimize.least_squares(obj.residuals, x0, jac=obj.jacobian, **least_squares_args)
+    xOpt = obj.splitX(optResults['x'])[1:]
+
+    optLandmarkDist = np.sqrt((optResults['fun'].reshape((-1, 3)) ** 2.0).sum(1))
+    optLandmarkRMSE = np.sqrt((optLandmarkDist ** 2.0).mean())
+    return xOpt, optLandmarkDist, optLandmarkRMSE, optResults
+
+
+def fit(ll, targetLandmarks, landmarkNames, pcModes, mweight, x0=None,
+        callback=None, minimise_args=None, eps=DEFAULT_EPS):
+    """Fit the lower limb shape model to landmarks using the objective
+    gradient. Arguments and returns are as for
+    gias3.musculoskeletal.bonemodels.lowerlimbatlasfit.fit with a single
+    set of pc modes. The 'jac' entry of minimise_args is ignored.
+    """
+    minimise_args = {} if minimise_args is None else dict(minimise_args)
+    minimise_args['jac'] = True
+    targetLandmarks = np.asarray(targetLandmarks, dtype=float)
+
+    if len(targetLandmarks) != len(landmarkNames):
+        raise ValueError('Number of target landmarks not equal to number of landmark names')
+
+    obj = ShapeModelLandmarkObjective(ll, targetLandmarks, landmarkNames, pcModes, mweight, eps)
+
+    if x0 is None:
+        sourceLandmarks = obj.getSourceLandmarks(ll, np.zeros((len(landmarkNames), 3)))
+        x0 = np.hstack([np.zeros(len(pcModes)),
+                        initialPelvisRigid(targetLandmarks, sourceLandmarks),
+                        np.zeros(ll.N_PARAMS_HIP + ll.N_PARAMS_KNEE),
+                        ])
+    else:
+        x0 = np.array(x0, dtype=float)
+        if len(x0) != (ll.N_PARAMS_RIGID + len(pcModes)):
+            raise ValueError('Incorrect number of elements in x0, need {}, given {}'.format(
+                ll.N_PARAMS_RIGID + len(pcModes), len(x0))
+            )
+
+    xHistory = [obj.splitX(x0)]
+    optResults = optimize.minimize(obj, x0, callback=callback, **minimise_args)
+    xOpt = obj.splitX(optResults['x'])
+    xHistory.append(xOpt)
+    ll.update_all_models(xOpt[0], pcModes, xOpt[1], xOpt[2], xOpt[3])
+
+    optSourceLandmarks = obj.getSourceLandmarks(ll, np.zeros((len(landmarkNames), 3)))
+    optLandmarkDist = np.sqrt(((targetLandmarks - optSourceLandmarks) ** 2.0).sum(1))
+    optLandmarkRMSE = np.sqrt((optLandmarkDist ** 2.0).mean())
+
+    outputInfo = {'source_landmark_getter': obj.getSourceLandmarks,
+                  'obj': obj,
+                  'min_results': optResults,
+                  'opt_source_landmarks': optSourceLandmarks,
+                  'mahalanobis_distance': np.sqrt((xOpt[0] ** 2.0).sum()),
+                  'model_evaluations': obj.nEvals,
+                  }
+
+    return xHistory, optLandmarkDist, optLandmarkRMSE, outputInfo
@@ -0,0 +1,156 @@
+"""
+Live model snapshots during registration.
+
+While the optimiser is running, the registration thread publishes its
+current parameters as an immutable ModelSnapshot, at most once every
+minInterval seconds, and less often if applying them is slow. Each
+snapshot is built privately by the publisher and then swapped into the
+SnapshotBuffer's front slot under a lock, so a reader only ever sees
+complete snapshots. Only the latest snapshot is kept, and the listener
+is notified only when the front slot goes from empty to full,
+so a slow GUI skips stale snapshots instead of queueing them.
+
+The GUI applies the waiting snapshot with SnapshotBuffer.apply. The
+buffer lock is held during the apply, and the registration closes the
+buffer, which takes the lock, before it touches the full lower limb model
+again. The fits themselves run on a reduced copy of the model, see
+landmarkmodel, so the GUI can update all four bones of the full model from
+a snapshot in one step without racing the optimiser.
+
+Applying a snapshot competes with the optimiser for the interpreter, so
+the buffer times each apply and spaces snapshots so that applying them
+takes at most maxApplyFraction of the time. Publishing never waits for
+the GUI: a snapshot that arrives while an apply is in progress is dropped.
+"""
+import collections
+import contextlib
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_MIN_INTERVAL = 0.2  # seconds
+DEFAULT_MAX_APPLY_FRACTION = 0.1
+
+ModelSnapshot = collections.namedtuple('ModelSnapshot', (
+    'mode',  # registration mode
+    'shapeModes',  # shape modes of the weights in x for shapemodel, else None
+    'x',  # parameters split as returned by the mode's fit function
+    'elapsed',  # seconds since the buffer was opened
+))
+
+
+def _freeze(x):
+    """Read-only copy of nested lists and arrays of parameters
+    """
+    if isinstance(x, np.ndarray):
+        x = np.array(x)
+        x.flags.writeable = False
+        return x
+    if isinstance(x, (list, tuple)):
+        return tuple(_freeze(i) for i in x)
+    return x
+
+
+class SnapshotBuffer(object):
+
+    def __init__(self, minInterval=DEFAULT_MIN_INTERVAL, maxApplyFraction=DEFAULT_MAX_APPLY_FRACTION):
+        self.minInterval = minInterval
+        self.maxApplyFraction = maxApplyFraction
+        self._listener = None
+        self._lock = threading.Lock()
+        self._front = None
+        self._open = False
+        self._t0 = 0.0
+        self._lastPublished = -np.inf
+        self._applyDuration = 0.0
+
+    @property
+    def enabled(self):
+        return self._listener is not None
+
+    def setListener(self, listener):
+        """listener is called with no arguments from the publishing thread
+        when a new snapshot is waiting. None removes the listener.
+        """
+        self._listener = listener
+
+    @property
+    def interval(self):
+        """Minimum seconds between snapshots
+        """
+        return max(self.minInterval, self._applyDuration / self.maxApplyFraction)
+
+    @property
+    def due(self):
+        """True if a snapshot published now would be kept
+        """
+        return self._open and self.enabled and \
+               (time.perf_counter() - self._lastPublished) >= self.interval
+
+    def open(self):
+        with self._lock:
+            self._front = None
+            self._open = True
+            self._t0 = time.perf_counter()
+            self._lastPublished = -np.inf
+
+    def close(self):
+        """Stop accepting snapshots and discard the waiting one. Waits for
+        an apply in progress to finish.
+        """
+        with self._lock:
+            self._open = False
+            self._front = None
+
+    @contextlib.contextmanager
+    def publishing(self):
+        """Open the buffer for the duration of the block
+        """
+        self.open()
+        try:
+            yield
+        finally:
+            self.close()
+
+    def publish(self, mode, shapeModes, x):
+        """Publish parameters x of registration mode if a snapshot is due.
+        Returns True if the snapshot was kept.
+        """
+        if not self.due:
+            return False
+        now = time.perf_counter()
+        back = ModelSnapshot(mode,
+                             None if shapeModes is None else _freeze(np.asarray(shapeModes, dtype=int)),
+                             _freeze(x),
+                             now - self._t0)
+
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            if not self._open:
+                return False
+            notify = self._front is None
+            self._front = back
+            self._lastPublished = now
+        finally:
+            self._lock.release()
+
+        listener = self._listener
+        if notify and listener is not None:
+            listener()
+        return True
+
+    def apply(self, func):
+        """Call func with the waiting snapshot, if there is one, while
+        holding the buffer lock. Returns True if func was called.
+        """
+        with self._lock:
+            snapshot = self._front
+            if snapshot is None:
+                return False
+            self._front = None
+            t0 = time.perf_counter()
+            func(snapshot)
+            self._applyDuration = time.perf_counter() - t0
+            return True
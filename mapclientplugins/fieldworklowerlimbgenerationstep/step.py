@@ -4,10 +4,12 @@ MAP Client Plugin Step
 import json
 
 from mapclient.mountpoints.workflowstep import WorkflowStepMountPoint
-from mapclientplugins.fieldworklowerlimbgenerationstep.configuredialog import ConfigureDialog
 
-from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
-from mapclientplugins.fieldworklowerlimbgenerationstep.lowerlimbgenerationdialog import LowerLimbGenerationDialog
+# The dialogs import Qt, traits and mayavi, so they are only imported when
+# shown. Headless execution (GUI 'False') and batch workers never load them.
+# llstep is only imported when a step is created, and only imports gias3
+# when the atlas is loaded, so MAP Client plugin discovery, which imports
+# every plugin, and loading a workflow do not load gias3.
 
 DEFAULT_MODEL_LANDMARKS = ('pelvis-LASIS', 'pelvis-RASIS', 'pelvis-Sacral',
                            'femur-MEC', 'femur-LEC', 'tibiafibula-MM',
@@ -66,6 +68,10 @@ class FieldworkLowerLimbGenerationStep(WorkflowStepMountPoint):
         self._config['mweight'] = '0.1'
         self._config['knee_corr'] = 'False'
         self._config['knee_dof'] = 'False'
+        self._config['pc_schedule'] = ''
+        self._config['warm_start_dir'] = ''
+        self._config['result_cache_dir'] = ''
+        self._config['output_submesh_views'] = 'False'
         self._config['marker_radius'] = '5.0'
         self._config['skin_pad'] = '5.0'
         self._config['side'] = 'left'
@@ -73,6 +79,8 @@ class FieldworkLowerLimbGenerationStep(WorkflowStepMountPoint):
         for l in DEFAULT_MODEL_LANDMARKS:
             self._config['landmarks'][l] = ''
 
+        from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+
         self._data = llstep.LLStepData(self._config)
 
     def execute(self):
@@ -86,6 +94,8 @@ class FieldworkLowerLimbGenerationStep(WorkflowStepMountPoint):
         self._data.updateFromConfig()
         if self._config['GUI'] == 'True':
             # start gui
+            from mapclientplugins.fieldworklowerlimbgenerationstep.lowerlimbgenerationdialog import \
+                LowerLimbGenerationDialog
             self._widget = LowerLimbGenerationDialog(self._data, self._doneExecution)
             self._widget.setModal(True)
             self._setCurrentWidget(self._widget)
@@ -125,6 +135,7 @@ class FieldworkLowerLimbGenerationStep(WorkflowStepMountPoint):
         then set:
             self._configured = True
         '''
+        from mapclientplugins.fieldworklowerlimbgenerationstep.configuredialog import ConfigureDialog
         dlg = ConfigureDialog(self._main_window)
         dlg.identifierOccursCount = self._identifierOccursCount
         dlg.setConfig(self._config)
@@ -166,10 +177,17 @@ class FieldworkLowerLimbGenerationStep(WorkflowStepMountPoint):
         self._config.update(json.loads(string))
         self._fix_legacy_config()
 
-        d = ConfigureDialog()
-        d.identifierOccursCount = self._identifierOccursCount
-        d.setConfig(self._config)
-        self._configured = d.validate()
+        # same as ConfigureDialog.validate for a freshly set config,
+        # without creating the dialog
+        from mapclientplugins.fieldworklowerlimbgenerationstep.pcschedule import parsePCSchedule
+
+        identifierCount = self._identifierOccursCount(self._config['identifier'])
+        try:
+            parsePCSchedule(self._config.get('pc_schedule', ''), int(self._config['pcs_to_fit']))
+            pcScheduleValid = True
+        except ValueError:
+            pcScheduleValid = False
+        self._configured = (identifierCount in (0, 1)) and pcScheduleValid
 
     def _fix_legacy_config(self):
         # legacy configs
@@ -0,0 +1,114 @@
+"""
+Precomputed maps for splitting a geometric field into submeshes, and
+read-only views of geometric fields that share parameter storage.
+
+gias3 geometric field methods that change field parameters (transforms,
+set_field_parameters) assign a new array rather than writing into the
+existing one. A view made with viewGF therefore stays a snapshot of the
+parameters at the time it was made, and a view that is transformed gets
+its own array. The view's parameter array is read-only so that in-place
+writes fail instead of changing the parent; to modify a view in place,
+first assign it a copy of its parameters.
+
+Views are read-only rather than copy-on-write: numpy cannot intercept an
+in-place write to give the view a private copy first, so only gias3
+methods that assign new parameters behave as copy-on-write. Pickling a
+view, e.g. to return it from a registerBatch worker process, writes its
+parameters out, so the unpickled field has its own writeable array and
+no longer shares storage.
+"""
+import copy
+import pickle
+import threading
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class SubmeshMap(object):
+    """
+    Maps a submesh made of some elements of a parent geometric field to
+    the parent's nodes. The submesh mesh and ensemble field function are
+    built once with makeGFFromElements; after that, a submesh of any parent
+    field with the same topology is a copy of the template whose field
+    parameters are parentParams[:, nodeIndex].
+    """
+
+    def __init__(self, parentGF, name, elements, basisTypes):
+        self.name = name
+        self.template = parentGF.makeGFFromElements(name, elements, basisTypes)
+        self._templatePickle = pickle.dumps(self.template, pickle.HIGHEST_PROTOCOL)
+
+        # submesh nodes are copies of parent nodes, find which
+        parentParams = parentGF.get_field_parameters()[:, :, 0].T
+        subParams = self.template.get_field_parameters()[:, :, 0].T
+        dist, nodeIndex = cKDTree(parentParams).query(subParams)
+        if dist.max() > 0.0:
+            raise ValueError('Submesh {} nodes not found in parent field'.format(name))
+        self.nodeIndex = nodeIndex
+
+        # contiguous node ranges can be sliced without copying
+        if np.all(np.diff(nodeIndex) == 1):
+            self.nodeSlice = slice(nodeIndex[0], nodeIndex[-1] + 1)
+        else:
+            self.nodeSlice = None
+
+    def makeGF(self, parentGF):
+        """Return the submesh of parentGF. Its mesh, ensemble field
+        function, points and triangulator are copies of the template's, so
+        it can be modified without affecting other submeshes.
+        """
+        # unpickling is several times faster than deepcopy of the mesh and
+        # ensemble field function dicts
+        gf = pickle.loads(self._templatePickle)
+        gf.field_parameters = parentGF.field_parameters[:, self.nodeIndex, :]
+        return gf
+
+    def makeView(self, parentGF):
+        """Return the submesh of parentGF with read-only field parameters
+        that share storage with parentGF where the submesh nodes are a
+        contiguous range of parent nodes, and are a copy otherwise.
+        """
+        if self.nodeSlice is None:
+            return viewGF(self.template, parentGF.field_parameters[:, self.nodeIndex, :])
+        else:
+            return viewGF(self.template, parentGF.field_parameters[:, self.nodeSlice, :])
+
+
+def viewGF(gf, fieldParameters=None):
+    """Return a shallow copy of gf whose field parameters are a read-only
+    view of fieldParameters, or of gf's own field parameters if None. The
+    mesh, ensemble field function and triangulator are shared with gf.
+    """
+    if fieldParameters is None:
+        fieldParameters = gf.field_parameters
+    view = copy.copy(gf)
+    view.field_parameters = fieldParameters.view()
+    view.field_parameters.flags.writeable = False
+    return view
+
+
+class SubmeshMapCache(object):
+    """
+    SubmeshMaps by key, built on first use. Keys should identify the
+    parent mesh topology, e.g. its source files, and the submesh.
+    """
+
+    def __init__(self):
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    def getMap(self, key, parentGF, name, elements, basisTypes):
+        with self._lock:
+            submeshMap = self._maps.get(key)
+            if submeshMap is None:
+                submeshMap = SubmeshMap(parentGF, name, elements, basisTypes)
+                self._maps[key] = submeshMap
+            return submeshMap
+
+    def clear(self):
+        with self._lock:
+            self._maps = {}
+
+
+submeshMapCache = SubmeshMapCache()
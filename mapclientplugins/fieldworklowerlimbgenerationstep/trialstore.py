@@ -0,0 +1,246 @@
+"""
+Chunked, append-only on-disk store of per-frame arrays, e.g. the poses and
+node coordinates of a motion capture trial.
+
+A store is a directory. Each named array is split into .npy shards of
+chunkFrames frames, written through numpy memory maps, so a writer only
+holds the pages of the shard it is filling and a reader maps just the
+shards of the frames it asks for. meta.json records the per-frame shape
+and dtype of each array, the number of frames written and user attributes.
+It is replaced atomically after the shards are flushed, so a reader, or a
+writer reopening the store after a crash, only sees complete frames.
+"""
+import json
+import os
+import re
+import tempfile
+
+import numpy as np
+
+DEFAULT_CHUNK_FRAMES = 256
+META_FILENAME = 'meta.json'
+STORE_VERSION = 1
+
+_validName = re.compile(r'^[A-Za-z0-9_]+$')
+
+
+def shardPath(directory, name, chunk):
+    return os.path.join(directory, '{}_{:06d}.npy'.format(name, chunk))
+
+
+def loadMeta(directory):
+    """Returns the meta dict of the store in directory, or None if there
+    is none
+    """
+    path = os.path.join(directory, META_FILENAME)
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _saveMeta(directory, meta):
+    fd, tmpPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmpPath, os.path.join(directory, META_FILENAME))
+    except Exception:
+        os.remove(tmpPath)
+        raise
+
+
+class TrialWriter(object):
+    """
+    Appends frames to the store in directory, creating it if needed. The
+    arrays of a new store are those of the first frame appended. Frames
+    appended to an existing store continue after its last complete frame
+    and must have the same arrays, and chunkFrames is that of the store.
+    attrs, a JSON-serialisable dict, are saved with the store, replacing
+    those of an existing store if given.
+    """
+
+    def __init__(self, directory, chunkFrames=DEFAULT_CHUNK_FRAMES, attrs=None):
+        self.directory = directory
+        meta = loadMeta(directory)
+        if meta is None:
+            meta = {'version': STORE_VERSION,
+                    'chunkFrames': int(chunkFrames),
+                    'nFrames': 0,
+                    'arrays': None,
+                    'attrs': {},
+                    }
+        elif meta['version'] != STORE_VERSION:
+            raise ValueError('Unsupported trial store version {}'.format(meta['version']))
+        if attrs is not None:
+            meta['attrs'] = attrs
+        self._meta = meta
+        self._shards = {}
+        self._shardChunk = None
+
+    @property
+    def nFrames(self):
+        return self._meta['nFrames']
+
+    @property
+    def chunkFrames(self):
+        return self._meta['chunkFrames']
+
+    def _setArrays(self, frame):
+        arrays = {}
+        for name, value in frame.items():
+            if not _validName.match(name):
+                raise ValueError('Invalid array name {}, use letters, digits and _'.format(name))
+            value = np.asarray(value)
+            arrays[name] = {'shape': list(value.shape), 'dtype': value.dtype.str}
+        self._meta['arrays'] = arrays
+
+    def _openShards(self, chunk):
+        """Memory maps of the shards of chunk, creating them if needed
+        """
+        self._closeShards()
+        for name, spec in self._meta['arrays'].items():
+            path = shardPath(self.directory, name, chunk)
+            if os.path.exists(path):
+                shard = np.lib.format.open_memmap(path, mode='r+')
+            else:
+                shard = np.lib.format.open_memmap(
+                    path, mode='w+', dtype=np.dtype(spec['dtype']),
+                    shape=(self.chunkFrames,) + tuple(spec['shape']),
+                )
+            self._shards[name] = shard
+        self._shardChunk = chunk
+
+    def _closeShards(self):
+        for shard in self._shards.values():
+            shard.flush()
+        self._shards = {}
+        self._shardChunk = None
+
+    def _checkFrame(self, frame):
+        """Returns the arrays of frame as numpy arrays, raising a
+        ValueError if their names, shapes or dtypes do not match the store
+        """
+        arrays = self._meta['arrays']
+        if set(frame) != set(arrays):
+            raise ValueError('Frame arrays {} do not match store arrays {}'.format(
+                sorted(frame), sorted(arrays)))
+        values = {}
+        for name, value in frame.items():
+            value = np.asarray(value)
+            shape = tuple(arrays[name]['shape'])
+            dtype = np.dtype(arrays[name]['dtype'])
+            if value.shape != shape:
+                raise ValueError('Array {} has shape {}, store has {}'.format(name, value.shape, shape))
+            if not np.can_cast(value.dtype, dtype, casting='same_kind'):
+                raise ValueError('Array {} has dtype {}, store has {}'.format(name, value.dtype, dtype))
+            values[name] = value
+        return values
+
+    def append(self, frame):
+        """Append one frame, a dict of array name: array. Nothing is
+        written if any array does not match the store.
+        """
+        if self._meta['arrays'] is None:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            self._setArrays(frame)
+        values = self._checkFrame(frame)
+
+        chunk, row = divmod(self.nFrames, self.chunkFrames)
+        if chunk != self._shardChunk:
+            self._openShards(chunk)
+        for name, value in values.items():
+            self._shards[name][row] = value
+        self._meta['nFrames'] += 1
+
+        if row == self.chunkFrames - 1:
+            self._closeShards()
+            _saveMeta(self.directory, self._meta)
+
+    def flush(self):
+        """Write the frames appended so far to disk and record them in
+        the store's meta
+        """
+        if self._meta['arrays'] is None:
+            return
+        for shard in self._shards.values():
+            shard.flush()
+        _saveMeta(self.directory, self._meta)
+
+    def close(self):
+        self.flush()
+        self._closeShards()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TrialReader(object):
+    """
+    Reads frame ranges of the store in directory through memory maps. The
+    frames are those complete when the reader was made, see refresh.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the store's meta, e.g. to see frames appended since
+        """
+        meta = loadMeta(self.directory)
+        if meta is None:
+            raise FileNotFoundError('No trial store in {}'.format(self.directory))
+        self._meta = meta
+
+    @property
+    def nFrames(self):
+        return self._meta['nFrames']
+
+    @property
+    def chunkFrames(self):
+        return self._meta['chunkFrames']
+
+    @property
+    def names(self):
+        return sorted(self._meta['arrays'] or {})
+
+    @property
+    def attrs(self):
+        return self._meta['attrs']
+
+    def frameShape(self, name):
+        return tuple(self._meta['arrays'][name]['shape'])
+
+    def iterChunks(self, name, start=0, stop=None):
+        """Yields read-only memory mapped slices of array name that
+        together cover frames start to stop
+        """
+        start, stop = slice(start, stop).indices(self.nFrames)[:2]
+        c = self.chunkFrames
+        for chunk in range(start // c, (stop - 1) // c + 1 if stop > start else 0):
+            shard = np.load(shardPath(self.directory, name, chunk), mmap_mode='r')
+            yield shard[max(start, chunk * c) - chunk * c:min(stop, (chunk + 1) * c) - chunk * c]
+
+    def read(self, name, start=0, stop=None):
+        """Frames start to stop of array name, with shape (frames,) +
+        frameShape(name). A range within one shard is returned as a memory
+        map without reading it, otherwise only the range is read.
+        """
+        parts = list(self.iterChunks(name, start, stop))
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            spec = self._meta['arrays'][name]
+            return np.empty((0,) + tuple(spec['shape']), dtype=np.dtype(spec['dtype']))
+        return np.concatenate(parts)
+
+    def readFrames(self, start=0, stop=None, names=None):
+        """Dict of array name: frames start to stop, see read
+        """
+        return dict((n, self.read(n, start, stop)) for n in (self.names if names is None else names))
@@ -142,6 +142,46 @@ class Ui_Dialog(object):
 
         self.formLayout.setWidget(9, QFormLayout.FieldRole, self.checkBox_GUI)
 
+        self.label_15 = QLabel(self.configGroupBox)
+        self.label_15.setObjectName(u"label_15")
+
+        self.formLayout.setWidget(10, QFormLayout.LabelRole, self.label_15)
+
+        self.lineEdit_pcSchedule = QLineEdit(self.configGroupBox)
+        self.lineEdit_pcSchedule.setObjectName(u"lineEdit_pcSchedule")
+
+        self.formLayout.setWidget(10, QFormLayout.FieldRole, self.lineEdit_pcSchedule)
+
+        self.label_16 = QLabel(self.configGroupBox)
+        self.label_16.setObjectName(u"label_16")
+
+        self.formLayout.setWidget(11, QFormLayout.LabelRole, self.label_16)
+
+        self.lineEdit_warmStartDir = QLineEdit(self.configGroupBox)
+        self.lineEdit_warmStartDir.setObjectName(u"lineEdit_warmStartDir")
+
+        self.formLayout.setWidget(11, QFormLayout.FieldRole, self.lineEdit_warmStartDir)
+
+        self.label_17 = QLabel(self.configGroupBox)
+        self.label_17.setObjectName(u"label_17")
+
+        self.formLayout.setWidget(12, QFormLayout.LabelRole, self.label_17)
+
+        self.lineEdit_resultCacheDir = QLineEdit(self.configGroupBox)
+        self.lineEdit_resultCacheDir.setObjectName(u"lineEdit_resultCacheDir")
+
+        self.formLayout.setWidget(12, QFormLayout.FieldRole, self.lineEdit_resultCacheDir)
+
+        self.label_18 = QLabel(self.configGroupBox)
+        self.label_18.setObjectName(u"label_18")
+
+        self.formLayout.setWidget(13, QFormLayout.LabelRole, self.label_18)
+
+        self.checkBox_outputViews = QCheckBox(self.configGroupBox)
+        self.checkBox_outputViews.setObjectName(u"checkBox_outputViews")
+
+        self.formLayout.setWidget(13, QFormLayout.FieldRole, self.checkBox_outputViews)
+
         self.verticalLayout = QVBoxLayout()
         self.verticalLayout.setObjectName(u"verticalLayout")
         self.tableWidgetLandmarks = QTableWidget(self.configGroupBox)
@@ -197,7 +237,11 @@ class Ui_Dialog(object):
         QWidget.setTabOrder(self.doubleSpinBox_skinPad, self.checkBox_kneedof)
         QWidget.setTabOrder(self.checkBox_kneedof, self.checkBox_kneecorr)
         QWidget.setTabOrder(self.checkBox_kneecorr, self.checkBox_GUI)
-        QWidget.setTabOrder(self.checkBox_GUI, self.buttonBox)
+        QWidget.setTabOrder(self.checkBox_GUI, self.lineEdit_pcSchedule)
+        QWidget.setTabOrder(self.lineEdit_pcSchedule, self.lineEdit_warmStartDir)
+        QWidget.setTabOrder(self.lineEdit_warmStartDir, self.lineEdit_resultCacheDir)
+        QWidget.setTabOrder(self.lineEdit_resultCacheDir, self.checkBox_outputViews)
+        QWidget.setTabOrder(self.checkBox_outputViews, self.buttonBox)
 
         self.retranslateUi(Dialog)
         self.buttonBox.accepted.connect(Dialog.accept)
@@ -222,6 +266,24 @@ class Ui_Dialog(object):
         self.checkBox_kneecorr.setText(QCoreApplication.translate("Dialog", u"Abd. Correction", None))
         self.label_11.setText(QCoreApplication.translate("Dialog", u"GUI:", None))
         self.checkBox_GUI.setText("")
+        self.label_15.setText(QCoreApplication.translate("Dialog", u"PC Schedule:", None))
+#if QT_CONFIG(tooltip)
+        self.lineEdit_pcSchedule.setToolTip(QCoreApplication.translate("Dialog", u"Shape model mode only. Empty to fit all PCs at once, 'auto' for rigid-only then 1, 2, 4, ... PCs, or comma-separated numbers of PCs, e.g. 0,1,2,4", None))
+#endif // QT_CONFIG(tooltip)
+        self.lineEdit_pcSchedule.setPlaceholderText(QCoreApplication.translate("Dialog", u"e.g. auto or 0,1,2,4", None))
+        self.label_16.setText(QCoreApplication.translate("Dialog", u"Warm Start Dir:", None))
+#if QT_CONFIG(tooltip)
+        self.lineEdit_warmStartDir.setToolTip(QCoreApplication.translate("Dialog", u"Directory to save fitted transforms in. Registrations to the same landmarks start from the saved fit. Empty to disable.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label_17.setText(QCoreApplication.translate("Dialog", u"Result Cache Dir:", None))
+#if QT_CONFIG(tooltip)
+        self.lineEdit_resultCacheDir.setToolTip(QCoreApplication.translate("Dialog", u"Directory to cache registration results in. Registrations with identical inputs and settings reuse the cached result. Empty to disable.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label_18.setText(QCoreApplication.translate("Dialog", u"Output Views:", None))
+#if QT_CONFIG(tooltip)
+        self.checkBox_outputViews.setToolTip(QCoreApplication.translate("Dialog", u"Output read-only views of the model field parameters instead of copies. gias3 transforms of an output model give it its own parameters; writing into its parameters in place raises.", None))
+#endif // QT_CONFIG(tooltip)
+        self.checkBox_outputViews.setText("")
         ___qtablewidgetitem = self.tableWidgetLandmarks.horizontalHeaderItem(0)
         ___qtablewidgetitem.setText(QCoreApplication.translate("Dialog", u"Model Landmarks", None));
         ___qtablewidgetitem1 = self.tableWidgetLandmarks.horizontalHeaderItem(1)
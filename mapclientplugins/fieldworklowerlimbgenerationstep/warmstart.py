@@ -0,0 +1,68 @@
+"""
+Sidecar files of fitted registration transforms, for warm-starting later
+registrations of the same subject.
+
+A sidecar is a small JSON file of LLTransformData.toDict() named by a hash
+of the atlas side, model landmark names and target landmark coordinates,
+so a registration to the same landmarks finds the previous fit without
+any other bookkeeping.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# coordinates are rounded to this many decimals before hashing so that
+# landmarks read back from text files give the same key
+HASH_DECIMALS = 6
+
+
+def landmarkSetHash(side, landmarkNames, landmarkCoords):
+    """Hex digest identifying a set of named target landmarks
+    """
+    coords = np.round(np.asarray(landmarkCoords, dtype=float), HASH_DECIMALS) + 0.0  # no -0.0
+    h = hashlib.sha1()
+    h.update(json.dumps([side, list(landmarkNames)]).encode('utf-8'))
+    h.update(np.ascontiguousarray(coords).tobytes())
+    return h.hexdigest()
+
+
+def sidecarPath(directory, key):
+    return os.path.join(directory, 'lltransform_{}.json'.format(key))
+
+
+def saveTransform(directory, key, transformDict):
+    """Write transformDict to the sidecar for key in directory. The file is
+    replaced atomically so that concurrent readers never see a partial
+    file.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmpPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(transformDict, f, indent=1)
+        os.replace(tmpPath, sidecarPath(directory, key))
+    except Exception:
+        os.remove(tmpPath)
+        raise
+
+
+def loadTransform(directory, key):
+    """Returns the transform dict in the sidecar for key in directory, or
+    None if there is none or it cannot be read.
+    """
+    path = sidecarPath(directory, key)
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log.warning('could not read warm start file %s: %s', path, e)
+        return None
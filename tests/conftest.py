@@ -0,0 +1,89 @@
+import copy
+
+import numpy as np
+import pytest
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import landmarkmodel
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+
+CONFIG = {'identifier': 'test',
+          'side': 'left',
+          'registration_mode': 'shapemodel',
+          'pcs_to_fit': '2',
+          'mweight': '0.1',
+          'knee_corr': 'False',
+          'knee_dof': 'False',
+          'landmarks': {},
+          }
+
+# shape model parameters of the target landmarks
+WEIGHTS = [0.5, -0.3]
+PELVIS_RIGID = [10.0, 5.0, 0.0, 0.1, 0.0, 0.0]
+HIP_ROT = [0.1, 0.0, 0.0]
+KNEE_ROT = [0.3]
+
+
+def atlasLandmarks(lldata):
+    """validModelLandmarks that the loaded atlas evaluates
+    """
+    return [l for l in llstep.validModelLandmarks
+            if l in lldata.LL.models[l.split('-')[0]].landmarks]
+
+
+def makeLandmarks(lldata, weights, pelvisRigid, hipRot, kneeRot):
+    """Target landmarks of the atlas at the given parameters
+    """
+    atlas = landmarkmodel.makeLandmarkAtlas(lldata.LL)
+    atlas.update_all_models(weights, np.arange(len(weights)), pelvisRigid, hipRot, kneeRot)
+    return dict((l, np.array(atlas.models[l.split('-')[0]].landmarks[l])) for l in lldata.landmarkNames)
+
+
+@pytest.fixture
+def lldata():
+    """LLStepData of the left atlas set up for a 2 mode shape model fit of
+    all atlas landmarks. The atlas is loaded once, later fixtures get
+    copies from the atlas cache.
+    """
+    data = llstep.LLStepData(copy.deepcopy(CONFIG))
+    data.loadData()
+    data.config['landmarks'] = dict((l, l) for l in atlasLandmarks(data))
+    data.updateFromConfig()
+    return data
+
+
+@pytest.fixture
+def targetLandmarks(lldata):
+    landmarks = makeLandmarks(lldata, WEIGHTS, PELVIS_RIGID, HIP_ROT, KNEE_ROT)
+    lldata.inputLandmarks = landmarks
+    lldata.updateFromConfig()
+    return landmarks
+
+
+@pytest.fixture
+def analytic(lldata):
+    """lldata with the fast gradient-based shape model fit
+    """
+    lldata.minArgs = dict(llstep.LLStepData.minArgs, jac='analytic')
+    return lldata
+
+
+@pytest.fixture
+def shortFits(monkeypatch):
+    """Short gradient-based shape model fits in this process and in the
+    forked workers
+    """
+    minArgs = copy.deepcopy(llstep.LLStepData.minArgs)
+    minArgs['jac'] = 'analytic'
+    minArgs['options']['maxiter'] = 10
+    monkeypatch.setattr(llstep.LLStepData, 'minArgs', minArgs)
+
+
+def startNearTarget(lldata):
+    """Set lldata.T near the parameters of targetLandmarks so that a fit
+    converges in a few iterations
+    """
+    lldata.T.shapeModelX = [np.array(WEIGHTS) + 0.01,
+                            np.array(PELVIS_RIGID) + 0.01,
+                            np.array(HIP_ROT) + 0.01,
+                            np.array(KNEE_ROT) + 0.01,
+                            ]
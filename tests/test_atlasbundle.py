@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from gias3.fieldwork.field import geometric_field
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import atlasbundle
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+
+
+@pytest.fixture
+def sourceFiles(tmp_path):
+    """Copies of the left patella .geof/.ens/.mesh files
+    """
+    sourceDir = tmp_path / 'sources'
+    sourceDir.mkdir()
+    return [shutil.copy(f, str(sourceDir)) for f in llstep._atlasFilenames('left')[1]['patella']]
+
+
+@pytest.fixture
+def bundleRoot(tmp_path, sourceFiles):
+    root = str(tmp_path / 'bundles')
+    atlasbundle.writeBundle(*sourceFiles, bundleDir=atlasbundle.bundleDirectory(root, sourceFiles[0]))
+    return root
+
+
+def test_round_trip_equals_text_load(sourceFiles, bundleRoot):
+    text = geometric_field.load_geometric_field(*sourceFiles)
+    bundled = atlasbundle.loadBundle(atlasbundle.bundleDirectory(bundleRoot, sourceFiles[0]))
+
+    np.testing.assert_array_equal(bundled.get_field_parameters(), text.get_field_parameters())
+    assert bundled.name == text.name
+    assert bundled.ensemble_point_counter == text.ensemble_point_counter
+
+    textMesh = text.ensemble_field_function.mesh
+    bundledMesh = bundled.ensemble_field_function.mesh
+    assert sorted(bundledMesh.elements) == sorted(textMesh.elements)
+    assert [type(bundledMesh.elements[e]) for e in sorted(bundledMesh.elements)] == \
+           [type(textMesh.elements[e]) for e in sorted(textMesh.elements)]
+    assert bundledMesh.connectivity == textMesh.connectivity
+
+    textMapper = text.ensemble_field_function.mapper
+    bundledMapper = bundled.ensemble_field_function.mapper
+    assert bundledMapper.get_number_of_ensemble_points() == textMapper.get_number_of_ensemble_points()
+    assert bundledMapper._ensemble_to_element_map == textMapper._ensemble_to_element_map
+    assert bundledMapper._element_to_ensemble_map == textMapper._element_to_ensemble_map
+
+    np.testing.assert_allclose(bundled.evaluate_geometric_field(5), text.evaluate_geometric_field(5))
+
+
+def test_load_geometric_field_uses_bundle(sourceFiles, bundleRoot, monkeypatch):
+    def fail(*args):
+        raise AssertionError('text files loaded')
+
+    monkeypatch.setattr(geometric_field, 'load_geometric_field', fail)
+    gf = atlasbundle.loadGeometricField(*sourceFiles, bundleRoot=bundleRoot)
+    assert gf.get_field_parameters().shape[1] > 0
+
+
+@pytest.mark.parametrize('changed', [0, 1, 2])
+def test_changed_source_falls_back_to_text(sourceFiles, bundleRoot, changed, caplog, monkeypatch):
+    st = os.stat(sourceFiles[changed])
+    os.utime(sourceFiles[changed], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    loads = []
+    load = geometric_field.load_geometric_field
+
+    def textLoad(*args):
+        loads.append(args)
+        return load(*args)
+
+    monkeypatch.setattr(geometric_field, 'load_geometric_field', textLoad)
+    with caplog.at_level(logging.WARNING):
+        atlasbundle.loadGeometricField(*sourceFiles, bundleRoot=bundleRoot)
+    assert len(loads) == 1
+    assert 'out of date' in caplog.text
+
+
+def test_other_version_is_ignored(sourceFiles, bundleRoot):
+    bundleDir = atlasbundle.bundleDirectory(bundleRoot, sourceFiles[0])
+    headerPath = os.path.join(bundleDir, atlasbundle.HEADER_FILENAME)
+    with open(headerPath, 'r') as f:
+        header = json.load(f)
+    header['version'] = atlasbundle.BUNDLE_VERSION - 1
+    with open(headerPath, 'w') as f:
+        json.dump(header, f)
+    assert atlasbundle.readBundleHeader(bundleDir) is None
+
+
+def test_no_bundle(sourceFiles, tmp_path):
+    assert atlasbundle.readBundleHeader(str(tmp_path / 'none')) is None
+    gf = atlasbundle.loadGeometricField(*sourceFiles, bundleRoot=str(tmp_path / 'none'))
+    assert gf.get_field_parameters().shape[1] > 0
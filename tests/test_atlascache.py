@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from mapclientplugins.fieldworklowerlimbgenerationstep.atlascache import AtlasCache
+
+
+class FakeAtlas(object):
+    combined_pcs = None
+
+    def __init__(self, side):
+        self.side = side
+        self.params = [0.0]
+
+
+@pytest.fixture
+def atlasFiles(tmp_path):
+    filenames = {}
+    for name in ('femur.geof', 'femur.ens', 'femur.mesh', 'shape.pc', 'femur.npy'):
+        path = str(tmp_path / name)
+        with open(path, 'w') as f:
+            f.write(name)
+        filenames[name] = path
+    boneFiles = {'femur': [filenames['femur.geof'], filenames['femur.ens'], filenames['femur.mesh']]}
+    return boneFiles, filenames['shape.pc'], filenames['femur.npy']
+
+
+def touch(path, seconds):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + int(seconds * 1e9)))
+
+
+def countingLoader(calls):
+    def loader(side, boneFiles, shapeModelFilename):
+        calls.append(side)
+        return FakeAtlas(side)
+
+    return loader
+
+
+def test_hit_returns_copies(atlasFiles):
+    boneFiles, shapeModelFilename, extra = atlasFiles
+    cache = AtlasCache()
+    calls = []
+    a = cache.getAtlas('left', boneFiles, shapeModelFilename, countingLoader(calls))
+    b = cache.getAtlas('left', boneFiles, shapeModelFilename, countingLoader(calls))
+    assert calls == ['left']
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+    assert a is not b
+    a.params[0] = 1.0
+    assert b.params[0] == 0.0
+    assert cache.getAtlas('left', boneFiles, shapeModelFilename, countingLoader(calls)).params[0] == 0.0
+
+
+def test_miss_per_side(atlasFiles):
+    boneFiles, shapeModelFilename, extra = atlasFiles
+    cache = AtlasCache()
+    calls = []
+    cache.getAtlas('left', boneFiles, shapeModelFilename, countingLoader(calls))
+    cache.getAtlas('right', boneFiles, shapeModelFilename, countingLoader(calls))
+    assert calls == ['left', 'right']
+
+
+@pytest.mark.parametrize('changed', [0, 3])
+def test_mtime_change_reloads(atlasFiles, changed):
+    boneFiles, shapeModelFilename, extra = atlasFiles
+    cache = AtlasCache()
+    calls = []
+    cache.getAtlas('left', boneFiles, shapeModelFilename, countingLoader(calls))
+    touch((boneFiles['femur'] + [shapeModelFilename])[changed], 10)
+    cache.getAtlas('left', boneFiles, shapeModelFilename, countingLoader(calls))
+    cache.getAtlas('left', boneFiles, shapeModelFilename, countingLoader(calls))
+    assert calls == ['left', 'left']
+
+
+def test_extra_files_change_reloads(atlasFiles):
+    boneFiles, shapeModelFilename, extra = atlasFiles
+    missing = extra + '.missing'
+    cache = AtlasCache()
+    calls = []
+    loader = countingLoader(calls)
+    cache.getAtlas('left', boneFiles, shapeModelFilename, loader, [extra, missing])
+    touch(extra, 10)
+    cache.getAtlas('left', boneFiles, shapeModelFilename, loader, [extra, missing])
+    assert len(calls) == 2
+    # a file that did not exist being created
+    with open(missing, 'w') as f:
+        f.write('new')
+    cache.getAtlas('left', boneFiles, shapeModelFilename, loader, [extra, missing])
+    cache.getAtlas('left', boneFiles, shapeModelFilename, loader, [extra, missing])
+    assert len(calls) == 3
+
+
+def test_invalidate(atlasFiles):
+    boneFiles, shapeModelFilename, extra = atlasFiles
+    cache = AtlasCache()
+    calls = []
+    for side in ('left', 'right'):
+        cache.getAtlas(side, boneFiles, shapeModelFilename, countingLoader(calls))
+    cache.invalidate('left')
+    for side in ('left', 'right'):
+        cache.getAtlas(side, boneFiles, shapeModelFilename, countingLoader(calls))
+    assert calls == ['left', 'right', 'left']
+    cache.clear()
+    assert cache.stats() == {'hits': 0, 'misses': 0, 'size': 0}
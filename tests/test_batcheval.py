@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import batcheval
+
+
+def randomRows(rng, k, nModes, nKnee=1):
+    return np.hstack([rng.normal(0.0, 1.0, (k, nModes)),
+                      rng.normal(0.0, 5.0, (k, 3)),
+                      rng.normal(0.0, 0.05, (k, 3)),
+                      rng.normal(0.0, 0.1, (k, 3)),
+                      np.abs(rng.normal(0.0, 0.2, (k, nKnee))),
+                      ])
+
+
+def updateAllModels(lldata, X):
+    """Landmarks and nodes of each row of X from LL.update_all_models
+    """
+    ll = lldata.LL
+    modes = lldata.T.shapeModes
+    n = len(modes)
+    landmarks = []
+    nodes = dict((b, []) for b in ll.models)
+    for x in X:
+        ll.update_all_models(x[:n], modes, x[n:n + 6], x[n + 6:n + 9], x[n + 9:])
+        landmarks.append([ll.models[l.split('-')[0]].landmarks[l] for l in lldata.landmarkNames])
+        for b, m in ll.models.items():
+            nodes[b].append(m.gf.field_parameters[:, :, 0].T.copy())
+    return np.array(landmarks), dict((b, np.array(v)) for b, v in nodes.items())
+
+
+def pelvisOnlyRows(rng, nModes):
+    X = np.repeat(randomRows(rng, 1, nModes), 4, axis=0)
+    X[:, nModes:nModes + 6] = randomRows(rng, 4, nModes)[:, nModes:nModes + 6]
+    return X
+
+
+@pytest.mark.parametrize('makeRows', [
+    lambda rng, nModes: randomRows(rng, 3, nModes),
+    pelvisOnlyRows,
+], ids=['distinct', 'pelvis only'])
+def test_equals_update_all_models(lldata, makeRows):
+    X = makeRows(np.random.RandomState(0), lldata.T.nShapeModes)
+    landmarks, nodes = lldata.evaluateBatch(X, nodes=True)
+    expectedLandmarks, expectedNodes = updateAllModels(lldata, X)
+    np.testing.assert_allclose(landmarks, expectedLandmarks, rtol=0.0, atol=1e-5)
+    assert sorted(nodes) == sorted(expectedNodes)
+    for b in nodes:
+        np.testing.assert_allclose(nodes[b], expectedNodes[b], rtol=0.0, atol=1e-5)
+
+
+def test_landmarks_only(lldata):
+    X = randomRows(np.random.RandomState(1), 2, lldata.T.nShapeModes)
+    landmarks = lldata.evaluateBatch(X)
+    assert landmarks.shape == (2, len(lldata.landmarkNames), 3)
+    np.testing.assert_allclose(landmarks, updateAllModels(lldata, X)[0], rtol=0.0, atol=1e-5)
+
+
+def test_does_not_modify_atlas(lldata):
+    before = dict((b, m.gf.field_parameters.copy()) for b, m in lldata.LL.models.items())
+    lldata.evaluateBatch(randomRows(np.random.RandomState(2), 2, lldata.T.nShapeModes), nodes=True)
+    for b, m in lldata.LL.models.items():
+        np.testing.assert_array_equal(m.gf.field_parameters, before[b])
+
+
+def test_wrong_number_of_parameters(lldata):
+    with pytest.raises(ValueError):
+        lldata.evaluateBatch(np.zeros((2, lldata.T.nShapeModes + 12)))
+
+
+def test_rotation_matrices():
+    from gias3.common import transform3D
+
+    r = np.random.RandomState(3).normal(0.0, 1.0, (4, 3))
+    x = np.random.RandomState(4).normal(0.0, 1.0, (5, 3))
+    R = batcheval._rotationMatrices(r)
+    for k in range(len(r)):
+        expected = transform3D.transformRigid3D(x, np.hstack([np.zeros(3), r[k]]))
+        np.testing.assert_allclose(x.dot(R[k].T), expected, atol=1e-12)
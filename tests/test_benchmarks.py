@@ -0,0 +1,31 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import registration_modes  # noqa: E402
+
+
+def test_make_targets(lldata):
+    neutral = np.array(lldata.LL.models['femur'].gf.field_parameters)
+    targets = registration_modes.makeTargets(lldata, 2, 2, seed=1)
+    assert len(targets) == 2
+    assert set(targets[0]) == set(registration_modes.atlasLandmarks(lldata))
+    assert not np.allclose(targets[0]['femur-GT'], targets[1]['femur-GT'])
+    again = registration_modes.makeTargets(lldata, 2, 2, seed=1)
+    np.testing.assert_array_equal(again[1]['femur-GT'], targets[1]['femur-GT'])
+    # the model is reset afterwards
+    np.testing.assert_array_equal(lldata.LL.models['femur'].gf.field_parameters, neutral)
+
+
+@pytest.mark.parametrize('mode', registration_modes.MODES)
+def test_run_mode(lldata, shortFits, mode):
+    targets = registration_modes.makeTargets(lldata, 1, 2)
+    config = registration_modes.makeConfig('left', mode, 2, targets[0])
+    result = registration_modes.runMode(config, targets)
+    target, = result['targets']
+    assert target['nfev'] > 0
+    assert np.isfinite(target['rmse'])
+    assert result['loadTime'] >= 0.0
@@ -0,0 +1,32 @@
+import multiprocessing
+import time
+
+from mapclientplugins.fieldworklowerlimbgenerationstep.cancellation import CancellationToken
+
+
+def test_cancel_and_reset():
+    token = CancellationToken()
+    assert not token.cancelled
+    token.cancel()
+    assert token.cancelled
+    token.reset()
+    assert not token.cancelled
+
+
+def test_shared_event():
+    event = multiprocessing.Event()
+    a = CancellationToken(event)
+    b = CancellationToken(event)
+    a.cancel()
+    assert b.cancelled
+    assert event.is_set()
+
+
+def test_cancelled_registration(lldata, targetLandmarks):
+    token = CancellationToken()
+    token.cancel()
+    t0 = time.perf_counter()
+    output = lldata.register(cancelToken=token)
+    assert time.perf_counter() - t0 < 5.0
+    assert output[3]['cancelled']
+    assert lldata.registrationCancelled
@@ -0,0 +1,84 @@
+import pytest
+
+from mapclientplugins.fieldworklowerlimbgenerationstep.coalesce import Coalescer
+
+
+class FakeTimer(object):
+    """Single-shot timer that fires when the test calls timeout
+    """
+
+    def __init__(self):
+        self.active = False
+        self.starts = 0
+        self.callback = None
+
+    def start(self):
+        self.active = True
+        self.starts += 1
+
+    def stop(self):
+        self.active = False
+
+    def isActive(self):
+        return self.active
+
+    def timeout(self):
+        if self.active:
+            self.active = False
+            self.callback()
+
+
+@pytest.fixture
+def coalescer():
+    timer = FakeTimer()
+    updates = []
+    coalescer = Coalescer(timer, lambda: updates.append(len(updates)))
+    timer.callback = coalescer.fire
+    coalescer.updates = updates
+    return coalescer
+
+
+def test_burst_applied_once(coalescer):
+    for i in range(10):
+        coalescer.changed()
+    assert coalescer.pending
+    assert coalescer.timer.starts == 1
+    assert coalescer.updates == []
+
+    coalescer.timer.timeout()
+    assert coalescer.updates == [0]
+    assert not coalescer.pending
+
+    # the next change starts a new interval
+    coalescer.changed()
+    coalescer.timer.timeout()
+    assert coalescer.updates == [0, 1]
+    assert coalescer.timer.starts == 2
+
+
+def test_locked_changes_ignored(coalescer):
+    coalescer.locked = True
+    coalescer.changed()
+    assert not coalescer.pending
+    coalescer.locked = False
+    coalescer.changed()
+    assert coalescer.pending
+
+
+def test_flush(coalescer):
+    coalescer.flush()
+    assert coalescer.updates == []
+    coalescer.changed()
+    coalescer.flush()
+    assert coalescer.updates == [0]
+    # the timer was stopped, it does not update again
+    coalescer.timer.timeout()
+    assert coalescer.updates == [0]
+
+
+def test_discard(coalescer):
+    coalescer.changed()
+    coalescer.discard()
+    coalescer.timer.timeout()
+    coalescer.flush()
+    assert coalescer.updates == []
@@ -0,0 +1,44 @@
+import copy
+
+import numpy as np
+import pytest
+
+from conftest import CONFIG
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+from mapclientplugins.fieldworklowerlimbgenerationstep.evaluatorcache import EvaluatorCache
+
+
+@pytest.fixture
+def cache():
+    return EvaluatorCache()
+
+
+def test_evaluates_model(lldata, cache):
+    gf = lldata.LL.models['femur'].gf
+    evaluator = cache.getModelEvaluator(lldata.LL, 'femur', [4, 4])
+    expected = gf.evaluate_geometric_field([4, 4])
+    np.testing.assert_allclose(evaluator(gf.field_parameters.ravel()), expected)
+
+
+def test_shared_by_mesh_and_discretisation(lldata, cache):
+    evaluator = cache.getModelEvaluator(lldata.LL, 'femur', [4, 4])
+    other = llstep.LLStepData(copy.deepcopy(CONFIG))
+    other.loadData()
+    assert other.LL is not lldata.LL
+    assert cache.getModelEvaluator(other.LL, 'femur', (4, 4)) is evaluator
+
+    assert cache.getModelEvaluator(lldata.LL, 'femur', [3, 3]) is not evaluator
+    assert cache.getModelEvaluator(lldata.LL, 'tibiafibula', [4, 4]) is not evaluator
+
+
+def test_key_includes_side(lldata, cache):
+    config = dict(copy.deepcopy(CONFIG), side='right')
+    right = llstep.LLStepData(config)
+    right.loadData()
+    assert right.LL.bone_files['femur'] != lldata.LL.bone_files['femur']
+
+    left = cache.getModelEvaluator(lldata.LL, 'femur', [4, 4])
+    assert cache.getModelEvaluator(right.LL, 'femur', [4, 4]) is not left
+    assert len(cache._evaluators) == 2
+    cache.clear()
+    assert cache.getModelEvaluator(lldata.LL, 'femur', [4, 4]) is not left
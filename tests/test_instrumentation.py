@@ -0,0 +1,32 @@
+import numpy as np
+
+from conftest import HIP_ROT, KNEE_ROT, PELVIS_RIGID, WEIGHTS
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+from mapclientplugins.fieldworklowerlimbgenerationstep.instrumentation import Instrumentation
+
+
+def test_time_calls():
+    class Obj(object):
+        def f(self, x):
+            return x + 1
+
+    instrumentation = Instrumentation()
+    obj = Obj()
+    with instrumentation.timeCalls(obj, 'f', 'f'):
+        assert obj.f(1) == 2
+        obj.f(2)
+    obj.f(3)
+    assert 'f' not in vars(obj)
+    stats = instrumentation.asDict()
+    assert stats['latency']['f']['count'] == 2
+    assert sum(stats['latency']['f']['counts']) == 2
+
+
+def test_progress_callback_is_not_a_model_evaluation(lldata, targetLandmarks):
+    ll = lldata.LL
+    callback = llstep._makeShapeModelProgressCallback(lldata, ll)
+    x = np.hstack([WEIGHTS, PELVIS_RIGID, HIP_ROT, KNEE_ROT])
+    lldata.progress.start()
+    with lldata.instrumentation.timeCalls(ll, 'update_all_models', 'modelEvaluation'):
+        callback(x)
+    assert 'modelEvaluation' not in lldata.stats['latency']
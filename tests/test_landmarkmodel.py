@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import landmarkmodel
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+
+PELVIS_RIGID = [10.0, -5.0, 3.0, 0.1, -0.05, 0.2]
+HIP_ROT = [0.3, 0.05, -0.1]
+KNEE_ROT = [0.4]
+
+
+def landmarks(ll, names):
+    return np.array([ll.models[l.split('-')[0]].landmarks[l] for l in names])
+
+
+@pytest.mark.parametrize('method, first', [
+    ('update_all_models', None),
+    ('update_all_models_uniform_scaling', 1.1),
+    ('update_all_models_multi_scaling', [llstep.PERBONE_SCALING_BONES, np.array([1.1, 0.9, 1.05, 0.95])]),
+], ids=['shapemodel', 'uniformscaling', 'perbonescaling'])
+def test_landmarks_equal_full_atlas(lldata, method, first):
+    atlas = landmarkmodel.makeLandmarkAtlas(lldata.LL)
+    if method == 'update_all_models':
+        args = ([0.8, -0.6], [0, 1], PELVIS_RIGID, HIP_ROT, KNEE_ROT)
+    else:
+        args = (first, PELVIS_RIGID, HIP_ROT, KNEE_ROT)
+    getattr(atlas, method)(*args)
+    getattr(lldata.LL, method)(*args)
+    np.testing.assert_allclose(landmarks(atlas, lldata.landmarkNames),
+                               landmarks(lldata.LL, lldata.landmarkNames),
+                               rtol=0.0, atol=1e-6)
+
+
+def test_does_not_modify_atlas(lldata):
+    before = landmarks(lldata.LL, lldata.landmarkNames)
+    atlas = landmarkmodel.makeLandmarkAtlas(lldata.LL)
+    atlas.update_all_models([1.0, 1.0], [0, 1], PELVIS_RIGID, HIP_ROT, KNEE_ROT)
+    np.testing.assert_array_equal(landmarks(lldata.LL, lldata.landmarkNames), before)
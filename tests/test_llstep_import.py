@@ -0,0 +1,26 @@
+import json
+import os
+import subprocess
+import sys
+
+
+def importedModules(code):
+    """Names of the modules imported by running code in a new interpreter
+    """
+    code = code + '\nimport json, sys\nprint(json.dumps(sorted(sys.modules)))'
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def test_import_does_not_load_gias3():
+    modules = importedModules('from mapclientplugins.fieldworklowerlimbgenerationstep import llstep\n'
+                              'llstep.LLStepData({"side": "left"})')
+    assert 'mapclientplugins.fieldworklowerlimbgenerationstep.llstep' in modules
+    assert [m for m in modules if m.startswith(('gias3.', 'scipy'))] == []
+
+
+def test_load_data_loads_gias3():
+    modules = importedModules('from mapclientplugins.fieldworklowerlimbgenerationstep import llstep\n'
+                              'llstep.LLStepData({"side": "left"}).loadData()')
+    assert 'gias3.musculoskeletal.bonemodels.bonemodels' in modules
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from conftest import makeLandmarks
+
+
+def test_first_start_is_initial_alignment(targetLandmarks, lldata):
+    starts = lldata._makeStarts(3, seed=0)
+    # the first three landmarks of the neutral shape at the start pose are
+    # registered to the targets, up to the shape differences
+    aligned = makeLandmarks(lldata, [0.0, 0.0], starts[0]['pelvisRigid'], [0.0, 0.0, 0.0], [0.0])
+    names = lldata.landmarkNames[:3]
+    dist = [np.linalg.norm(aligned[l] - targetLandmarks[l]) for l in names]
+    assert max(dist) < 10.0
+    assert not np.allclose(starts[1]['pelvisRigid'], starts[0]['pelvisRigid'])
+    np.testing.assert_array_equal(lldata._makeStarts(3, seed=0)[2]['hipRot'], starts[2]['hipRot'])
+
+
+@pytest.mark.parametrize('nWorkers', [1, 2])
+def test_keeps_best_start(targetLandmarks, lldata, shortFits, nWorkers):
+    starts = lldata._makeStarts(3, seed=0)
+    results = lldata.registerMultiStart(3, nWorkers=nWorkers, seed=0)
+    assert len(results) == 3
+    assert all(r['error'] is None for r in results)
+    rmse = [r['landmarkRMSE'] for r in results]
+    best = results[int(np.argmin(rmse))]
+    assert lldata.landmarkRMSE == min(rmse)
+    np.testing.assert_array_equal(lldata.T.shapeModelX, best['transform'].shapeModelX)
+    for result, start in zip(results, starts):
+        np.testing.assert_array_equal(result['start']['pelvisRigid'], start['pelvisRigid'])
+
+
+@pytest.mark.parametrize('nWorkers', [1, 2])
+def test_stops_at_rmse_threshold(targetLandmarks, lldata, shortFits, nWorkers):
+    results = lldata.registerMultiStart(4, nWorkers=nWorkers, rmseThreshold=1e6, seed=0)
+    fitted = [r for r in results if r is not None]
+    # the first fit to finish reaches the threshold, the others are cancelled
+    assert len(fitted) == 1
+    assert lldata.landmarkRMSE == fitted[0]['landmarkRMSE']
+    if nWorkers == 1:
+        assert results[0] is fitted[0]
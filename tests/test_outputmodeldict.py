@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+
+
+@pytest.fixture
+def posed(lldata):
+    lldata.T.kneeRot = [0.2]
+    lldata.updateLLModel()
+    return lldata
+
+
+def fieldParameters(gf):
+    return np.array(gf.field_parameters)
+
+
+def test_entries_show_model_when_made(posed):
+    outputs = posed.outputModelDict
+    femur = fieldParameters(posed.LL.models['femur'].gf)
+    tibiaFibula = fieldParameters(posed.LL.models['tibiafibula'].gf)
+    expectedTibia = posed._makeTibiaFibulaSubmeshGF('tibia').field_parameters
+
+    posed.T.hipRot = [0.3, 0.0, 0.0]
+    posed.T.kneeRot = [0.6]
+    assert posed.updateLLModel() == ('femur', 'patella', 'tibiafibula')
+    assert not np.allclose(posed.LL.models['tibiafibula'].gf.field_parameters, tibiaFibula)
+
+    # built after the update, from the model before it
+    np.testing.assert_array_equal(outputs['femur'].field_parameters, femur)
+    np.testing.assert_array_equal(outputs['tibiafibula'].field_parameters, tibiaFibula)
+    np.testing.assert_array_equal(outputs['tibia'].field_parameters, expectedTibia)
+    np.testing.assert_array_equal(posed.outputModelDict['tibiafibula'].field_parameters,
+                                  posed.LL.models['tibiafibula'].gf.field_parameters)
+
+
+def test_reused_until_model_changes(posed):
+    outputs = posed.outputModelDict
+    assert posed.outputModelDict is outputs
+    posed.T.kneeRot = [0.6]
+    posed.updateLLModel()
+    assert posed.outputModelDict is not outputs
+
+
+def test_partial_rebuild_carries_over_unchanged_bones(posed):
+    old = dict(posed.outputModelDict)
+    posed.T.kneeRot = [0.6]
+    changed = posed.updateLLModel()
+    assert set(changed) == {'tibiafibula', 'patella'}
+
+    new = posed.outputModelDict
+    for key, bone in llstep.OUTPUT_MODEL_BONES.items():
+        if bone in changed:
+            assert key not in new._values, key
+            assert new[key] is not old[key], key
+        else:
+            assert new._values[key] is old[key], key
+    np.testing.assert_array_equal(new['patella'].field_parameters,
+                                  posed.LL.models['patella'].gf.field_parameters)
+
+
+@pytest.fixture
+def views(posed):
+    copies = dict(posed.outputModelDict)
+    posed.config['output_submesh_views'] = 'True'
+    posed._outputModelDict = None
+    assert posed.outputSubmeshViews
+    return copies, posed.outputModelDict
+
+
+def test_views_equal_copies(posed, views):
+    copies, outputs = views
+    assert set(outputs) == set(copies)
+    for key in outputs:
+        np.testing.assert_array_equal(outputs[key].field_parameters, copies[key].field_parameters)
+        assert not outputs[key].field_parameters.flags.writeable, key
+
+    for name, elements in llstep.TIBFIB_SUBMESH_ELEMS.items():
+        expected = posed.LL.models['tibiafibula'].gf.makeGFFromElements(
+            name, elements, llstep.TIBFIB_BASISTYPES)
+        np.testing.assert_array_equal(outputs[name].field_parameters, expected.field_parameters)
+    # contiguous submeshes share storage with the bone
+    assert np.shares_memory(outputs['tibia'].field_parameters,
+                            posed.LL.models['tibiafibula'].gf.field_parameters)
+
+
+def test_view_writes(posed, views):
+    outputs = views[1]
+    femur = posed.LL.models['femur'].gf
+    expected = fieldParameters(femur)
+
+    with pytest.raises(ValueError):
+        outputs['femur'].field_parameters[0, 0, 0] = 1.0
+
+    # gias3 transforms assign the view its own parameters
+    outputs['femur'].transformTranslate(np.array([10.0, 0.0, 0.0]))
+    assert outputs['femur'].field_parameters.flags.writeable
+    assert not np.shares_memory(outputs['femur'].field_parameters, femur.field_parameters)
+    np.testing.assert_array_equal(femur.field_parameters, expected)
+    np.testing.assert_allclose(outputs['femur'].field_parameters[0], expected[0] + 10.0)
+
+
+def test_views_config_setter(posed):
+    outputs = posed.outputModelDict
+    posed.outputSubmeshViews = True
+    assert posed.config['output_submesh_views'] == 'True'
+    assert posed.outputModelDict is not outputs
+    assert not posed.outputModelDict['pelvis'].field_parameters.flags.writeable
@@ -0,0 +1,31 @@
+import pytest
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+from mapclientplugins.fieldworklowerlimbgenerationstep.cancellation import CancellationToken
+
+
+def test_parse_pc_schedule():
+    assert llstep.parsePCSchedule('', 4) is None
+    assert llstep.parsePCSchedule('None', 4) is None
+    assert llstep.parsePCSchedule('auto', 8) == [0, 1, 2, 4, 8]
+    assert llstep.parsePCSchedule('auto', 1) == [0, 1]
+    assert llstep.parsePCSchedule('auto', 0) is None
+    assert llstep.parsePCSchedule('0, 2, 6', 4) == [0, 2, 4]
+    assert llstep.parsePCSchedule('0, 4', 4) == [0, 4]
+    # only the final stage
+    assert llstep.parsePCSchedule('4', 4) is None
+    assert llstep.parsePCSchedule('6, 8', 4) is None
+    assert llstep.parsePCSchedule('0', 0) is None
+    for spec in ('2,1', '2,2,4', '-1,2', 'a,b'):
+        with pytest.raises(ValueError):
+            llstep.parsePCSchedule(spec, 4)
+
+
+def test_cancelled_schedule_restores_shape_modes(lldata, targetLandmarks):
+    lldata.config['pc_schedule'] = '0,1'
+    token = CancellationToken()
+    token.cancel()
+    output = lldata.register(cancelToken=token)
+    assert output[3]['cancelled']
+    assert lldata.T.nShapeModes == 2
+    assert len(lldata.T.shapeModeWeights) == 2
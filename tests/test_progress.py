@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.fieldworklowerlimbgenerationstep.progress import ProgressReporter
+
+
+def test_events():
+    progress = ProgressReporter()
+    events = []
+    progress.iterate(1.0)
+    progress.addListener(events.append)
+    progress.start()
+    progress.iterate(2.0, 3)
+    progress.finish(1.5, 3)
+    progress.removeListener(events.append)
+    progress.iterate(1.0)
+    assert [(e.iteration, e.rmse, e.stage, e.done) for e in events] == [(1, 2.0, 3, False), (1, 1.5, 3, True)]
+
+
+@pytest.mark.parametrize('mode, stage', [('shapemodel', 2), ('uniformscaling', None), ('perbonescaling', None)])
+def test_iteration_events_in_every_mode(lldata, targetLandmarks, shortFits, mode, stage):
+    lldata.config['registration_mode'] = mode
+    events = []
+    lldata.progress.addListener(events.append)
+    lldata.register()
+
+    iterations = [e for e in events if not e.done]
+    assert len(iterations) > 0
+    assert [e.iteration for e in iterations] == list(range(1, len(iterations) + 1))
+    assert all(e.stage == stage for e in events)
+    assert all(np.isfinite(e.rmse) for e in iterations)
+    assert events[-1].done
+    assert events[-1].rmse == pytest.approx(lldata.landmarkRMSE)
+    if stage is None:
+        # the RMSE of each iterate, which only decreases
+        rmse = [e.rmse for e in iterations]
+        assert rmse == sorted(rmse, reverse=True)
+        assert rmse[-1] == pytest.approx(lldata.landmarkRMSE)
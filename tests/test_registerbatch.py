@@ -0,0 +1,44 @@
+import copy
+
+import numpy as np
+import pytest
+
+from conftest import HIP_ROT, KNEE_ROT, PELVIS_RIGID, WEIGHTS, makeLandmarks
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+
+
+def serialRegister(config, landmarks):
+    lldata = llstep.LLStepData(copy.deepcopy(config))
+    lldata.loadData()
+    lldata.inputLandmarks = landmarks
+    xFitted = lldata.register()[0]
+    return xFitted, lldata.landmarkRMSE, lldata.fitMDist
+
+
+def test_register_batch_error(lldata):
+    results = lldata.registerBatch([{}], nWorkers=1, outputModels=False)
+    assert len(results) == 1
+    assert results[0]['error'] is not None
+    assert results[0]['xFitted'] is None
+
+
+def test_workers_equal_serial_register(lldata, shortFits):
+    subjects = [makeLandmarks(lldata, WEIGHTS, PELVIS_RIGID, HIP_ROT, KNEE_ROT),
+                {},
+                makeLandmarks(lldata, [-0.4, 0.2], np.array(PELVIS_RIGID) + 20.0, HIP_ROT, [0.6]),
+                ]
+    results = lldata.registerBatch(subjects, nWorkers=2, outputModels=False)
+
+    # the invalid subject fails first, the others are still in input order
+    assert len(results) == 3
+    assert results[1]['error'] is not None
+    assert results[1]['xFitted'] is None
+    for i in (0, 2):
+        result = results[i]
+        assert result['error'] is None
+        xFitted, rmse, mDist = serialRegister(lldata.config, subjects[i])
+        np.testing.assert_allclose(np.hstack(result['xFitted'][-1]), np.hstack(xFitted[-1]),
+                                   rtol=1e-10, atol=1e-10)
+        assert result['landmarkRMSE'] == pytest.approx(rmse, rel=1e-10)
+        assert result['fitMDist'] == pytest.approx(mDist, rel=1e-10)
+    assert results[0]['landmarkRMSE'] != pytest.approx(results[2]['landmarkRMSE'])
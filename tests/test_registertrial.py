@@ -0,0 +1,20 @@
+import numpy as np
+
+from conftest import HIP_ROT, KNEE_ROT, PELVIS_RIGID, WEIGHTS, makeLandmarks, startNearTarget
+
+
+def test_register_trial(analytic, targetLandmarks):
+    lldata = analytic
+    startNearTarget(lldata)
+    moved = np.array(PELVIS_RIGID) + [5.0, -2.0, 1.0, 0.05, 0.0, 0.0]
+    frames = [targetLandmarks,
+              makeLandmarks(lldata, WEIGHTS, moved, HIP_ROT, KNEE_ROT),
+              {},
+              ]
+    results = list(lldata.registerTrial(frames))
+    assert [r['frame'] for r in results] == [0, 1, 2]
+    assert results[0]['error'] is None
+    assert results[1]['landmarkRMSE'] < 1.0
+    np.testing.assert_allclose(results[1]['pelvisRigid'][:3], moved[:3], atol=1.0)
+    assert results[2]['error'] is not None
+    np.testing.assert_array_equal(results[2]['pelvisRigid'], results[1]['pelvisRigid'])
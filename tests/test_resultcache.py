@@ -0,0 +1,109 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import startNearTarget
+from mapclientplugins.fieldworklowerlimbgenerationstep import resultcache
+
+
+def test_make_key():
+    items = {'a': np.arange(3.0), 'b': {'c': 1, 'd': 'e'}}
+    key = resultcache.makeKey(items)
+    assert key == resultcache.makeKey({'b': {'d': 'e', 'c': 1}, 'a': [0.0, 1.0, 2.0]})
+    assert key != resultcache.makeKey({'a': np.arange(3.0) + 1e-9, 'b': {'c': 1, 'd': 'e'}})
+    assert key != resultcache.makeKey({'a': np.arange(3.0), 'b': {'c': 2, 'd': 'e'}})
+    assert key != resultcache.makeKey({'a': np.arange(3.0), 'b': {'c': 1, 'd': 'e'}, 'f': None})
+
+
+def test_file_checksum(tmp_path):
+    path = str(tmp_path / 'f')
+    with open(path, 'w') as f:
+        f.write('abc')
+    checksum = resultcache.fileChecksum(path)
+    assert checksum == resultcache.fileChecksum(path)
+    with open(path, 'w') as f:
+        f.write('abcd')
+    assert resultcache.fileChecksum(path) != checksum
+
+
+def test_put_get(tmp_path):
+    cache = resultcache.ResultCache(str(tmp_path))
+    assert cache.get('k') is None
+    cache.put('k', {'x': np.arange(2.0)})
+    assert cache.get('k') == {'x': [0.0, 1.0]}
+    cache.clear()
+    assert cache.get('k') is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = resultcache.ResultCache(str(tmp_path), maxBytes=10 ** 6)
+    for i, key in enumerate('abc'):
+        cache.put(key, {'x': list(range(100))})
+        os.utime(cache._path(key), (i, i))
+    cache.get('a')
+    size = os.path.getsize(cache._path('a'))
+    cache.maxBytes = 2 * size
+    cache.evict()
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+def test_key_sensitivity(lldata, targetLandmarks, tmp_path):
+    key = lldata._resultCacheKey()
+    assert key == lldata._resultCacheKey()
+
+    moved = dict(targetLandmarks)
+    name = lldata.landmarkNames[0]
+    moved[name] = moved[name] + 1.0
+    lldata.inputLandmarks = moved
+    lldata.updateFromConfig()
+    assert lldata._resultCacheKey() != key
+    lldata.inputLandmarks = targetLandmarks
+    lldata.updateFromConfig()
+    assert lldata._resultCacheKey() == key
+
+    for name, value in (('mweight', '0.2'), ('pcs_to_fit', '3'), ('pc_schedule', 'auto'), ('knee_dof', 'True')):
+        old = lldata.config.get(name, '')
+        lldata.config[name] = value
+        assert lldata._resultCacheKey() != key, name
+        lldata.config[name] = old
+
+    lldata.T.pelvisRigid = [1.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    assert lldata._resultCacheKey() != key
+
+
+def test_key_includes_warm_start(lldata, targetLandmarks, tmp_path):
+    lldata.config['warm_start_dir'] = str(tmp_path)
+    noSidecar = lldata._resultCacheKey()
+
+    lldata.T.pelvisRigid = [1.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    lldata.saveWarmStart()
+    lldata.T.pelvisRigid = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    first = lldata._resultCacheKey()
+    assert first != noSidecar
+
+    lldata.T.pelvisRigid = [2.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    lldata.saveWarmStart()
+    lldata.T.pelvisRigid = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    assert lldata._resultCacheKey() != first
+
+
+def test_result_cache_hit(analytic, targetLandmarks, tmp_path):
+    lldata = analytic
+    lldata.config['result_cache_dir'] = str(tmp_path)
+    startNearTarget(lldata)
+    start = lldata.T.toDict()
+    fitted = lldata.register()
+    assert not fitted[3].get('result_cache_hit')
+    transform = lldata.T.toDict()
+
+    lldata.T.setFromDict(start)
+    lldata.T.lastTransformSet = None
+    cached = lldata.register()
+    assert cached[3]['result_cache_hit']
+    assert lldata.T.toDict() == transform
+    assert lldata.T.lastTransformSet is not None
+    assert cached[2] == pytest.approx(fitted[2])
+    assert lldata.stats['counters']['resultCacheHits'] == 1
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import landmarkmodel
+from mapclientplugins.fieldworklowerlimbgenerationstep import shapemodelfit
+
+X = np.hstack([[0.8, -0.6], [10.0, -5.0, 3.0, 0.1, -0.05, 0.2], [0.2, 0.05, -0.1], [0.3]])
+
+
+@pytest.fixture
+def objective(lldata):
+    atlas = landmarkmodel.makeLandmarkAtlas(lldata.LL)
+    targets = np.random.RandomState(0).normal(0.0, 10.0, (len(lldata.landmarkNames), 3))
+    return shapemodelfit.ShapeModelLandmarkObjective(atlas, targets, lldata.landmarkNames, [0, 1], 0.1)
+
+
+def centralDifference(f, x, i, h=1e-3):
+    xp = x.copy()
+    xp[i] += h
+    xm = x.copy()
+    xm[i] -= h
+    return (f(xp) - f(xm)) / (2.0 * h)
+
+
+def test_landmark_jacobian_equals_finite_differences(objective):
+    L0, dL = objective.landmarkJacobian(X)
+    R = shapemodelfit._rotationMatrices(X[5:8])[0]
+    J = dL.dot(R.T)
+    # pc weights and hip rot. The knee column is left out, the knee gap
+    # is not smooth in the knee angle.
+    for k, i in enumerate([0, 1, 8, 9, 10]):
+        expected = centralDifference(objective.landmarkResiduals, X, i)
+        error = np.linalg.norm(J[k] - expected) / np.linalg.norm(expected)
+        assert error < 0.05, (i, error)
+
+
+def test_gradient_equals_finite_differences(objective):
+    f, g = objective(X)
+    assert f == pytest.approx(objective(X)[0])
+    expected = [centralDifference(lambda x: objective(x)[0], X, i) for i in range(len(X))]
+    # pelvis rigid and mahalanobis terms are analytic
+    np.testing.assert_allclose(g[2:8], expected[2:8], rtol=1e-4)
+    np.testing.assert_allclose(g[:2], expected[:2], rtol=0.05)
+
+
+def test_pose_jacobian_equals_finite_differences(objective):
+    ll = objective.ll
+    ll.update_all_models(X[:2], [0, 1], np.zeros(6), X[8:11], X[11:])
+    pose = shapemodelfit.PoseLandmarkObjective(ll, objective.targetLandmarks, objective.landmarkNames)
+    x = X[2:]
+    J = pose.jacobian(x)
+    for i in range(9):
+        expected = centralDifference(pose.residuals, x, i)
+        np.testing.assert_allclose(J[:, i], expected, rtol=0.0, atol=0.01 * np.abs(expected).max())
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from mapclientplugins.fieldworklowerlimbgenerationstep.snapshot import SnapshotBuffer
+
+
+class Listener(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+
+
+@pytest.fixture
+def buf():
+    buf = SnapshotBuffer(minInterval=0.0)
+    buf.setListener(Listener())
+    buf.open()
+    return buf
+
+
+def received(buf):
+    snapshots = []
+    buf.apply(snapshots.append)
+    return snapshots
+
+
+def test_snapshot_is_read_only_copy(buf):
+    x = [np.zeros(2), np.ones(6)]
+    assert buf.publish('shapemodel', [0, 1], x)
+    x[0][0] = 1.0
+    snapshot, = received(buf)
+    assert snapshot.mode == 'shapemodel'
+    assert snapshot.x[0][0] == 0.0
+    with pytest.raises(ValueError):
+        snapshot.x[1][0] = 0.0
+
+
+def test_not_due_without_listener_or_when_closed():
+    buf = SnapshotBuffer(minInterval=0.0)
+    buf.open()
+    assert not buf.publish('shapemodel', None, [np.zeros(2)])
+    buf.setListener(Listener())
+    assert buf.publish('shapemodel', None, [np.zeros(2)])
+    buf.close()
+    assert not buf.publish('shapemodel', None, [np.zeros(2)])
+
+
+def test_publish_throttled_by_interval(buf):
+    buf.minInterval = 0.2
+    assert buf.publish('uniformscaling', None, [np.zeros(1)])
+    assert not buf.due
+    assert not buf.publish('uniformscaling', None, [np.ones(1)])
+    time.sleep(0.25)
+    assert buf.publish('uniformscaling', None, [np.ones(1)])
+    assert received(buf)[0].x[0][0] == 1.0
+
+
+def test_interval_grows_with_apply_duration(buf):
+    buf.maxApplyFraction = 0.1
+    buf.publish('shapemodel', None, [np.zeros(1)])
+    buf.apply(lambda snapshot: time.sleep(0.02))
+    # an apply of 0.02 s may take at most a tenth of the time
+    assert buf.interval >= 0.2
+    assert not buf.due
+
+
+def test_notify_only_when_front_fills(buf):
+    listener = buf._listener
+    buf.publish('shapemodel', None, [np.zeros(1)])
+    buf.publish('shapemodel', None, [np.ones(1)])
+    assert listener.calls == 1
+    # the newer snapshot replaced the waiting one
+    snapshot, = received(buf)
+    assert snapshot.x[0][0] == 1.0
+    assert received(buf) == []
+
+    buf.publish('shapemodel', None, [np.zeros(1)])
+    assert listener.calls == 2
+
+
+def test_publish_dropped_while_applying(buf):
+    buf.publish('shapemodel', None, [np.zeros(1)])
+    published = []
+
+    def apply(snapshot):
+        # another thread publishing while the lock is held does not wait
+        t = threading.Thread(target=lambda: published.append(buf.publish('shapemodel', None, [np.ones(1)])))
+        t.start()
+        t.join(5.0)
+        assert not t.is_alive()
+
+    assert buf.apply(apply)
+    assert published == [False]
+    assert received(buf) == []
+
+
+def test_close_discards_waiting_snapshot(buf):
+    buf.publish('shapemodel', None, [np.zeros(1)])
+    buf.close()
+    assert received(buf) == []
+    # reopening starts empty
+    buf.open()
+    assert received(buf) == []
+
+
+def test_close_waits_for_apply(buf):
+    buf.publish('shapemodel', None, [np.zeros(1)])
+    applying = threading.Event()
+    events = []
+
+    def apply(snapshot):
+        applying.set()
+        time.sleep(0.1)
+        events.append('applied')
+
+    t = threading.Thread(target=buf.apply, args=(apply,))
+    t.start()
+    applying.wait(5.0)
+    buf.close()
+    events.append('closed')
+    t.join()
+    assert events == ['applied', 'closed']
@@ -0,0 +1,55 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('mapclient.mountpoints.workflowstep')
+
+from mapclientplugins.fieldworklowerlimbgenerationstep.step import FieldworkLowerLimbGenerationStep  # noqa: E402
+
+GUI_MODULES = ('PySide2', 'PySide6', 'PyQt5', 'PyQt6', 'traits', 'traitsui', 'pyface', 'mayavi', 'tvtk', 'vtk')
+
+
+@pytest.fixture
+def step(tmp_path):
+    step = FieldworkLowerLimbGenerationStep(str(tmp_path))
+    step._identifierOccursCount = lambda identifier: 1
+    return step
+
+
+@pytest.mark.parametrize('pcSchedule, pcsToFit, configured', [
+    ('', '1', True),
+    ('auto', '4', True),
+    ('0,2', '4', True),
+    ('2,1', '4', False),
+    ('2,2,4', '4', False),
+    ('a', '4', False),
+    ('0,2', 'x', False),
+])
+def test_deserialize_validates_pc_schedule(step, pcSchedule, pcsToFit, configured):
+    step.deserialize(json.dumps({'identifier': 'llstep', 'pc_schedule': pcSchedule, 'pcs_to_fit': pcsToFit}))
+    assert step._configured is configured
+
+
+def test_deserialize_duplicate_identifier(step):
+    step._identifierOccursCount = lambda identifier: 2
+    step.deserialize(json.dumps({'identifier': 'llstep'}))
+    assert not step._configured
+
+
+def test_deserialize_imports_no_gui(tmp_path):
+    code = '\n'.join([
+        'import json, sys',
+        'from mapclientplugins.fieldworklowerlimbgenerationstep.step import FieldworkLowerLimbGenerationStep',
+        'step = FieldworkLowerLimbGenerationStep({!r})'.format(str(tmp_path)),
+        'step._identifierOccursCount = lambda identifier: 1',
+        'step.deserialize(json.dumps({"identifier": "llstep", "pc_schedule": "auto"}))',
+        'assert step._configured',
+        'print(json.dumps(sorted(set(m.split(".")[0] for m in sys.modules))))',
+    ])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    modules = json.loads(output.stdout.strip().splitlines()[-1])
+    assert not set(modules) & set(GUI_MODULES)
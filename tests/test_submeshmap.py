@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+from mapclientplugins.fieldworklowerlimbgenerationstep.submeshmap import SubmeshMap, viewGF
+
+SUBMESHES = [
+    ('pelvis', 'sacrum', llstep.PELVIS_SUBMESH_ELEMS['sac'], llstep.PELVIS_BASISTYPES),
+    ('tibiafibula', 'fibula', llstep.TIBFIB_SUBMESH_ELEMS['fibula'], llstep.TIBFIB_BASISTYPES),
+]
+
+
+@pytest.mark.parametrize('bone, name, elements, basisTypes', SUBMESHES)
+def test_nodes_equal_make_gf_from_elements(lldata, bone, name, elements, basisTypes):
+    gf = lldata.LL.models[bone].gf
+    submeshMap = SubmeshMap(gf, name, elements, basisTypes)
+    # a different shape than the map was built from
+    lldata.LL.update_all_models([1.0, -1.0], [0, 1], np.zeros(6), np.zeros(3), [0.0])
+    gf = lldata.LL.models[bone].gf
+
+    expected = gf.makeGFFromElements(name, elements, basisTypes)
+    submesh = submeshMap.makeGF(gf)
+    np.testing.assert_array_equal(submesh.get_field_parameters(), expected.get_field_parameters())
+    assert sorted(submesh.ensemble_field_function.mesh.elements) == \
+           sorted(expected.ensemble_field_function.mesh.elements)
+    np.testing.assert_array_equal(submeshMap.makeView(gf).field_parameters, expected.field_parameters)
+
+
+def test_submeshes_are_independent(lldata):
+    bone, name, elements, basisTypes = SUBMESHES[0]
+    gf = lldata.LL.models[bone].gf
+    submeshMap = SubmeshMap(gf, name, elements, basisTypes)
+    a = submeshMap.makeGF(gf)
+    b = submeshMap.makeGF(gf)
+    for attr in ('ensemble_field_function', 'triangulator', 'points', 'field_parameters'):
+        assert getattr(a, attr) is not getattr(b, attr)
+        assert getattr(a, attr) is not getattr(submeshMap.template, attr)
+    assert a.ensemble_field_function.mesh is not b.ensemble_field_function.mesh
+
+    a.ensemble_field_function.mesh.connectivity.clear()
+    a.field_parameters[:] = 0.0
+    assert len(b.ensemble_field_function.mesh.connectivity) > 0
+    assert len(submeshMap.template.ensemble_field_function.mesh.connectivity) > 0
+    np.testing.assert_array_equal(b.field_parameters, gf.field_parameters[:, submeshMap.nodeIndex, :])
+
+
+def test_views_are_read_only(lldata):
+    gf = lldata.LL.models['pelvis'].gf
+    view = viewGF(gf)
+    assert np.shares_memory(view.field_parameters, gf.field_parameters)
+    with pytest.raises(ValueError):
+        view.field_parameters[0, 0, 0] = 1.0
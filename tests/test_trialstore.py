@@ -0,0 +1,132 @@
+import os
+
+import numpy as np
+import pytest
+
+from mapclientplugins.fieldworklowerlimbgenerationstep import trialstore
+
+
+def makeFrame(i):
+    return {'pose': np.full(6, float(i)),
+            'nodes': np.full((4, 3), float(i), dtype=np.float32),
+            'rmse': float(i),
+            }
+
+
+def writeFrames(directory, start, stop, chunkFrames=4):
+    with trialstore.TrialWriter(directory, chunkFrames, attrs={'subject': 'a'}) as writer:
+        for i in range(start, stop):
+            writer.append(makeFrame(i))
+
+
+def test_round_trip(tmp_path):
+    writeFrames(str(tmp_path), 0, 10)
+    reader = trialstore.TrialReader(str(tmp_path))
+    assert reader.nFrames == 10
+    assert reader.names == ['nodes', 'pose', 'rmse']
+    assert reader.attrs == {'subject': 'a'}
+    assert reader.frameShape('nodes') == (4, 3)
+
+    nodes = reader.read('nodes')
+    assert nodes.dtype == np.float32
+    assert nodes.shape == (10, 4, 3)
+    np.testing.assert_array_equal(nodes[:, 0, 0], np.arange(10))
+    # within and across shards
+    np.testing.assert_array_equal(reader.read('pose', 1, 3)[:, 0], [1, 2])
+    np.testing.assert_array_equal(reader.read('pose', 2, 9)[:, 0], np.arange(2, 9))
+    np.testing.assert_array_equal(reader.readFrames(8)['rmse'], [8, 9])
+    assert reader.read('pose', 5, 5).shape == (0, 6)
+
+
+def test_within_shard_read_is_memory_mapped(tmp_path):
+    writeFrames(str(tmp_path), 0, 10)
+    part = trialstore.TrialReader(str(tmp_path)).read('pose', 4, 7)
+    assert isinstance(part, np.memmap)
+    assert not part.flags.writeable
+
+
+def test_reopen_and_append(tmp_path):
+    writeFrames(str(tmp_path), 0, 6)
+    writeFrames(str(tmp_path), 6, 11)
+    reader = trialstore.TrialReader(str(tmp_path))
+    assert reader.nFrames == 11
+    assert reader.chunkFrames == 4
+    np.testing.assert_array_equal(reader.read('rmse'), np.arange(11))
+
+
+def test_reader_refresh(tmp_path):
+    writeFrames(str(tmp_path), 0, 3)
+    reader = trialstore.TrialReader(str(tmp_path))
+    writeFrames(str(tmp_path), 3, 5)
+    assert reader.nFrames == 3
+    reader.refresh()
+    assert reader.nFrames == 5
+
+
+def test_crash_keeps_complete_frames(tmp_path):
+    directory = str(tmp_path)
+    writer = trialstore.TrialWriter(directory, 4)
+    for i in range(6):
+        writer.append(makeFrame(i))
+    # the first shard was completed and recorded, frames 4 and 5 were
+    # neither flushed nor recorded when the writer is lost
+    del writer
+    reader = trialstore.TrialReader(directory)
+    assert reader.nFrames == 4
+    np.testing.assert_array_equal(reader.read('rmse'), np.arange(4))
+
+    # a new writer continues after the last complete frame
+    writer = trialstore.TrialWriter(directory)
+    writer.append(makeFrame(40))
+    writer.close()
+    reader.refresh()
+    np.testing.assert_array_equal(reader.read('rmse'), [0, 1, 2, 3, 40])
+
+
+def test_flush_records_frames(tmp_path):
+    writer = trialstore.TrialWriter(str(tmp_path), 4)
+    for i in range(3):
+        writer.append(makeFrame(i))
+    writer.flush()
+    assert trialstore.TrialReader(str(tmp_path)).nFrames == 3
+    writer.close()
+
+
+@pytest.mark.parametrize('change', [
+    {'nodes': np.zeros((5, 3), dtype=np.float32)},
+    {'pose': np.zeros(6, dtype=complex)},
+])
+def test_bad_frame_writes_nothing(tmp_path, change):
+    directory = str(tmp_path)
+    writer = trialstore.TrialWriter(directory, 4)
+    writer.append(makeFrame(0))
+    bad = makeFrame(1)
+    bad.update(change)
+    with pytest.raises(ValueError):
+        writer.append(bad)
+    assert writer.nFrames == 1
+    writer.append(makeFrame(2))
+    writer.close()
+    reader = trialstore.TrialReader(directory)
+    np.testing.assert_array_equal(reader.read('pose')[:, 0], [0, 2])
+    np.testing.assert_array_equal(reader.read('nodes')[:, 0, 0], [0, 2])
+
+
+def test_frame_arrays_must_match(tmp_path):
+    writer = trialstore.TrialWriter(str(tmp_path), 4)
+    writer.append(makeFrame(0))
+    frame = makeFrame(1)
+    del frame['rmse']
+    with pytest.raises(ValueError):
+        writer.append(frame)
+
+
+def test_invalid_array_name(tmp_path):
+    writer = trialstore.TrialWriter(str(tmp_path / 'store'), 4)
+    with pytest.raises(ValueError):
+        writer.append({'bad name': np.zeros(3)})
+
+
+def test_missing_store(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        trialstore.TrialReader(os.path.join(str(tmp_path), 'none'))
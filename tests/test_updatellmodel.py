@@ -0,0 +1,77 @@
+import copy
+
+import numpy as np
+import pytest
+
+from conftest import CONFIG, HIP_ROT, KNEE_ROT, PELVIS_RIGID, WEIGHTS
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+
+
+@pytest.fixture
+def posed(lldata):
+    lldata.T.shapeModeWeights = WEIGHTS
+    lldata.T.pelvisRigid = PELVIS_RIGID
+    lldata.T.hipRot = HIP_ROT
+    lldata.T.kneeRot = KNEE_ROT
+    assert lldata.updateLLModel() == tuple(lldata.LL.models)
+    return lldata
+
+
+def assertModelEqual(ll, expected, atol):
+    for mn, m in ll.models.items():
+        np.testing.assert_allclose(m.gf.field_parameters, expected[mn], rtol=0.0, atol=atol, err_msg=mn)
+
+
+def fullUpdate(T):
+    """Field parameters of each bone of a new model fully updated to T
+    """
+    lldata = llstep.LLStepData(copy.deepcopy(CONFIG))
+    lldata.loadData()
+    lldata.LL.update_all_models(T.shapeModeWeights, T.shapeModes, T.pelvisRigid, T.hipRot, T.kneeRot)
+    return dict((mn, np.array(m.gf.field_parameters)) for mn, m in lldata.LL.models.items())
+
+
+def test_partial_updates_equal_full_update(posed):
+    pelvis = np.array(posed.LL.models['pelvis'].gf.field_parameters)
+
+    posed.T.hipRot = [0.2, -0.1, 0.05]
+    assert set(posed.updateLLModel()) == {'femur', 'patella', 'tibiafibula'}
+    posed.T.kneeRot = [0.5]
+    assert set(posed.updateLLModel()) == {'patella', 'tibiafibula'}
+    assert posed.updateLLModel() == ()
+
+    np.testing.assert_array_equal(posed.LL.models['pelvis'].gf.field_parameters, pelvis)
+    # bones are re-placed from their current pose, which leaves a round-off
+    # of the joint fits of about 1e-6 mm
+    assertModelEqual(posed.LL, fullUpdate(posed.T), 1e-5)
+
+
+def test_full_update_after_max_partial_updates(posed, monkeypatch):
+    monkeypatch.setattr(llstep, 'MAX_PARTIAL_UPDATES', 3)
+    fullUpdates = []
+    updateAllModels = posed.LL.update_all_models
+    monkeypatch.setattr(posed.LL, 'update_all_models',
+                        lambda *args: fullUpdates.append(1) or updateAllModels(*args))
+
+    updated = []
+    for i in range(4):
+        posed.T.kneeRot = [0.3 + 0.1 * (i + 1)]
+        updated.append(posed.updateLLModel())
+    # three partial updates, then a full one that resets the count
+    assert fullUpdates == [1]
+    assert [len(u) for u in updated] == [2, 2, 2, len(posed.LL.models)]
+    assert posed._partialUpdates == 0
+    assertModelEqual(posed.LL, fullUpdate(posed.T), 1e-10)
+
+    posed.T.kneeRot = [0.2]
+    assert len(posed.updateLLModel()) == 2
+    assert fullUpdates == [1]
+    assert posed._partialUpdates == 1
+
+
+def test_shape_change_is_full_update(posed):
+    posed.T.hipRot = [0.2, 0.0, 0.0]
+    posed.updateLLModel()
+    posed.T.shapeModeWeights = [0.1, 0.1]
+    assert posed.updateLLModel() == tuple(posed.LL.models)
+    assert posed._partialUpdates == 0
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from conftest import HIP_ROT, KNEE_ROT, PELVIS_RIGID, WEIGHTS
+from mapclientplugins.fieldworklowerlimbgenerationstep import llstep
+from mapclientplugins.fieldworklowerlimbgenerationstep import warmstart
+
+POSE = [np.array(PELVIS_RIGID), np.array(HIP_ROT), np.array(KNEE_ROT)]
+
+
+def test_warm_start_round_trip(lldata, targetLandmarks, tmp_path):
+    lldata.config['warm_start_dir'] = str(tmp_path)
+    assert not lldata.loadWarmStart()
+    lldata.T.shapeModeWeights = [0.5, -0.5]
+    lldata.T.pelvisRigid = [1.0, 2.0, 3.0, 0.1, 0.2, 0.3]
+    saved = lldata.T.toDict()
+    lldata.saveWarmStart()
+
+    lldata.T.shapeModeWeights = [0.0, 0.0]
+    lldata.T.pelvisRigid = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    assert lldata.loadWarmStart()
+    assert lldata.T.toDict() == saved
+
+
+def test_landmark_set_hash():
+    coords = np.arange(6.0).reshape((2, 3))
+    key = warmstart.landmarkSetHash('left', ['a', 'b'], coords)
+    assert key == warmstart.landmarkSetHash('left', ['a', 'b'], coords + 1e-9)
+    assert key != warmstart.landmarkSetHash('right', ['a', 'b'], coords)
+    assert key != warmstart.landmarkSetHash('left', ['b', 'a'], coords)
+    assert key != warmstart.landmarkSetHash('left', ['a', 'b'], coords + 1e-3)
+
+
+@pytest.mark.parametrize('prop, value, expected', [
+    ('shapeModelX', [np.array(WEIGHTS)] + POSE, WEIGHTS),
+    ('uniformScalingX', [1.1] + POSE, [1.1]),
+    ('perBoneScalingX', [[llstep.PERBONE_SCALING_BONES, [1.1, 0.9, 1.05, 0.95]]] + POSE, [1.1, 0.9, 1.05, 0.95]),
+], ids=['shapemodel', 'uniformscaling', 'perbonescaling'])
+def test_setters_set_last_transform(lldata, prop, value, expected):
+    T = lldata.T
+    assert T.lastTransformSet is None
+    setattr(T, prop, value)
+    np.testing.assert_allclose(T.lastTransformSet, np.hstack([expected, PELVIS_RIGID, HIP_ROT, KNEE_ROT]))
+
+
+def test_transform_dict_round_trip(lldata):
+    T = lldata.T
+    T.shapeModeWeights = [0.5, -0.3]
+    T.pelvisRigid = PELVIS_RIGID
+    T.hipRot = HIP_ROT
+    T.femurScaling = 1.1
+    d = T.toDict()
+    other = llstep.LLStepData(dict(lldata.config)).T
+    other.nShapeModes = T.nShapeModes
+    other.setFromDict(d)
+    assert other.toDict() == d